@@ -0,0 +1,120 @@
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from typing import Any, Dict, List
+import os
+import asyncio
+from ..models.retrieval_service import get_retrieval_service
+from ..models.essay_analysis import EssayAnalysisSession, Sentence, analyze_sentences
+from .exercise_endpoint import get_scorer
+from .concurrency import offload
+
+router = APIRouter()
+
+# Changed sentences analyzed per worker call; results stream back after each chunk
+ANALYSIS_CHUNK = int(os.environ.get('ESSAY_ANALYSIS_CHUNK', 4))
+
+
+def _analyze(sentences: List[Sentence]) -> List[Dict[str, Any]]:
+    return analyze_sentences(get_scorer(), get_retrieval_service(), [sentence.text for sentence in sentences])
+
+
+def _knowledge_graph():
+    return get_retrieval_service().knowledge_graph_rag
+
+
+def _error(revision: int, e: Exception) -> Dict[str, Any]:
+    return {'type': 'error', 'revision': revision, 'detail': e.detail if isinstance(e, HTTPException) else str(e)}
+
+
+async def _stream_analysis(websocket: WebSocket, session: EssayAnalysisSession, changed: asyncio.Event):
+    """
+    Analyze the latest revision chunk by chunk and stream each sentence as it finishes.
+
+    A chunk already handed to the worker pool always completes and is cached,
+    but when a newer revision arrives the rest of the old one is dropped and
+    analysis restarts from what the new revision still needs. A failure is
+    sent as an ``error`` message and only ends its revision; the task itself
+    only ends when the client is gone.
+    """
+    while True:
+        await changed.wait()
+        changed.clear()
+        revision = session.revision
+        try:
+            # The first use loads the retrieval service, which must not stall the event loop
+            session.bind(await offload('analysis', _knowledge_graph))
+        except Exception as e:
+            await websocket.send_json(_error(revision, e))
+            continue
+        pending = session.pending()
+        for start in range(0, len(pending), ANALYSIS_CHUNK):
+            chunk = pending[start:start + ANALYSIS_CHUNK]
+            try:
+                results = await offload('analysis', _analyze, chunk)
+            except Exception as e:
+                await websocket.send_json(_error(revision, e))
+                break
+            for sentence, result in zip(chunk, results):
+                session.store(sentence.id, result)
+            if session.revision != revision:
+                break
+            for sentence, result in zip(chunk, results):
+                await websocket.send_json(dict(result, type='sentence', revision=revision, **sentence.to_dict()))
+        else:
+            await websocket.send_json(dict(session.summary(), type='done', revision=revision,
+                                           analyzed=len(pending), reused=len(session.sentences) - len(pending)))
+
+
+@router.websocket("/analysis/ws")
+async def analysis_session(websocket: WebSocket):
+    """
+    Live analysis of an essay while it is being written.
+
+    The client sends ``{"text": ...}`` with the whole essay or ``{"edits":
+    [{"start", "end", "text"}, ...]}`` splicing the previous revision. Every
+    message starts a revision and is answered right away with its ``segments``:
+    the sentence ids and offsets, and whether each one was already analyzed.
+    Only sentences whose text changed are then analyzed, and each is streamed
+    back as a ``sentence`` message with its detected component and examples,
+    followed by ``done`` with the component counts of the whole essay.
+    Messages of a revision that was superseded stop arriving.
+    """
+    await websocket.accept()
+    session = EssayAnalysisSession()
+    changed = asyncio.Event()
+    analysis = asyncio.create_task(_stream_analysis(websocket, session, changed))
+    try:
+        while True:
+            receive = asyncio.ensure_future(websocket.receive_json())
+            await asyncio.wait((receive, analysis), return_when=asyncio.FIRST_COMPLETED)
+            if not receive.done():
+                # Analysis only stops when sending failed, end the session instead of reading into the void
+                receive.cancel()
+                await websocket.close(code=1011)
+                break
+            try:
+                message = receive.result()
+            except ValueError as e:
+                # Malformed JSON only costs its message, the session and its analysis carry on
+                await websocket.send_json({'type': 'error', 'revision': session.revision,
+                                           'detail': f"Invalid JSON: {e}"})
+                continue
+            try:
+                revision = session.update(message.get('text'), message.get('edits'))
+            except (ValueError, TypeError, AttributeError) as e:
+                await websocket.send_json({'type': 'error', 'revision': session.revision, 'detail': str(e)})
+                continue
+            await websocket.send_json({
+                'type': 'segments',
+                'revision': revision,
+                'sentences': [dict(sentence.to_dict(), analyzed=session.result(sentence.id) is not None)
+                              for sentence in session.sentences]
+            })
+            changed.set()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        analysis.cancel()
+        try:
+            await analysis
+        except (asyncio.CancelledError, WebSocketDisconnect):
+            pass
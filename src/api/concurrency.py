@@ -0,0 +1,192 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+from fastapi import APIRouter, HTTPException
+
+try:
+    from ..models.metrics import Counter, Gauge, Histogram
+except ImportError:  # Served with src on sys.path, like neuralcdm_api
+    from models.metrics import Counter, Gauge, Histogram
+
+# Default (max concurrency, max queued requests) per endpoint class,
+# overridable with API_LIMIT_<CLASS>="concurrency:queue"
+DEFAULT_LIMITS = {
+    'retrieval': (4, 64),
+    'mastery': (4, 128),
+    'scoring': (4, 64),
+    'profile': (8, 256),
+    'analysis': (4, 64),
+    'training': (2, 32)
+}
+WAIT_SAMPLES = 1024  # Recent queue waits kept per endpoint class for percentiles
+
+
+def _parse_limit(name: str) -> Tuple[int, int]:
+    value = os.environ.get(f'API_LIMIT_{name.upper()}')
+    if not value:
+        return DEFAULT_LIMITS.get(name, (4, 64))
+    concurrency, queue = value.split(':')
+    return int(concurrency), int(queue)
+
+
+# Every endpoint class runs on worker threads of its own, one per concurrency slot;
+# NumPy, torch and SQLite release the GIL
+WORKER_THREADS = sum(_parse_limit(name)[0] for name in DEFAULT_LIMITS)
+# Intra-op threads per torch call, by default the cores are split between the workers
+TORCH_THREADS = int(os.environ.get('API_TORCH_THREADS', max(1, (os.cpu_count() or 1) // WORKER_THREADS)))
+
+WAIT_SECONDS = Histogram('api_queue_wait_seconds', "Time a request waited for a worker slot", ['endpoint_class'])
+RUN_SECONDS = Histogram('api_worker_seconds', "Time a request held a worker slot", ['endpoint_class'])
+REQUESTS = Counter('api_offloaded_requests_total', "Requests offloaded to the worker pool, by outcome",
+                   ['endpoint_class', 'result'])
+QUEUE_DEPTH = Gauge('api_queue_depth', "Requests waiting for a worker slot", ['endpoint_class'])
+RUNNING = Gauge('api_running_requests', "Requests running on the worker pool", ['endpoint_class'])
+
+router = APIRouter()
+
+
+def _init_worker():
+    # Imported in the worker so the event loop never waits on it
+    import torch
+    torch.set_num_threads(TORCH_THREADS)
+
+
+class EndpointLimiter:
+    """
+    Bounded concurrency with load shedding for one class of endpoints.
+
+    At most ``max_concurrency`` calls run at once, on a worker pool of exactly
+    that many threads owned by this class, and at most ``max_queue`` more wait
+    for a slot; anything beyond that is rejected right away with 429 so overload
+    shows up as fast failures instead of latency for every connection. Since a
+    slot always has a thread, one class can never queue behind another. The
+    event loop only awaits, it never runs the work.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._waits: deque = deque(maxlen=WAIT_SAMPLES)
+        self._run_times: deque = deque(maxlen=WAIT_SAMPLES)
+        self._wait_seconds, self._run_seconds = WAIT_SECONDS.labels(name), RUN_SECONDS.labels(name)
+        for result in ('completed', 'failed', 'rejected'):
+            REQUESTS.labels(name, result).set_function(lambda result=result: getattr(self, result))
+        QUEUE_DEPTH.labels(name).set_function(lambda: self.waiting)
+        RUNNING.labels(name).set_function(lambda: self.running)
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run ``func(*args, **kwargs)`` on the worker pool within the limits.
+
+        Raises:
+            HTTPException: 429 if the queue of this endpoint class is full
+        """
+        if self._semaphore is None:
+            # Created lazily so it binds to the serving event loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                thread_name_prefix=f'api-{self.name}', initializer=_init_worker)
+        if self.waiting >= self.max_queue and self._semaphore.locked():
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail=f"Too many {self.name} requests, retry later",
+                                headers={'Retry-After': '1'})
+
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        # Wait lasts until a worker thread actually starts the call, run time from there
+        started = None
+
+        def call():
+            nonlocal started
+            started = time.perf_counter()
+            return func(*args, **kwargs)
+
+        self.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, call)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+            if started is not None:
+                finished = time.perf_counter()
+                self._waits.append(started - queued)
+                self._wait_seconds.observe(started - queued)
+                self._run_times.append(finished - started)
+                self._run_seconds.observe(finished - started)
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """Get queue depth, counters and recent wait and run time percentiles in milliseconds."""
+        def percentiles(samples):
+            if not samples:
+                return {'p50_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+            ordered = sorted(samples)
+            return {
+                'p50_ms': ordered[len(ordered) // 2] * 1000,
+                'p99_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+                'max_ms': ordered[-1] * 1000
+            }
+
+        return {
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'queue_depth': self.waiting,
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'wait': percentiles(list(self._waits)),
+            'run': percentiles(list(self._run_times))
+        }
+
+
+_limiters: Dict[str, EndpointLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> EndpointLimiter:
+    """Return the limiter of an endpoint class, configured from the environment on first use."""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limiter = _limiters[name] = EndpointLimiter(name, *_parse_limit(name))
+    return limiter
+
+
+async def offload(name: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run CPU-bound handler work on the worker threads of an endpoint class under its limits."""
+    return await get_limiter(name).run(func, *args, **kwargs)
+
+
+@router.get("/concurrency/statistics")
+async def get_concurrency_statistics():
+    """Get per endpoint class queue depth, wait times and rejections."""
+    return {
+        'worker_threads': sum(limiter.max_concurrency for limiter in _limiters.values()),
+        'torch_threads': TORCH_THREADS,
+        'endpoints': {name: limiter.get_statistics() for name, limiter in sorted(_limiters.items())}
+    }
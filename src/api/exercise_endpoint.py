@@ -1,10 +1,62 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
-from ..models.mab_enhanced_rag import MABEnhancedRAG
+import os
+import threading
+from ..models.retrieval_service import get_retrieval_service
+from ..models.neuralcdm.service import get_neuralcdm_service
+from ..models.neuralcdm.recommender import ExerciseRecommender
+from ..models.answer_scorer import AnswerScorer, DIFFICULTY_TARGETS
+from ..models.student_records import get_student_records
+from .concurrency import offload
 
 router = APIRouter()
-mab_rag = MABEnhancedRAG()
+
+# Seconds a single answer may spend comparing against exemplars
+SCORER_LATENCY_BUDGET = float(os.environ.get('EXERCISE_SCORER_LATENCY_BUDGET', 0.05))
+# Seconds a recommendation holds its worker waiting for the trainer's first publish before 503
+RECOMMENDER_START_TIMEOUT = float(os.environ.get('EXERCISE_RECOMMENDER_START_TIMEOUT', 2.0))
+
+_recommender: Optional[ExerciseRecommender] = None
+_recommender_lock = threading.Lock()
+_scorer = (None, None)  # (KnowledgeGraphRAG the scorer was built from, AnswerScorer)
+_scorer_lock = threading.Lock()
+
+def get_recommender() -> ExerciseRecommender:
+    """
+    Return the process-wide exercise recommender, creating it on first use.
+
+    Raises:
+        TimeoutError: If no trainer published weights within ``RECOMMENDER_START_TIMEOUT``
+    """
+    global _recommender
+    if _recommender is None:
+        with _recommender_lock:
+            if _recommender is None:
+                # Never started here, so it must not win the trainer election
+                service = get_neuralcdm_service(role='reader', start_timeout=RECOMMENDER_START_TIMEOUT)
+                _recommender = ExerciseRecommender(
+                    service.inference_model,
+                    service.item_bank,
+                    lambda: get_retrieval_service().knowledge_graph_rag
+                )
+    return _recommender
+
+def get_scorer() -> AnswerScorer:
+    """Return the answer scorer, rebuilding its exemplar matrices only after a knowledge graph reload"""
+    global _scorer
+    rag = get_retrieval_service().knowledge_graph_rag
+    if _scorer[0] is not rag:
+        with _scorer_lock:
+            if _scorer[0] is not rag:
+                _scorer = (rag, AnswerScorer.from_knowledge_graph(rag.knowledge_graph,
+                                                                  latency_budget=SCORER_LATENCY_BUDGET))
+    return _scorer[1]
+
+@router.on_event("startup")
+async def build_scorer():
+    # Encode the exemplars before the first submission arrives
+    await offload('scoring', get_scorer)
 
 class ExerciseSubmission(BaseModel):
     student_id: str
@@ -18,6 +70,10 @@ class ExerciseFeedback(BaseModel):
     feedback: str
     suggestions: List[str]
     sample_answer: str
+    nearest_exemplars: List[Dict[str, Any]] = []
+
+class BatchSubmission(BaseModel):
+    submissions: List[ExerciseSubmission]
 
 @router.post("/exercises/submit", response_model=ExerciseFeedback)
 async def submit_exercise(submission: ExerciseSubmission):
@@ -30,26 +86,86 @@ async def submit_exercise(submission: ExerciseSubmission):
     Returns:
         ExerciseFeedback containing evaluation and suggestions
     """
-    try:
-        # Use RAG system to evaluate the answer
+    def submit():
         evaluation = evaluate_answer(
             submission.answer,
             submission.component_type,
             submission.difficulty
         )
+        record_submissions([submission], [evaluation])
+        return evaluation
+    
+    try:
+        evaluation = await offload('scoring', submit)
         
         return ExerciseFeedback(
             score=evaluation["score"],
             feedback=evaluation["feedback"],
             suggestions=evaluation["suggestions"],
-            sample_answer=evaluation["sample_answer"]
+            sample_answer=evaluation["sample_answer"],
+            nearest_exemplars=evaluation["nearest_exemplars"]
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/exercises/submit/batch", response_model=List[ExerciseFeedback])
+async def submit_exercises(batch: BatchSubmission):
+    """
+    Score many submissions at once, e.g. a whole class's answers to an exercise.
+    
+    Args:
+        batch: BatchSubmission containing the students' answers
+        
+    Returns:
+        ExerciseFeedback per submission, in request order
+    """
+    def submit_many():
+        evaluations = get_scorer().score_many(
+            [s.answer for s in batch.submissions],
+            [s.component_type for s in batch.submissions],
+            [s.difficulty for s in batch.submissions]
         )
+        record_submissions(batch.submissions, evaluations)
+        return evaluations
+    
+    try:
+        evaluations = await offload('scoring', submit_many)
+        
+        return [
+            ExerciseFeedback(
+                score=e["score"],
+                feedback=e["feedback"],
+                suggestions=e["suggestions"],
+                sample_answer=e["sample_answer"],
+                nearest_exemplars=e["nearest_exemplars"]
+            )
+            for e in evaluations
+        ]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def record_submissions(submissions: List[ExerciseSubmission], evaluations: List[Dict[str, Any]]):
+    """
+    Store scored submissions in the student records.
+    
+    Submissions of recommended exercises (ids like task_3) also count as attempts,
+    correct when the score meets the target of the exercise's difficulty.
+    """
+    records = get_student_records()
+    for submission, evaluation in zip(submissions, evaluations):
+        records.record_submission(submission.student_id, submission.exercise_id, submission.component_type,
+                                  submission.difficulty, submission.answer, evaluation["score"])
+        if submission.exercise_id.startswith("task_"):
+            target = DIFFICULTY_TARGETS.get(submission.difficulty, DIFFICULTY_TARGETS['intermediate'])
+            records.record_attempt(submission.student_id, submission.exercise_id, evaluation["score"] >= target)
+
 def evaluate_answer(answer: str, component_type: str, difficulty: str) -> Dict[str, Any]:
     """
-    Evaluate a student's answer using the RAG system.
+    Evaluate a student's answer against exemplars from high-band essays.
     
     Args:
         answer: The student's submitted answer
@@ -59,52 +175,33 @@ def evaluate_answer(answer: str, component_type: str, difficulty: str) -> Dict[s
     Returns:
         Dictionary containing evaluation results
     """
-    # TODO: Implement actual evaluation using RAG system
-    # This is mock evaluation for demonstration
-    evaluation = {
-        "score": 7.5,
-        "feedback": "Good attempt! Your answer shows understanding of the component, but could be strengthened with more specific examples.",
-        "suggestions": [
-            "Provide more concrete examples",
-            "Strengthen the connection between your points",
-            "Consider alternative perspectives"
-        ],
-        "sample_answer": "This is a sample answer demonstrating the expected level of response."
-    }
-    
-    return evaluation
+    return get_scorer().score(answer, component_type, difficulty)
 
 @router.get("/exercises/recommendations/{student_id}")
-async def get_exercise_recommendations(student_id: str):
+async def get_exercise_recommendations(student_id: str, top_k: int = 3):
     """
     Get personalized exercise recommendations for a student.
     
     Args:
         student_id: The ID of the student
+        top_k: Number of exercises to recommend
         
     Returns:
         List of recommended exercises
     """
     try:
-        # TODO: Implement actual recommendation logic using RAG system
-        # This is mock data for demonstration
-        recommendations = [
-            {
-                "id": "ex_1",
-                "type": "claim",
-                "difficulty": "intermediate",
-                "content": "Write a claim about the impact of technology on education",
-                "points": 20
-            },
-            {
-                "id": "ex_2",
-                "type": "data",
-                "difficulty": "advanced",
-                "content": "Provide evidence for the effectiveness of online learning",
-                "points": 30
-            }
-        ]
-        
-        return recommendations
+        user_id = int(student_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid student_id {student_id}")
+    if user_id < 0 or top_k < 0:
+        raise HTTPException(status_code=400, detail="student_id and top_k must not be negative")
+    
+    try:
+        # A reader waits for the trainer's first publish, so the recommender is created off the loop
+        return await offload('scoring', lambda: get_recommender().recommend(user_id, top_k))
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=f"{e}, retry later", headers={'Retry-After': '1'})
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import asyncio
+import hmac
+import threading
+from collections import Counter as StackCounter
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+try:
+    from ..models.metrics import REGISTRY, Histogram
+except ImportError:  # Served with src on sys.path, like neuralcdm_api
+    from models.metrics import REGISTRY, Histogram
+
+# /debug/profile is off unless API_PROFILE_ENABLED=1. Once on, it answers clients on
+# localhost, or anyone sending API_PROFILE_TOKEN in the X-Profile-Token header
+PROFILE_ENABLED = os.environ.get('API_PROFILE_ENABLED', '0') == '1'
+PROFILE_TOKEN = os.environ.get('API_PROFILE_TOKEN', '')
+LOCAL_HOSTS = ('127.0.0.1', '::1', 'localhost')
+MAX_PROFILE_SECONDS = float(os.environ.get('API_PROFILE_MAX_SECONDS', 60.0))
+MIN_PROFILE_INTERVAL = 0.001
+
+HTTP_SECONDS = Histogram('http_request_seconds', "Time to handle an HTTP request, by route template",
+                         ['method', 'route', 'status'])
+
+router = APIRouter()
+_profile_lock = threading.Lock()
+
+
+def instrument_app(app: FastAPI):
+    """Time every request of an app, labelled by route template so ids in paths do not create series."""
+    @app.middleware("http")
+    async def observe_request(request: Request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get('route')
+            HTTP_SECONDS.labels(request.method, getattr(route, 'path', 'unmatched'), status).observe(
+                time.perf_counter() - start)
+
+
+def sample_stacks(seconds: float, interval: float) -> StackCounter:
+    """
+    Sample the Python stacks of every other thread for ``seconds``.
+
+    Returns:
+        Sample counts per stack, keyed in the folded format of flamegraph.pl
+        and speedscope: "thread;outer (file:line);...;inner (file:line)"
+    """
+    own = threading.get_ident()
+    stacks: StackCounter = StackCounter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                # Keyed by function rather than current line so samples of one call merge
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            frames.append(names.get(ident, str(ident)))
+            stacks[';'.join(reversed(frames))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Get every metric of this worker in the Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+
+@router.get("/debug/profile", response_class=PlainTextResponse)
+async def profile(request: Request, seconds: float = 10.0, interval: float = 0.01):
+    """
+    Sample the stacks of this worker for a while and return them folded, ready for a flamegraph.
+
+    Sampling runs on its own thread, so the profiled handlers keep running on the
+    event loop and the worker pool. One profile runs at a time per worker. Disabled
+    unless API_PROFILE_ENABLED=1, and then limited to localhost or API_PROFILE_TOKEN.
+    """
+    if not PROFILE_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    token = request.headers.get('X-Profile-Token', '')
+    local = request.client is not None and request.client.host in LOCAL_HOSTS
+    if not local and not (PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN)):
+        raise HTTPException(status_code=403, detail="Profiling is only available from localhost or with a token")
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {MAX_PROFILE_SECONDS:g}]")
+    if not _profile_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running in this worker")
+    try:
+        stacks = await asyncio.to_thread(sample_stacks, seconds, max(interval, MIN_PROFILE_INTERVAL))
+    finally:
+        _profile_lock.release()
+    body = ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    return PlainTextResponse(body, headers={'X-Profile-Samples': str(sum(stacks.values()))})
@@ -1,89 +1,244 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-import torch
-import json
-import os
-from typing import List, Dict
-from models.neuralcdm.neuralcdm import NeuralCDM
+import asyncio
+import numpy as np
+from typing import List, Dict, Literal, Optional
+from api.concurrency import offload, router as concurrency_router
+from api.metrics_endpoint import instrument_app, router as metrics_router
 
 app = FastAPI()
+app.include_router(concurrency_router)
+app.include_router(metrics_router)
+instrument_app(app)
 
-# Load Q-matrix
-with open('src/data/qmatrix.json', 'r') as f:
-    q_matrix_data = json.load(f)
-
-# Initialize model
-model = NeuralCDM(
-    num_skills=len(q_matrix_data['skills']),
-    num_students=1000,  # Adjust based on your needs
-    num_items=len(q_matrix_data['tasks'])
-)
-
-# Load saved model if exists
-model_path = 'models/saved/neuralcdm_model.pt'
-if os.path.exists(model_path):
-    model = NeuralCDM.load_model(model_path)
+# The service (item bank, checkpoint, student store) loads in the background after startup,
+# requests arriving before it is ready get 503 and /ready reports when it is. Under several
+# workers one of them trains and the others serve the weights it publishes, see NeuralCDMService
+_service = None
+_startup: Optional[asyncio.Task] = None
+item_lock = asyncio.Lock()
 
 class AttemptLog(BaseModel):
     user_id: int
     item_id: int
-    correct: int
+    correct: Literal[0, 1]
+
+class ItemRequest(BaseModel):
+    skills: List[int]  # Q-matrix row, 1 for every skill the task exercises
+
+class ItemResponse(BaseModel):
+    item_id: int
+    name: str
+
+class PredictionRequest(BaseModel):
+    user_id: int
+    item_ids: Optional[List[int]] = None  # Defaults to every item
+
+class PredictionResponse(BaseModel):
+    item_ids: List[int]
+    probabilities: List[float]
 
 class MasteryResponse(BaseModel):
     skills: Dict[str, float]
 
+class BulkMasteryRequest(BaseModel):
+    user_ids: List[int]
+
+class BulkMasteryResponse(BaseModel):
+    skills: List[str]
+    user_ids: List[int]
+    mastery: List[List[float]]
+
+class CohortRequest(BaseModel):
+    user_ids: Optional[List[int]] = None  # Defaults to every student
+    k: int = 5
+    bins: int = 10
+
+class StudentMastery(BaseModel):
+    user_id: int
+    mastery: float
+
+class WeakestStudentsResponse(BaseModel):
+    skills: Dict[str, List[StudentMastery]]
+
+class SkillHistogramResponse(BaseModel):
+    bin_edges: List[float]
+    skills: Dict[str, List[int]]
+
+def _require_service():
+    """Return the loaded service, or reject the request while it is still starting"""
+    if _service is None:
+        raise HTTPException(status_code=503, detail="NeuralCDM service is starting, retry later",
+                            headers={'Retry-After': '1'})
+    return _service
+
+def _cohort_mastery(user_ids: Optional[List[int]]):
+    """Gather the mastery rows of a cohort, unknown users count as fresh students"""
+    if user_ids is not None and any(user_id < 0 for user_id in user_ids):
+        raise HTTPException(status_code=400, detail="Unknown user_id in cohort")
+    return _require_service().model.get_mastery_many(user_ids)
+
+def _load_service():
+    # Imported here so torch loads off the import path of the worker
+    from models.neuralcdm.service import get_neuralcdm_service
+    service = get_neuralcdm_service()
+    # Catch up on attempts journaled after the last checkpoint before serving
+    service.recover()
+    return service
+
+async def _start_service():
+    global _service
+    service = await asyncio.to_thread(_load_service)
+    await service.start()
+    _service = service
+
+@app.on_event("startup")
+async def start_trainer():
+    # The worker accepts connections right away, loading happens in the background
+    global _startup
+    _startup = asyncio.create_task(_start_service())
+
+@app.on_event("shutdown")
+async def stop_trainer():
+    if _startup is not None and not _startup.done():
+        await asyncio.wait([_startup])
+    if _service is not None:
+        await _service.stop()
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once the model is loaded and the trainer runs, 503 before"""
+    if _startup is not None and _startup.done() and _startup.exception() is not None:
+        raise HTTPException(status_code=500, detail=f"NeuralCDM service failed to start: {_startup.exception()}")
+    service = _require_service()
+    return {'status': 'ready', 'role': service.role, 'generation': service.inference_model.generation,
+            'num_items': service.inference_model.num_items, 'num_skills': service.item_bank.num_skills}
+
 @app.post("/log_attempt")
 async def log_attempt(attempt: AttemptLog):
     """Log a learner's attempt at a task"""
-    try:
-        # Convert to tensors
-        student_id = torch.tensor([attempt.user_id])
-        item_id = torch.tensor([attempt.item_id])
-        correct = torch.tensor([attempt.correct], dtype=torch.float)
-        
-        # Get Q-matrix for the item
-        q_matrix = torch.tensor([q_matrix_data['tasks'][f"task_{attempt.item_id+1}"]])
-        
-        # Forward pass to update embeddings
-        model.train()
-        prediction = model(student_id, item_id, q_matrix)
-        
-        # Calculate loss and update model
-        criterion = torch.nn.BCELoss()
-        loss = criterion(prediction, correct)
-        loss.backward()
-        
-        # Update model weights
-        optimizer = torch.optim.Adam(model.parameters())
-        optimizer.step()
-        optimizer.zero_grad()
-        
-        # Save updated model
-        model.save_model(model_path)
-        
-        return {"status": "success", "message": "Attempt logged successfully"}
+    service = _require_service()
+    num_items, trainer = service.inference_model.num_items, service.trainer
+    if not 0 <= attempt.item_id < num_items:
+        raise HTTPException(status_code=400, detail=f"Unknown item_id {attempt.item_id}")
+    if attempt.user_id < 0:
+        raise HTTPException(status_code=400, detail=f"Unknown user_id {attempt.user_id}")
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Training happens in the background trainer, the request only journals the attempt
+    if not trainer.submit(attempt.user_id, attempt.item_id, attempt.correct):
+        raise HTTPException(status_code=503, detail="Training queue is full, retry later")
+    
+    return {"status": "success", "message": "Attempt queued for training"}
+
+@app.post("/items", response_model=ItemResponse)
+async def add_item(request: ItemRequest):
+    """Publish a new task, it can be attempted right away without a restart"""
+    service = _require_service()
+    item_bank = service.item_bank
+    if len(request.skills) != item_bank.num_skills or any(v not in (0, 1) for v in request.skills):
+        raise HTTPException(status_code=400, detail=f"skills must be {item_bank.num_skills} values of 0 or 1")
+    
+    # Publishing is serialized (across workers by the service) so item ids of the bank and the model stay aligned
+    async with item_lock:
+        try:
+            item_id = await offload('training', service.add_item, request.skills)
+        except TimeoutError as e:
+            # The task is saved to the bank and the trainer still adds it, posting it again would duplicate it
+            raise HTTPException(status_code=503, detail=f"{e}; it is saved and will be served once published")
+    return ItemResponse(item_id=item_id, name=item_bank.names[item_id])
+
+@app.post("/predict", response_model=PredictionResponse)
+async def predict(request: PredictionRequest):
+    """Predict the probability that a user answers each item correctly"""
+    inference_model = _require_service().inference_model
+    num_items = inference_model.num_items
+    item_ids = list(range(num_items)) if request.item_ids is None else request.item_ids
+    if any(not 0 <= item_id < num_items for item_id in item_ids):
+        raise HTTPException(status_code=400, detail="Unknown item_id")
+    if request.user_id < 0:
+        raise HTTPException(status_code=400, detail=f"Unknown user_id {request.user_id}")
+    
+    probabilities = await offload('mastery', inference_model.predict, [request.user_id] * len(item_ids), item_ids)
+    return PredictionResponse(item_ids=item_ids, probabilities=probabilities.tolist())
+
+@app.get("/trainer/statistics")
+async def get_trainer_statistics():
+    """Get queue depth and progress of the trainer, as seen from this worker"""
+    return _require_service().trainer.get_statistics()
 
 @app.get("/get_mastery/{user_id}", response_model=MasteryResponse)
 async def get_mastery(user_id: int):
     """Get a user's mastery scores for all Toulmin skills"""
+    service = _require_service()
+    model, skill_names = service.model, service.item_bank.skill_names
     try:
         # Get mastery scores
-        mastery_scores = model.get_mastery(user_id)
+        mastery_scores = await offload('mastery', model.get_mastery, user_id)
         
         # Convert to dictionary with skill names
         mastery_dict = {
-            skill_name: float(mastery_scores[int(skill_id)])
-            for skill_id, skill_name in q_matrix_data['skills'].items()
+            skill_name: float(mastery_scores[skill_id])
+            for skill_id, skill_name in enumerate(skill_names)
         }
         
         return MasteryResponse(skills=mastery_dict)
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/get_mastery/bulk", response_model=BulkMasteryResponse)
+async def get_bulk_mastery(request: BulkMasteryRequest):
+    """Get the mastery scores of many users in one request, e.g. for a class dashboard"""
+    skill_names = _require_service().item_bank.skill_names
+    ids, mastery = await offload('mastery', _cohort_mastery, request.user_ids)
+    return BulkMasteryResponse(skills=skill_names, user_ids=ids.tolist(), mastery=mastery.tolist())
+
+@app.post("/cohort/weakest", response_model=WeakestStudentsResponse)
+async def get_weakest_students(request: CohortRequest):
+    """Get the k students of a cohort with the lowest mastery of each Toulmin skill"""
+    skill_names = _require_service().item_bank.skill_names
+    
+    def weakest_students():
+        ids, mastery = _cohort_mastery(request.user_ids)
+        k = max(0, min(request.k, len(ids)))
+        if k == 0:
+            return ids, mastery, np.empty((0, len(skill_names)), dtype=np.int64)
+        # Partial sort of every skill column at once, then order the k survivors
+        weakest = np.argpartition(mastery, k - 1, axis=0)[:k]
+        weakest = np.take_along_axis(weakest, np.argsort(np.take_along_axis(mastery, weakest, axis=0), axis=0), axis=0)
+        return ids, mastery, weakest
+    
+    ids, mastery, weakest = await offload('mastery', weakest_students)
+    return WeakestStudentsResponse(skills={
+        name: [
+            StudentMastery(user_id=int(ids[row]), mastery=float(mastery[row, skill]))
+            for row in weakest[:, skill]
+        ]
+        for skill, name in enumerate(skill_names)
+    })
+
+@app.post("/cohort/histogram", response_model=SkillHistogramResponse)
+async def get_skill_histogram(request: CohortRequest):
+    """Get a histogram of mastery levels per Toulmin skill for a cohort"""
+    skill_names = _require_service().item_bank.skill_names
+    bins = max(1, request.bins)
+    
+    def skill_histogram():
+        _, mastery = _cohort_mastery(request.user_ids)
+        # One bincount over all skills by offsetting each skill's bin indices
+        bin_index = np.minimum((mastery * bins).astype(np.int64), bins - 1)
+        offsets = np.arange(len(skill_names)) * bins
+        counts = np.bincount((bin_index + offsets).ravel(), minlength=len(skill_names) * bins)
+        return counts.reshape(len(skill_names), bins)
+    
+    counts = await offload('mastery', skill_histogram)
+    return SkillHistogramResponse(
+        bin_edges=np.linspace(0.0, 1.0, bins + 1).tolist(),
+        skills={name: counts[skill].tolist() for skill, name in enumerate(skill_names)}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -1,10 +1,15 @@
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
-from ..models.mab_enhanced_rag import MABEnhancedRAG
+import os
+import asyncio
+from ..models.retrieval_service import get_retrieval_service, warm_retrieval_service, is_retrieval_service_ready
+from .concurrency import offload
 
 router = APIRouter()
-mab_rag = MABEnhancedRAG()
+
+# Queries per /retrieve/batch request, larger batches are rejected with 422
+MAX_BATCH_QUERIES = int(os.environ.get('RETRIEVAL_MAX_BATCH_QUERIES', 256))
 
 class QueryRequest(BaseModel):
     query: str
@@ -15,6 +20,75 @@ class QueryResponse(BaseModel):
     selected_arm: int
     arm_statistics: Dict[str, Any]
 
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest] = Field(..., max_length=MAX_BATCH_QUERIES)
+
+class BatchQueryResult(BaseModel):
+    results: List[Dict[str, Any]]
+    selected_arm: int
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResult]
+    arm_statistics: Dict[str, Any]
+
+class RelatedExamplesRequest(BaseModel):
+    text: str
+    target_type: str = 'rebuttal'
+    via_type: Optional[str] = 'claim'
+    top_k: int = 5
+
+class RelatedExamplesResponse(BaseModel):
+    results: List[Dict[str, Any]]
+
+class ReloadResponse(BaseModel):
+    snapshot_version: Optional[str]
+    essays: int
+
+_warmup: Optional[asyncio.Task] = None
+
+@router.on_event("startup")
+async def warm_retrieval():
+    # Serve right away and warm in the background, /retrieval/ready reports when the indexes are warm
+    global _warmup
+    _warmup = asyncio.create_task(asyncio.to_thread(warm_retrieval_service))
+
+@router.get("/retrieval/ready")
+async def retrieval_ready():
+    """Readiness probe: 200 once the knowledge graph is open and its indexes are warm, 503 before."""
+    if not is_retrieval_service_ready():
+        raise HTTPException(status_code=503, detail="Retrieval indexes are warming up")
+    
+    def ready():
+        mab_rag = get_retrieval_service()
+        return {
+            'status': 'ready',
+            'snapshot_version': mab_rag.get_snapshot_version(),
+            'essays': len(mab_rag.knowledge_graph_rag.knowledge_graph['essays'])
+        }
+    
+    return await offload('retrieval', ready)
+
+@router.post("/knowledge_graph/reload", response_model=ReloadResponse)
+async def reload_knowledge_graph():
+    """
+    Recompile the knowledge graph and swap it in without downtime.
+    
+    Requests already running finish on the old snapshot; other workers pick up
+    the new version within a few seconds.
+    """
+    def reload():
+        mab_rag = get_retrieval_service()
+        mab_rag.reload_knowledge_graph()
+        return mab_rag.get_snapshot_version(), len(mab_rag.knowledge_graph_rag.knowledge_graph['essays'])
+    
+    try:
+        version, essays = await offload('training', reload)
+        return ReloadResponse(snapshot_version=version, essays=essays)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/retrieve", response_model=QueryResponse)
 async def retrieve_essays(request: QueryRequest):
     """
@@ -26,15 +100,79 @@ async def retrieve_essays(request: QueryRequest):
     Returns:
         QueryResponse containing the retrieved essays and MAB statistics
     """
+    def retrieve():
+        mab_rag = get_retrieval_service()
+        results, selected_arm = mab_rag.retrieve(request.query, request.component_type)
+        return results, selected_arm, mab_rag.get_arm_statistics()
+    
     try:
-        results, selected_arm = mab_rag.retrieve(request.query)
-        arm_stats = mab_rag.get_arm_statistics()
+        results, selected_arm, arm_stats = await offload('retrieval', retrieve)
         
         return QueryResponse(
             results=results,
             selected_arm=selected_arm,
             arm_statistics=arm_stats
         )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/retrieve/batch", response_model=BatchQueryResponse)
+async def retrieve_essays_batch(request: BatchQueryRequest):
+    """
+    Retrieve relevant essays for many queries in a single pass.
+    
+    Args:
+        request: BatchQueryRequest containing the queries and their optional component types
+        
+    Returns:
+        BatchQueryResponse containing the retrieved essays per query and MAB statistics
+    """
+    def retrieve_many():
+        mab_rag = get_retrieval_service()
+        batch = mab_rag.retrieve_many(
+            [query.query for query in request.queries],
+            [query.component_type for query in request.queries]
+        )
+        return batch, mab_rag.get_arm_statistics()
+    
+    try:
+        batch, arm_stats = await offload('retrieval', retrieve_many)
+        
+        return BatchQueryResponse(
+            results=[BatchQueryResult(results=results, selected_arm=arm) for results, arm in batch],
+            arm_statistics=arm_stats
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/related_examples", response_model=RelatedExamplesResponse)
+async def related_examples(request: RelatedExamplesRequest):
+    """
+    Find components of essays that share concepts with a text, e.g. rebuttals for a claim.
+    
+    Args:
+        request: RelatedExamplesRequest containing the text, the component type to
+            return and the component type that must share the concepts
+        
+    Returns:
+        RelatedExamplesResponse containing the examples, most related first
+    """
+    if not 0 < request.top_k <= 100:
+        raise HTTPException(status_code=400, detail="top_k must be in [1, 100]")
+    
+    def related():
+        return get_retrieval_service().knowledge_graph_rag.get_related_examples(
+            request.text, request.target_type, request.via_type, request.top_k
+        )
+    
+    try:
+        return RelatedExamplesResponse(results=await offload('retrieval', related))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -42,6 +180,8 @@ async def retrieve_essays(request: QueryRequest):
 async def get_statistics():
     """Get current MAB statistics."""
     try:
-        return mab_rag.get_arm_statistics()
+        return await offload('retrieval', lambda: get_retrieval_service().get_arm_statistics())
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -1,11 +1,11 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import List, Dict, Any
-from datetime import datetime, timedelta
-from ..models.mab_enhanced_rag import MABEnhancedRAG
+from typing import List, Dict, Any, Optional
+from ..models.student_records import get_student_records
+from ..models.answer_scorer import COMPONENT_SUGGESTIONS
+from .concurrency import offload
 
 router = APIRouter()
-mab_rag = MABEnhancedRAG()
 
 class StudentResponse(BaseModel):
     studentId: str
@@ -13,113 +13,102 @@ class StudentResponse(BaseModel):
     essays: List[Dict[str, Any]]
     statistics: Dict[str, Any]
 
+class EssayRecord(BaseModel):
+    topic: str
+    bandScore: float
+    components: Dict[str, Any]
+    componentScores: Optional[Dict[str, float]] = None
+
+def _level(value: float, thresholds: List[float], labels: List[str]) -> str:
+    for threshold, label in zip(thresholds, labels):
+        if value >= threshold:
+            return label
+    return labels[-1]
+
+def build_statistics(rollup: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turn a student's rollup into the statistics shown on the profile page.
+
+    Only reads the rollup, its cost does not depend on the length of the history.
+    """
+    component_scores = {
+        component: total / count
+        for component, (total, count) in rollup['components'].items() if count
+    }
+    ranked = sorted(component_scores, key=component_scores.get)
+    style = rollup['style']
+    words_per_sentence = style['words'] / style['sentences'] if style['sentences'] else 0.0
+    long_word_ratio = style['long_words'] / style['words'] if style['words'] else 0.0
+    average_band = rollup['band_sum'] / rollup['essay_count'] if rollup['essay_count'] else 0.0
+
+    return {
+        "averageBandScore": round(average_band, 2),
+        "strongestComponent": ranked[-1].capitalize() if ranked else None,
+        "weakestComponent": ranked[0].capitalize() if ranked else None,
+        "totalEssays": rollup['essay_count'],
+        "totalSubmissions": rollup['submission_count'],
+        "totalAttempts": rollup['attempt_count'],
+        "attemptAccuracy": rollup['attempt_correct'] / rollup['attempt_count'] if rollup['attempt_count'] else None,
+        "componentScores": {component: round(score, 2) for component, score in component_scores.items()},
+        "progressData": [
+            {"date": day, "score": round(total / count, 2)}
+            for day, (total, count) in sorted(rollup['progress'].items())
+        ],
+        "writingStyle": {
+            "vocabularyLevel": _level(long_word_ratio, [0.25, 0.15], ["Advanced", "Intermediate", "Basic"]),
+            "sentenceComplexity": _level(words_per_sentence, [20, 12], ["High", "Medium", "Low"]),
+            "coherenceScore": round(sum(component_scores.values()) / len(component_scores), 2)
+                              if component_scores else round(average_band, 2),
+            "commonPatterns": []
+        },
+        "recommendations": [
+            {
+                "component": component.capitalize(),
+                "suggestion": COMPONENT_SUGGESTIONS.get(component, f"Practise writing the {component}"),
+                "priority": priority
+            }
+            for component, priority in zip(ranked, ["high", "medium", "low"])
+        ]
+    }
+
 @router.get("/students/{student_id}", response_model=StudentResponse)
 async def get_student_profile(student_id: str):
     """
     Get student profile with their essay history and statistics.
-    
+
     Args:
         student_id: The ID of the student
-        
+
     Returns:
         StudentResponse containing student profile data
     """
     try:
-        # Generate mock progress data
-        start_date = datetime.now() - timedelta(days=30)
-        progress_data = [
-            {
-                "date": (start_date + timedelta(days=i)).strftime("%Y-%m-%d"),
-                "score": 6.5 + (i * 0.1)  # Simulated progress
-            }
-            for i in range(31)
-        ]
-
-        # Mock student data with enhanced features
-        student_data = {
-            "studentId": student_id,
-            "name": f"Student {student_id}",
-            "essays": [
-                {
-                    "id": "essay_1",
-                    "topic": "Parents vs School Teaching Children",
-                    "bandScore": 8.0,
-                    "date": "2024-03-15",
-                    "components": {
-                        "claim": "Family upbringing plays a more important role in educating children",
-                        "data": [
-                            "Schools have standardized educational methods",
-                            "Average class size in Vietnam is 20 students"
-                        ],
-                        "warrant": "One-to-one lessons at home allow children to progress faster",
-                        "backing": "Example of bedtime stories instilling compassion",
-                        "rebuttal": "Schools can foster cognitive development",
-                        "qualifier": "School success stories represent only a small fraction"
-                    }
-                },
-                {
-                    "id": "essay_2",
-                    "topic": "Technology in Education",
-                    "bandScore": 7.5,
-                    "date": "2024-03-10",
-                    "components": {
-                        "claim": "Technology enhances learning outcomes when properly integrated",
-                        "data": [
-                            "Interactive learning platforms increase engagement",
-                            "Digital tools provide immediate feedback"
-                        ],
-                        "warrant": "Technology enables personalized learning experiences",
-                        "backing": "Studies show 30% improvement in retention rates",
-                        "rebuttal": "Over-reliance on technology may reduce critical thinking",
-                        "qualifier": "Technology should complement, not replace, traditional methods"
-                    }
-                }
-            ],
-            "statistics": {
-                "averageBandScore": 7.75,
-                "strongestComponent": "Claim",
-                "weakestComponent": "Rebuttal",
-                "totalEssays": 5,
-                "componentScores": {
-                    "claim": 8.5,
-                    "data": 7.8,
-                    "warrant": 7.5,
-                    "backing": 7.2,
-                    "rebuttal": 6.8,
-                    "qualifier": 7.0
-                },
-                "progressData": progress_data,
-                "writingStyle": {
-                    "vocabularyLevel": "Advanced",
-                    "sentenceComplexity": "High",
-                    "coherenceScore": 8.2,
-                    "commonPatterns": [
-                        "Clear topic sentences",
-                        "Effective transitions",
-                        "Strong supporting evidence",
-                        "Balanced arguments"
-                    ]
-                },
-                "recommendations": [
-                    {
-                        "component": "Rebuttal",
-                        "suggestion": "Strengthen counter-arguments by providing more specific examples and evidence",
-                        "priority": "high"
-                    },
-                    {
-                        "component": "Backing",
-                        "suggestion": "Include more academic sources and research to support your arguments",
-                        "priority": "medium"
-                    },
-                    {
-                        "component": "Qualifier",
-                        "suggestion": "Add more nuanced qualifiers to make your arguments more balanced",
-                        "priority": "low"
-                    }
-                ]
-            }
-        }
-        
-        return StudentResponse(**student_data)
+        rollup = await offload('profile', get_student_records().get_rollup, student_id)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+    if rollup is None:
+        raise HTTPException(status_code=404, detail=f"Unknown student {student_id}")
+
+    return StudentResponse(
+        studentId=student_id,
+        name=rollup['name'] or f"Student {student_id}",
+        essays=rollup['recent_essays'],
+        statistics=build_statistics(rollup)
+    )
+
+@router.get("/students/{student_id}/essays")
+async def get_student_essays(student_id: str, limit: int = 50, offset: int = 0):
+    """Page through a student's full essay history, newest first"""
+    return await offload('profile', get_student_records().list_essays,
+                         student_id, max(1, min(limit, 500)), max(0, offset))
+
+@router.post("/students/{student_id}/essays")
+async def record_student_essay(student_id: str, essay: EssayRecord):
+    """Store a graded essay and update the student's statistics"""
+    essay_id = await offload(
+        'profile', get_student_records().record_essay,
+        student_id, essay.topic, essay.bandScore, essay.components, essay.componentScores
+    )
+    return {"status": "success", "id": f"essay_{essay_id}"}
@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import itertools
+import numpy as np
+from pathlib import Path
+from typing import Any, Callable, Dict
+from .harness import time_calls, summarize
+from .synthetic import (generate_knowledge_graph, write_knowledge_graph, generate_queries,
+                        generate_q_matrix, generate_attempts)
+
+NEURALCDM_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'neuralcdm')
+
+
+def load_training_module():
+    """Import train_neuralcdm, a script that imports its sibling modules as top-level modules"""
+    if NEURALCDM_DIR not in sys.path:
+        sys.path.insert(0, NEURALCDM_DIR)
+    import train_neuralcdm
+    return train_neuralcdm
+
+
+def _paths(workdir: str) -> Dict[str, str]:
+    return {
+        'knowledge_graph': os.path.join(workdir, 'knowledge_graph.json'),
+        'queries': os.path.join(workdir, 'queries.json'),
+        'embeddings': os.path.join(workdir, 'embeddings'),
+        'snapshots': os.path.join(workdir, 'snapshots'),
+        'q_matrix': os.path.join(workdir, 'q_matrix.npy'),
+        'attempts': os.path.join(workdir, 'attempts')
+    }
+
+
+def prepare(config: Dict[str, Any], workdir: str, corpus: bool = True, attempts: bool = True) -> Dict[str, float]:
+    """
+    Generate the synthetic inputs the cases share into ``workdir``.
+
+    Returns:
+        Seconds spent generating each input
+    """
+    paths = _paths(workdir)
+    timings = {}
+    if corpus:
+        start = time.perf_counter()
+        knowledge_graph = generate_knowledge_graph(config['essays'], seed=config['seed'])
+        write_knowledge_graph(knowledge_graph, paths['knowledge_graph'])
+        with open(paths['queries'], 'w', encoding='utf-8') as f:
+            json.dump(generate_queries(knowledge_graph, config['queries'], seed=config['seed']), f)
+        timings['knowledge_graph'] = time.perf_counter() - start
+    if attempts:
+        start = time.perf_counter()
+        q_matrix = generate_q_matrix(config['items'], config['skills'], seed=config['seed'])
+        np.save(paths['q_matrix'], q_matrix)
+        load_training_module().write_attempt_shards(
+            generate_attempts(config['attempts'], config['students'], q_matrix, seed=config['seed']),
+            paths['attempts']
+        )
+        timings['attempts'] = time.perf_counter() - start
+    return timings
+
+
+def _queries(workdir: str) -> Callable[[], str]:
+    with open(_paths(workdir)['queries'], 'r', encoding='utf-8') as f:
+        return itertools.cycle(json.load(f)).__next__
+
+
+def bench_knowledge_graph_rag(config: Dict[str, Any], workdir: str) -> Dict[str, Any]:
+    """Index build and the search methods of KnowledgeGraphRAG"""
+    from ..models.knowledge_graph_rag import KnowledgeGraphRAG
+    from ..models.graph_snapshot import GraphSnapshot
+    paths = _paths(workdir)
+    start = time.perf_counter()
+    rag = KnowledgeGraphRAG(paths['knowledge_graph'], paths['embeddings'])
+    build = time.perf_counter() - start
+    # A second instance finds the dense index on disk and only maps it
+    start = time.perf_counter()
+    KnowledgeGraphRAG(paths['knowledge_graph'], paths['embeddings'])
+    reopen = time.perf_counter() - start
+    # Compiling a snapshot once, then the cold start of a worker opening it
+    start = time.perf_counter()
+    GraphSnapshot.build(Path(paths['knowledge_graph']), paths['snapshots'])
+    snapshot_build = time.perf_counter() - start
+    start = time.perf_counter()
+    snapshot_rag = KnowledgeGraphRAG.open(paths['knowledge_graph'], paths['embeddings'], paths['snapshots'])
+    snapshot_open = time.perf_counter() - start
+
+    query, iterations = _queries(workdir), config['iterations']
+    return {
+        'build': {'seconds': build},
+        'reopen': {'seconds': reopen},
+        'snapshot_build': {'seconds': snapshot_build},
+        'snapshot_open': {'seconds': snapshot_open},
+        'snapshot_rank_essays': summarize(time_calls(lambda: snapshot_rag.rank_essays(query()), iterations)),
+        'rank_essays': summarize(time_calls(lambda: rag.rank_essays(query()), iterations)),
+        'rank_essays_claim': summarize(time_calls(lambda: rag.rank_essays(query(), 'claim'), iterations)),
+        'semantic_search': summarize(time_calls(lambda: rag.semantic_search(query()), iterations)),
+        'get_relevant_essays': summarize(time_calls(lambda: rag.get_relevant_essays(query()), iterations))
+    }
+
+
+def bench_mab_retrieve(config: Dict[str, Any], workdir: str) -> Dict[str, Any]:
+    """Routed retrieval of MABEnhancedRAG, without a result cache so every call runs an arm"""
+    from ..models.mab_enhanced_rag import MABEnhancedRAG
+    paths = _paths(workdir)
+    rag = MABEnhancedRAG(paths['knowledge_graph'], embedding_dir=paths['embeddings'])
+    query, iterations, batch_size = _queries(workdir), config['iterations'], config['batch_size']
+    return {
+        'retrieve': summarize(time_calls(lambda: rag.retrieve(query()), iterations)),
+        'retrieve_many': summarize(
+            time_calls(lambda: rag.retrieve_many([query() for _ in range(batch_size)]),
+                       max(1, iterations // 10), warmup=2),
+            items_per_call=batch_size
+        ),
+        'arm_counts': {'counts': rag.get_arm_statistics()['arm_counts']}
+    }
+
+
+def bench_log_attempt(config: Dict[str, Any], workdir: str) -> Dict[str, Any]:
+    """
+    The /log_attempt path: journal append and queueing in the request, and the
+    sustained rate at which the background trainer consumes attempts.
+    """
+    import torch
+    from ..models.neuralcdm.neuralcdm import NeuralCDM
+    from ..models.neuralcdm.student_store import StudentStore
+    from ..models.neuralcdm.attempt_journal import AttemptJournal
+    from ..models.neuralcdm.online_trainer import OnlineTrainer
+    from ..models.neuralcdm import service
+    train = load_training_module()
+    paths = _paths(workdir)
+    q_matrix = torch.from_numpy(np.load(paths['q_matrix']))
+    online = os.path.join(workdir, 'online')
+    store = StudentStore(os.path.join(online, 'students'), num_skills=q_matrix.shape[1])
+    model = NeuralCDM(q_matrix.shape[1], None, len(q_matrix), student_store=store, q_matrix=q_matrix)
+    trainer = OnlineTrainer(
+        model, os.path.join(online, 'neuralcdm_model.pt'),
+        batch_size=service.TRAIN_BATCH_SIZE,
+        flush_interval=service.TRAIN_FLUSH_INTERVAL,
+        max_queue_size=service.TRAIN_QUEUE_SIZE,
+        checkpoint_interval=service.CHECKPOINT_INTERVAL,
+        journal=AttemptJournal(os.path.join(online, 'attempts.journal'), service.JOURNAL_FSYNC_INTERVAL)
+    )
+
+    # Replay the head of the attempt stream, only the shards it covers are read
+    chunks, remaining = [], config['online_attempts']
+    for path in train.find_attempt_files([paths['attempts']]):
+        if remaining <= 0:
+            break
+        chunks.append(np.array(train.open_attempts(path)[:remaining]))
+        remaining -= len(chunks[-1])
+    attempts = np.concatenate(chunks)
+
+    async def run():
+        await trainer.start()
+        latencies, rejected = np.empty(len(attempts)), 0
+        start = time.perf_counter()
+        for i, (user_id, item_id, correct) in enumerate(zip(attempts['user_id'].tolist(),
+                                                            attempts['item_id'].tolist(),
+                                                            attempts['correct'].tolist())):
+            while True:
+                call = time.perf_counter()
+                if trainer.submit(user_id, item_id, correct):
+                    latencies[i] = time.perf_counter() - call
+                    break
+                # Backpressure, a client would retry after the 503
+                rejected += 1
+                await asyncio.sleep(0.001)
+            if i % 256 == 255:
+                await asyncio.sleep(0)
+        while trainer.trained_attempts < len(attempts):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        await trainer.stop()
+        trainer.journal.close()
+        return latencies, rejected, elapsed
+
+    latencies, rejected, elapsed = asyncio.run(run())
+    return {
+        'submit': summarize(latencies),
+        'training': {
+            'seconds': elapsed,
+            'throughput_per_second': len(attempts) / elapsed,
+            'rejected': rejected,
+            'steps': trainer.steps
+        }
+    }
+
+
+def bench_get_mastery(config: Dict[str, Any], workdir: str) -> Dict[str, Any]:
+    """Single and cohort mastery reads from a StudentStore holding every student"""
+    import torch
+    from ..models.neuralcdm.neuralcdm import NeuralCDM
+    from ..models.neuralcdm.student_store import StudentStore
+    num_students, num_skills = config['students'], config['skills']
+    store = StudentStore(os.path.join(workdir, 'mastery', 'students'), num_skills=num_skills)
+    start = time.perf_counter()
+    for first in range(0, num_students, 1 << 16):
+        store.rows(np.arange(first, min(first + (1 << 16), num_students)), create=True)
+    populate = time.perf_counter() - start
+    model = NeuralCDM(num_skills, None, config['items'], student_store=store,
+                      q_matrix=torch.ones(config['items'], num_skills))
+
+    rng = np.random.default_rng(config['seed'])
+    user_id = lambda: int(rng.integers(0, num_students))
+    batch_size, iterations = config['batch_size'], config['iterations']
+    return {
+        'populate': {'seconds': populate, 'throughput_per_second': num_students / populate},
+        'get_mastery': summarize(time_calls(lambda: model.get_mastery(user_id()), iterations)),
+        'get_mastery_many': summarize(
+            time_calls(lambda: model.get_mastery_many(rng.integers(0, num_students, batch_size)), iterations),
+            items_per_call=batch_size
+        )
+    }
+
+
+def bench_train_neuralcdm(config: Dict[str, Any], workdir: str) -> Dict[str, Any]:
+    """Offline streaming training of train_neuralcdm over the attempt shards"""
+    import torch
+    train = load_training_module()
+    paths = _paths(workdir)
+    q_matrix = torch.from_numpy(np.load(paths['q_matrix']))
+    model = train.NeuralCDM(q_matrix.shape[1], config['students'], len(q_matrix), q_matrix=q_matrix)
+    history = train.train_streaming(
+        model, train.find_attempt_files([paths['attempts']]), num_epochs=config['epochs'],
+        batch_size=config['train_batch_size'], num_workers=config['train_workers'],
+        patience=config['epochs'], seed=config['seed']
+    )
+    seconds = sum(epoch['seconds'] for epoch in history)
+    return {
+        'epoch': {
+            'seconds': seconds / len(history),
+            'throughput_per_second': sum(epoch['samples'] for epoch in history) / seconds
+        },
+        'quality': {'valid_accuracy': history[-1]['valid_accuracy'], 'valid_loss': history[-1]['valid_loss']}
+    }
+
+
+# Case name -> (function, needs the corpus, needs the attempt stream)
+CASES = {
+    'knowledge_graph_rag': (bench_knowledge_graph_rag, True, False),
+    'mab_retrieve': (bench_mab_retrieve, True, False),
+    'log_attempt': (bench_log_attempt, False, True),
+    'get_mastery': (bench_get_mastery, False, False),
+    'train_neuralcdm': (bench_train_neuralcdm, False, True)
+}
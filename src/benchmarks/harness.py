@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import platform
+import multiprocessing
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Metrics compared against a baseline with the smallest difference that counts; below it a change
+# is timer or scheduler noise. Percentiles are used rather than means, one stall moves a mean.
+REGRESSION_METRICS = {
+    'p50_ms': 0.05,
+    'p90_ms': 0.05,
+    'seconds': 0.1  # One-off paths: index builds, training epochs
+}
+
+
+def time_calls(call: Callable[[], Any], iterations: int, warmup: int = 10) -> np.ndarray:
+    """Run a call repeatedly and return per-call latencies in seconds"""
+    for _ in range(warmup):
+        call()
+    latencies = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter()
+        call()
+        latencies[i] = time.perf_counter() - start
+    return latencies
+
+
+def summarize(latencies: np.ndarray, items_per_call: int = 1) -> Dict[str, float]:
+    """Latency percentiles in milliseconds and items per second of a series of calls"""
+    return {
+        'calls': int(len(latencies)),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p90_ms': float(np.percentile(latencies, 90) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'max_ms': float(latencies.max() * 1000),
+        'throughput_per_second': float(items_per_call * len(latencies) / latencies.sum())
+    }
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MiB, None where it cannot be read"""
+    try:
+        # ru_maxrss survives exec on Linux, so a spawned child would report its parent's peak;
+        # VmHWM belongs to the address space of the running program only
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def environment() -> Dict[str, Any]:
+    """Describe the machine and library versions results were recorded with"""
+    import torch
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'torch': torch.__version__,
+        'torch_threads': torch.get_num_threads()
+    }
+
+
+def _run_case(case: Callable[..., Dict[str, Any]], args: tuple, results):
+    start = time.perf_counter()
+    try:
+        metrics = case(*args)
+        results.put({
+            'seconds': time.perf_counter() - start,
+            'peak_rss_mb': peak_rss_mb(),
+            'metrics': metrics
+        })
+    except BaseException as e:
+        results.put({'error': f"{type(e).__name__}: {e}"})
+        raise
+
+
+def run_isolated(case: Callable[..., Dict[str, Any]], *args) -> Dict[str, Any]:
+    """
+    Run a benchmark case in a fresh process.
+
+    A new process per case keeps the peak RSS of one hot path from leaking into
+    the next and leaves no warm caches behind.
+
+    Returns:
+        Wall-clock seconds, peak RSS and the metrics returned by the case, or
+        'error' if it failed
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_case, args=(case, args, results))
+    process.start()
+    # Read before joining, a full pipe would otherwise block the child from exiting
+    result = results.get()
+    process.join()
+    return result
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """
+    Find the paths that got slower than the baseline by more than ``max_regression`` percent.
+
+    Returns:
+        One message per regressed metric, empty if every path is within the threshold
+    """
+    regressions = []
+    for case, result in results['cases'].items():
+        reference = baseline['cases'].get(case)
+        if reference is None or 'error' in reference or 'error' in result:
+            continue
+        for path, metrics in result['metrics'].items():
+            for metric, floor in REGRESSION_METRICS.items():
+                old = reference['metrics'].get(path, {}).get(metric)
+                new = metrics.get(metric)
+                if old is None or new is None or old <= 0 or new - old < floor:
+                    continue
+                change = (new - old) / old * 100
+                if change > max_regression:
+                    regressions.append(f"{case}/{path} {metric}: {old:.4g} -> {new:.4g} "
+                                       f"({change:.1f}% slower, limit {max_regression:g}%)")
+    return regressions
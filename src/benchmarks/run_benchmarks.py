@@ -0,0 +1,111 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+from typing import Any, Dict
+from .cases import CASES, prepare
+from .harness import run_isolated, compare, environment
+
+# Corpus and attempt stream sizes of each scale, individual sizes can be overridden
+SCALES = {
+    'small': {'essays': 1000, 'attempts': 10000, 'students': 1000, 'items': 100},
+    'medium': {'essays': 10000, 'attempts': 1000000, 'students': 100000, 'items': 1000},
+    'large': {'essays': 100000, 'attempts': 10000000, 'students': 1000000, 'items': 5000}
+}
+# Settings that have to match for results to be comparable
+COMPARABLE_KEYS = ['essays', 'attempts', 'students', 'items', 'skills', 'queries', 'iterations',
+                   'batch_size', 'online_attempts', 'epochs', 'train_batch_size', 'train_workers', 'seed']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the retrieval and NeuralCDM hot paths "
+                                                 "on synthetic data")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--essays', type=int, help="Essays in the synthetic knowledge graph")
+    parser.add_argument('--attempts', type=int, help="Attempts in the synthetic attempt stream")
+    parser.add_argument('--students', type=int, help="Distinct students in the attempt stream")
+    parser.add_argument('--items', type=int, help="Items in the synthetic Q-matrix")
+    parser.add_argument('--skills', type=int, default=6)
+    parser.add_argument('--queries', type=int, default=1000, help="Distinct queries sampled from the corpus")
+    parser.add_argument('--iterations', type=int, default=200, help="Timed calls per path")
+    parser.add_argument('--batch-size', type=int, default=64, help="Batch size of the batched read paths")
+    parser.add_argument('--online-attempts', type=int, default=50000,
+                        help="Attempts replayed through the online trainer")
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--train-batch-size', type=int, default=4096)
+    parser.add_argument('--train-workers', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=list(CASES))
+    parser.add_argument('--workdir', help="Directory for the generated data, a temporary one is used by default")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', help="Results JSON of an earlier run to check for regressions")
+    parser.add_argument('--max-regression', type=float, default=10.0,
+                        help="Percentage by which a path may be slower than the baseline")
+    return parser.parse_args()
+
+
+def print_results(results: Dict[str, Any]):
+    print(f"\n{'path':<42}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'per second':>14}{'seconds':>10}")
+    for case, result in results['cases'].items():
+        if 'error' in result:
+            print(f"{case:<42} failed: {result['error']}")
+            continue
+        for path, metrics in result['metrics'].items():
+            def column(metric, width, fmt):
+                return f"{metrics[metric]:>{width}{fmt}}" if metric in metrics else ' ' * width
+            print(f"{case + '/' + path:<42}{column('p50_ms', 10, '.3f')}{column('p90_ms', 10, '.3f')}"
+                  f"{column('p99_ms', 10, '.3f')}{column('throughput_per_second', 14, ',.0f')}"
+                  f"{column('seconds', 10, '.2f')}")
+        rss = result['peak_rss_mb']
+        print(f"{case + ' peak RSS':<42}{'' if rss is None else f'{rss:,.0f} MiB':>54}")
+
+
+def main():
+    args = parse_args()
+    config = dict(SCALES[args.scale], skills=args.skills, queries=args.queries, iterations=args.iterations,
+                  batch_size=args.batch_size, online_attempts=args.online_attempts, epochs=args.epochs,
+                  train_batch_size=args.train_batch_size, train_workers=args.train_workers, seed=args.seed)
+    for key in ('essays', 'attempts', 'students', 'items'):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        different = [key for key in COMPARABLE_KEYS if baseline['config'].get(key) != config[key]]
+        if different:
+            sys.exit(f"Baseline was recorded with different settings: {', '.join(different)}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='argmind-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        print(f"Generating {config['essays']:,} essays and {config['attempts']:,} attempts in {workdir}")
+        preparation = prepare(config, workdir,
+                              corpus=any(CASES[case][1] for case in args.cases),
+                              attempts=any(CASES[case][2] for case in args.cases))
+        results = {'config': config, 'environment': environment(), 'preparation': preparation, 'cases': {}}
+        for case in args.cases:
+            print(f"Running {case}")
+            results['cases'][case] = run_isolated(CASES[case][0], config, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = [case for case, result in results['cases'].items() if 'error' in result]
+    regressions = compare(results, baseline, args.max_regression) if baseline is not None else []
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import os
+import json
+import numpy as np
+from typing import Any, Dict, Iterator, List
+from ..models.answer_scorer import COMPONENT_MARKERS
+from ..models.neuralcdm.attempt_journal import ATTEMPT_DTYPE
+
+COMPONENT_TYPES = ['claim', 'data', 'warrant', 'backing', 'rebuttal', 'qualifier']
+SUBJECTS = [
+    'technology', 'education', 'environment', 'government', 'health', 'family', 'work', 'tourism',
+    'transport', 'media', 'crime', 'culture', 'science', 'sport', 'advertising', 'housing',
+    'energy', 'food', 'language', 'art', 'space', 'economy', 'cities', 'volunteering'
+]
+TOPIC_TEMPLATES = [
+    '{a} vs {b}: which matters more',
+    'Should {a} be funded before {b}',
+    'The impact of {a} on {b}',
+    'Advantages and disadvantages of {a}',
+    'Is {a} more important than {b}'
+]
+BAND_SCORES = [4, 5, 6, 7, 8, 9]
+BAND_WEIGHTS = [0.05, 0.15, 0.3, 0.3, 0.15, 0.05]
+SYLLABLES = ['ka', 'lo', 'mi', 'ren', 'to', 'sa', 'vi', 'dor', 'el', 'an', 'us', 'tra', 'pe', 'ni', 'gu', 'or']
+
+
+def _vocabulary(size: int, rng: np.random.Generator) -> List[str]:
+    """Pseudo-words of 2-4 syllables, unique and at least 4 letters so tokenizers keep them"""
+    words, seen = [], set()
+    while len(words) < size:
+        word = ''.join(SYLLABLES[i] for i in rng.integers(0, len(SYLLABLES), rng.integers(2, 5)))
+        if len(word) >= 4 and word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def generate_knowledge_graph(num_essays: int, num_topics: int = None, vocabulary_size: int = 20000,
+                             seed: int = 0) -> Dict[str, Any]:
+    """
+    Generate a Toulmin-annotated knowledge graph shaped like ielts_knowledge_graph.json.
+
+    Essays belong to topics with their own vocabulary, and component texts mix
+    Zipf-distributed common words with topic words, so term statistics and
+    topic overlap resemble a real corpus. Higher band essays get more marker
+    phrases and longer components.
+
+    Args:
+        num_essays: Number of essays
+        num_topics: Number of distinct topics, defaults to one per 50 essays
+        vocabulary_size: Number of distinct common words
+        seed: Random seed, the same arguments always give the same graph
+
+    Returns:
+        Dictionary with 'essays' and 'metadata'
+    """
+    rng = np.random.default_rng(seed)
+    num_topics = num_topics or max(10, num_essays // 50)
+    vocabulary = _vocabulary(vocabulary_size, rng)
+    word_weights = 1.0 / np.arange(1, vocabulary_size + 1) ** 1.1
+    word_weights /= word_weights.sum()
+
+    topics = []
+    for t in range(num_topics):
+        a, b = rng.choice(len(SUBJECTS), 2, replace=False)
+        template = TOPIC_TEMPLATES[t % len(TOPIC_TEMPLATES)]
+        topics.append({
+            'topic': f"{template.format(a=SUBJECTS[a], b=SUBJECTS[b])} ({t + 1})".capitalize(),
+            'words': [SUBJECTS[a], SUBJECTS[b]] + [vocabulary[i] for i in rng.integers(0, vocabulary_size, 30)]
+        })
+
+    # Draw every word of the corpus up front, sentences slice into these arrays
+    total_words = num_essays * len(COMPONENT_TYPES) * 40
+    common_words = rng.choice(vocabulary_size, total_words, p=word_weights)
+    topic_words = rng.integers(0, 32, total_words)
+    from_topic = rng.random(total_words) < 0.4
+    cursor = 0
+
+    def sentence(topic, length, markers):
+        nonlocal cursor
+        stop = cursor + length
+        words = [topic['words'][topic_words[i]] if from_topic[i] else vocabulary[common_words[i]]
+                 for i in range(cursor, stop)]
+        cursor = stop if stop + 40 < total_words else 0
+        return ' '.join(markers + words).capitalize()
+
+    essays = []
+    topic_ids = rng.integers(0, num_topics, num_essays)
+    bands = rng.choice(BAND_SCORES, num_essays, p=BAND_WEIGHTS)
+    for i in range(num_essays):
+        topic, band = topics[topic_ids[i]], int(bands[i])
+        components = {}
+        for component_type in COMPONENT_TYPES:
+            markers = COMPONENT_MARKERS[component_type]
+            num_markers = int(rng.random() < (band - 3) / 6) + int(band >= 8)
+            chosen = [markers[j] for j in rng.choice(len(markers), num_markers, replace=False)]
+            length = int(rng.integers(6, 10)) + band
+            if component_type == 'data':
+                components[component_type] = [sentence(topic, length, chosen if k == 0 else [])
+                                              for k in range(int(rng.integers(1, 4)))]
+            else:
+                components[component_type] = sentence(topic, length, chosen)
+        essays.append({
+            'id': f"essay_{i + 1}",
+            'topic': topic['topic'],
+            'band_score': band,
+            'components': components
+        })
+
+    return {
+        'essays': essays,
+        'metadata': {'synthetic': True, 'seed': seed, 'num_essays': num_essays, 'num_topics': num_topics}
+    }
+
+
+def write_knowledge_graph(knowledge_graph: Dict[str, Any], path: str):
+    """Write a knowledge graph as JSON, atomically"""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(knowledge_graph, f)
+    os.replace(tmp_path, path)
+
+
+def generate_queries(knowledge_graph: Dict[str, Any], num_queries: int, seed: int = 0) -> List[str]:
+    """
+    Sample search queries from the corpus: a few words of a random component,
+    sometimes naming the component type or quoting a topic.
+    """
+    rng = np.random.default_rng(seed)
+    essays = knowledge_graph['essays']
+    queries = []
+    for i in rng.integers(0, len(essays), num_queries):
+        essay = essays[i]
+        kind = rng.random()
+        if kind < 0.1:
+            queries.append(essay['topic'].split(' (')[0])
+            continue
+        component_type = COMPONENT_TYPES[rng.integers(0, len(COMPONENT_TYPES))]
+        component = essay['components'][component_type]
+        words = (' '.join(component) if isinstance(component, list) else component).lower().split()
+        start = int(rng.integers(0, max(1, len(words) - 3)))
+        query = ' '.join(words[start:start + int(rng.integers(2, 7))])
+        queries.append(f"{component_type} {query}" if kind < 0.4 else query)
+    return queries
+
+
+def generate_q_matrix(num_items: int, num_skills: int, seed: int = 0) -> np.ndarray:
+    """Random [num_items, num_skills] 0/1 Q-matrix, every item exercises 1-3 skills"""
+    rng = np.random.default_rng(seed)
+    q_matrix = np.zeros((num_items, num_skills), dtype=np.float32)
+    for item, count in enumerate(rng.integers(1, min(3, num_skills) + 1, num_items)):
+        q_matrix[item, rng.choice(num_skills, count, replace=False)] = 1.0
+    return q_matrix
+
+
+def generate_attempts(num_attempts: int, num_students: int, q_matrix: np.ndarray, seed: int = 0,
+                      chunk_size: int = 1 << 20) -> Iterator[np.ndarray]:
+    """
+    Generate a stream of learner attempts from a latent skill model.
+
+    Every student has an ability and every item a difficulty per skill; an
+    attempt is correct with the sigmoid of the mean ability minus difficulty
+    over the skills of the item. Student activity is skewed, a few students
+    account for many of the attempts, like on a real platform.
+
+    Args:
+        num_attempts: Number of attempts
+        num_students: Number of distinct user ids
+        q_matrix: [num_items, num_skills] Q-matrix, see generate_q_matrix
+        seed: Random seed
+        chunk_size: Attempts per yielded chunk
+
+    Yields:
+        Structured arrays of ``ATTEMPT_DTYPE`` attempts
+    """
+    rng = np.random.default_rng(seed)
+    num_items, num_skills = q_matrix.shape
+    abilities = rng.normal(0.0, 1.0, (num_students, num_skills)).astype(np.float32)
+    difficulties = rng.normal(0.0, 1.0, (num_items, num_skills)).astype(np.float32)
+    skill_counts = np.maximum(q_matrix.sum(axis=1), 1.0)
+
+    for start in range(0, num_attempts, chunk_size):
+        size = min(chunk_size, num_attempts - start)
+        user_ids = (num_students * rng.random(size) ** 2).astype(np.int64)
+        item_ids = rng.integers(0, num_items, size)
+        logits = ((abilities[user_ids] - difficulties[item_ids]) * q_matrix[item_ids]).sum(axis=1)
+        logits /= skill_counts[item_ids]
+        records = np.zeros(size, dtype=ATTEMPT_DTYPE)
+        records['user_id'] = user_ids
+        records['item_id'] = item_ids
+        records['correct'] = rng.random(size) < 1.0 / (1.0 + np.exp(-2.0 * logits))
+        records['timestamp'] = start + np.arange(size, dtype=np.float64)
+        yield records
@@ -0,0 +1,259 @@
+import re
+import time
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+from .bm25_index import tokenize
+from .dense_index import HashingEncoder
+
+# Phrases that signal each Toulmin component
+COMPONENT_MARKERS = {
+    'claim': ['i believe', 'i think', 'should', 'must', 'more important', 'better', 'agree', 'disagree',
+              'in my opinion', 'argue'],
+    'data': ['for example', 'according to', 'percent', 'statistics', 'study', 'research', 'survey',
+             'evidence', 'average', 'number of'],
+    'warrant': ['because', 'therefore', 'since', 'this means', 'allows', 'leads to', 'as a result',
+                'thus', 'which means', 'so that'],
+    'backing': ['for instance', 'such as', 'example of', 'story', 'stories', 'case of', 'experience',
+                'studies show', 'experts', 'history'],
+    'rebuttal': ['however', 'although', 'on the other hand', 'some people', 'critics', 'opponents',
+                 'despite', 'while', 'nevertheless', 'it could be argued'],
+    'qualifier': ['only', 'some', 'most', 'often', 'may', 'might', 'likely', 'usually', 'probably',
+                  'in many cases', 'to some extent', 'fraction']
+}
+
+COMPONENT_SUGGESTIONS = {
+    'claim': "State your position explicitly, e.g. 'I believe that ...' or '... should ...'",
+    'data': "Support the point with concrete facts, figures or cited sources",
+    'warrant': "Explain why the evidence supports the claim, e.g. with 'because' or 'this means'",
+    'backing': "Back the reasoning up with an example, case or expert view",
+    'rebuttal': "Acknowledge an opposing view and respond to it, e.g. 'However, ...'",
+    'qualifier': "Limit the scope of the claim, e.g. with 'most', 'often' or 'in many cases'"
+}
+
+# Minimum score that meets the expectation of each difficulty level
+DIFFICULTY_TARGETS = {'beginner': 5.5, 'intermediate': 6.5, 'advanced': 7.5}
+
+# Minimum detection score for a sentence to be labelled with a component
+DETECTION_THRESHOLD = 0.25
+
+NUMBER_PATTERN = re.compile(r'\d')
+MARKER_PATTERNS = {
+    component_type: [(marker, re.compile(rf'\b{re.escape(marker)}\b')) for marker in markers]
+    for component_type, markers in COMPONENT_MARKERS.items()
+}
+
+
+class AnswerScorer:
+    """
+    CPU-only scorer of Toulmin component answers against exemplar matrices.
+
+    For every component type the exemplars of high-band essays are encoded once
+    into a row-normalized matrix. An answer is encoded with the same hashing
+    encoder and compared against all exemplars of its type with one matrix
+    product, and the similarity is combined with lexical features: marker
+    phrases of the component and the answer length relative to the exemplars.
+
+    Exemplar rows are scanned in blocks so that a single answer stops within
+    ``latency_budget`` seconds even against a very large exemplar set, in which
+    case the result is flagged as partial.
+
+    The normalized mean of each exemplar matrix is kept as the centroid of its
+    component, so ``detect_components`` labels free text, e.g. the sentences
+    of an essay being written, with one small matrix product.
+    """
+
+    def __init__(self, exemplars: Dict[str, List[Dict[str, Any]]], encoder: HashingEncoder = None,
+                 latency_budget: float = 0.05, block_rows: int = 4096, num_nearest: int = 3):
+        self.encoder = encoder or HashingEncoder()
+        self.latency_budget = latency_budget
+        self.block_rows = block_rows
+        self.num_nearest = num_nearest
+        self.exemplars = exemplars
+        self.matrices: Dict[str, np.ndarray] = {}
+        self.reference_similarity: Dict[str, float] = {}
+        self.reference_length: Dict[str, float] = {}
+        self.centroid_types: List[str] = []
+        centroids, centroid_similarity = [], []
+        for component_type, examples in exemplars.items():
+            texts = [example['example'] for example in examples]
+            matrix = self.encoder.encode(texts)
+            self.matrices[component_type] = matrix
+            if len(texts):
+                centroid = matrix.mean(axis=0)
+                centroid /= max(float(np.linalg.norm(centroid)), 1e-12)
+                self.centroid_types.append(component_type)
+                centroids.append(centroid)
+                # Typical similarity of an exemplar to its own centroid, the yardstick for detection
+                centroid_similarity.append(max(float((matrix @ centroid).mean()), 0.05))
+            self.reference_length[component_type] = float(np.median([len(tokenize(t)) for t in texts])) if texts else 1.0
+            # Typical similarity of an exemplar to its nearest other exemplar, the yardstick for answers,
+            # estimated on a sample of large exemplar sets
+            if len(texts) > 1:
+                sample = matrix[np.random.default_rng(0).permutation(len(matrix))[:1024]]
+                similarities = sample @ sample.T
+                np.fill_diagonal(similarities, -1.0)
+                self.reference_similarity[component_type] = max(float(similarities.max(axis=1).mean()), 0.1)
+            else:
+                self.reference_similarity[component_type] = 0.3
+        self.centroids = np.array(centroids, dtype=np.float32).reshape(len(centroids), self.encoder.dim)
+        self.centroid_similarity = np.array(centroid_similarity, dtype=np.float32)
+
+    @classmethod
+    def from_knowledge_graph(cls, knowledge_graph: Dict[str, Any], min_band: float = 7,
+                             **kwargs) -> 'AnswerScorer':
+        """Collect the components of essays scoring at least ``min_band`` as exemplars"""
+        exemplars: Dict[str, List[Dict[str, Any]]] = {}
+        for essay in knowledge_graph['essays']:
+            if essay['band_score'] < min_band:
+                continue
+            for component_type, component in essay['components'].items():
+                text = '. '.join(component) if isinstance(component, list) else component
+                exemplars.setdefault(component_type, []).append({
+                    'example': text,
+                    'topic': essay['topic'],
+                    'band_score': essay['band_score']
+                })
+        return cls(exemplars, **kwargs)
+
+    def _similarities(self, vectors: np.ndarray, component_type: str, deadline: float) -> Tuple[np.ndarray, bool]:
+        """Cosine similarities of answers to the exemplars, block by block until the deadline"""
+        matrix = self.matrices.get(component_type)
+        if matrix is None or len(matrix) == 0:
+            return np.full((len(vectors), 0), -1.0, dtype=np.float32), True
+        similarities = np.full((len(vectors), len(matrix)), -1.0, dtype=np.float32)
+        for start in range(0, len(matrix), self.block_rows):
+            if start > 0 and time.perf_counter() > deadline:
+                return similarities, False
+            block = matrix[start:start + self.block_rows]
+            similarities[:, start:start + len(block)] = vectors @ block.T
+        return similarities, True
+
+    @staticmethod
+    def _markers(text: str, answer: str, component_type: str) -> List[str]:
+        """Marker phrases of a component found in the tokenized ``text`` of ``answer``"""
+        markers = [marker for marker, pattern in MARKER_PATTERNS.get(component_type, []) if pattern.search(text)]
+        if component_type == 'data' and NUMBER_PATTERN.search(answer):
+            markers.append('figures')
+        return markers
+
+    def _lexical_features(self, answer: str, component_type: str) -> Dict[str, Any]:
+        text = ' '.join(tokenize(answer))
+        markers = self._markers(text, answer, component_type)
+        words = len(text.split())
+        return {
+            'markers': markers,
+            'words': words,
+            'length_ratio': words / self.reference_length.get(component_type, 1.0)
+        }
+
+    def score_many(self, answers: List[str], component_types: List[str],
+                   difficulties: List[str] = None) -> List[Dict[str, Any]]:
+        """
+        Score a batch of answers, e.g. a whole class's submissions.
+
+        Answers are encoded in one pass and compared with one matrix product per
+        component type.
+
+        Returns:
+            Per answer: score (0-9), feedback, suggestions, sample_answer,
+            nearest_exemplars, features and whether the exemplar scan completed
+        """
+        start = time.perf_counter()
+        difficulties = difficulties or ['intermediate'] * len(answers)
+        vectors = self.encoder.encode(answers)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(answers)
+
+        component_types = [component_type.lower() for component_type in component_types]
+        for component_type in set(component_types):
+            rows = [i for i, t in enumerate(component_types) if t == component_type]
+            # A batch gets the budget once per answer
+            deadline = start + self.latency_budget * len(rows)
+            similarities, complete = self._similarities(vectors[rows], component_type, deadline)
+            for row, i in enumerate(rows):
+                results[i] = self._result(answers[i], component_type, difficulties[i], similarities[row], complete)
+        return results
+
+    def detect_components(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """
+        Guess which Toulmin component each text, e.g. a sentence of an essay, expresses.
+
+        Texts are encoded in one pass and compared with every component centroid
+        in one matrix product; the similarity, relative to how close exemplars
+        are to their own centroid, is combined with the marker phrases found.
+
+        Returns:
+            Per text: the most likely 'component_type' (None below
+            DETECTION_THRESHOLD), its 'confidence' and the 'scores' of every type
+        """
+        if not texts:
+            return []
+        similarities = self.encoder.encode(texts) @ self.centroids.T
+        similarity_scores = np.clip(similarities / self.centroid_similarity, 0.0, 1.0)
+        results = []
+        for row, answer in enumerate(texts):
+            text = ' '.join(tokenize(answer))
+            scores = {
+                component_type: round(float(0.5 * similarity_scores[row, column] +
+                                            0.5 * min(len(self._markers(text, answer, component_type)) / 2, 1.0)), 4)
+                for column, component_type in enumerate(self.centroid_types)
+            }
+            best = max(scores, key=scores.get) if scores and text else None
+            confidence = scores[best] if best is not None else 0.0
+            results.append({
+                'component_type': best if confidence >= DETECTION_THRESHOLD else None,
+                'confidence': confidence,
+                'scores': scores
+            })
+        return results
+
+    def score(self, answer: str, component_type: str, difficulty: str = 'intermediate') -> Dict[str, Any]:
+        """Score one answer, see score_many"""
+        return self.score_many([answer], [component_type], [difficulty])[0]
+
+    def _result(self, answer: str, component_type: str, difficulty: str,
+                similarities: np.ndarray, complete: bool) -> Dict[str, Any]:
+        features = self._lexical_features(answer, component_type)
+        examples = self.exemplars.get(component_type, [])
+
+        k = min(self.num_nearest, len(similarities))
+        nearest = np.argpartition(-similarities, k - 1)[:k] if 0 < k < len(similarities) else np.arange(k)
+        nearest = nearest[np.argsort(-similarities[nearest], kind='stable')]
+        nearest = [i for i in nearest.tolist() if similarities[i] > -1.0]
+        similarity = float(similarities[nearest].mean()) if nearest else 0.0
+
+        similarity_score = min(max(similarity, 0.0) / self.reference_similarity.get(component_type, 0.3), 1.0)
+        marker_score = min(len(features['markers']) / 2, 1.0)
+        length_score = min(features['length_ratio'], 1.0)
+        if features['length_ratio'] > 3:
+            length_score = max(0.0, 1.0 - (features['length_ratio'] - 3) / 3)
+        raw = 0.5 * similarity_score + 0.3 * marker_score + 0.2 * length_score
+        score = 0.0 if features['words'] == 0 else round(9 * raw * 2) / 2
+
+        suggestions = []
+        if marker_score < 1.0 and component_type in COMPONENT_SUGGESTIONS:
+            suggestions.append(COMPONENT_SUGGESTIONS[component_type])
+        if features['length_ratio'] < 0.6:
+            suggestions.append("Develop the answer further, it is much shorter than high-band examples")
+        elif features['length_ratio'] > 3:
+            suggestions.append("Make the answer more concise and focused on a single point")
+        if similarity_score < 0.5:
+            suggestions.append(f"Compare your answer with the sample {component_type} from a high-band essay")
+
+        target = DIFFICULTY_TARGETS.get(difficulty, DIFFICULTY_TARGETS['intermediate'])
+        if score >= target:
+            feedback = f"Well done! Your {component_type} meets the {difficulty} level expectation."
+        elif score >= target - 1.5:
+            feedback = f"Good attempt! Your {component_type} is close to the {difficulty} level, see the suggestions."
+        else:
+            feedback = f"Your {component_type} needs more work to reach the {difficulty} level, see the suggestions."
+
+        nearest_exemplars = [dict(examples[i], similarity=float(similarities[i])) for i in nearest]
+        return {
+            'score': score,
+            'feedback': feedback,
+            'suggestions': suggestions,
+            'sample_answer': nearest_exemplars[0]['example'] if nearest_exemplars else '',
+            'nearest_exemplars': nearest_exemplars,
+            'features': dict(features, similarity=similarity),
+            'complete': complete
+        }
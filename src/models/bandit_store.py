@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+from typing import Tuple
+
+
+def ewma_coefficients(rewards: np.ndarray, alpha: float) -> Tuple[float, float]:
+    """
+    Collapse sequential exponential moving average updates into one affine step.
+
+    Applying ``value += alpha * (reward - value)`` for each reward in order is
+    equivalent to ``value = decay * value + increment``.
+
+    Returns:
+        Tuple of (decay, increment)
+    """
+    weights = alpha * (1 - alpha) ** np.arange(len(rewards) - 1, -1, -1)
+    return float((1 - alpha) ** len(rewards)), float(weights @ rewards)
+
+
+class BanditStateStore:
+    """
+    Bandit arm statistics shared by all worker processes through a local SQLite file.
+
+    Every update is a single atomic UPDATE statement, so concurrent workers merge
+    their pulls into one set of counts and values instead of each keeping its own.
+    The database runs in WAL mode so readers never block the writer.
+    """
+
+    def __init__(self, path: str = "models/saved/bandit_state.db", num_arms: int = 4):
+        self.path = path
+        self.num_arms = num_arms
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS arms ("
+            "arm INTEGER PRIMARY KEY, count REAL NOT NULL DEFAULT 0, value REAL NOT NULL DEFAULT 0)"
+        )
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO arms (arm) VALUES (?)", [(arm,) for arm in range(num_arms)]
+        )
+        # Additive LinUCB sufficient statistics (sum of x x^T and of reward * x) per arm
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS contexts (arm INTEGER PRIMARY KEY, xx BLOB NOT NULL, rx BLOB NOT NULL)"
+        )
+
+    def _read(self) -> Tuple[np.ndarray, np.ndarray]:
+        rows = self._connection.execute(
+            "SELECT count, value FROM arms WHERE arm < ? ORDER BY arm", (self.num_arms,)
+        ).fetchall()
+        counts = np.array([row[0] for row in rows], dtype=float)
+        values = np.array([row[1] for row in rows], dtype=float)
+        return counts, values
+
+    def _add_context(self, arm: int, xx: np.ndarray, rx: np.ndarray):
+        row = self._connection.execute("SELECT xx, rx FROM contexts WHERE arm = ?", (arm,)).fetchone()
+        if row is not None:
+            xx += np.frombuffer(row[0], dtype=np.float64).reshape(xx.shape)
+            rx += np.frombuffer(row[1], dtype=np.float64)
+        self._connection.execute(
+            "INSERT OR REPLACE INTO contexts (arm, xx, rx) VALUES (?, ?, ?)",
+            (arm, xx.astype(np.float64).tobytes(), rx.astype(np.float64).tobytes())
+        )
+
+    def record(self, arm: int, reward: float, alpha: float,
+               context: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Apply one pull of an arm and return the merged statistics of all workers.
+
+        Args:
+            arm: The pulled arm
+            reward: The observed reward
+            alpha: Learning rate of the value estimate
+            context: Optional context vector the arm was pulled for
+
+        Returns:
+            Tuple of (arm counts, arm values)
+        """
+        contexts = None if context is None else np.asarray(context, dtype=np.float64)[None]
+        return self.record_batch(np.array([arm]), np.array([reward], dtype=np.float64), alpha, contexts)
+
+    def record_batch(self, arms: np.ndarray, rewards: np.ndarray, alpha: float,
+                     contexts: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Apply many pulls in one transaction and return the merged statistics of all workers.
+
+        Args:
+            arms: The pulled arm of each pull
+            rewards: The observed reward of each pull
+            alpha: Learning rate of the value estimates
+            contexts: Optional (pulls, dim) matrix of the context of each pull
+
+        Returns:
+            Tuple of (arm counts, arm values)
+        """
+        arms = np.asarray(arms)
+        rewards = np.asarray(rewards, dtype=np.float64)
+        if contexts is not None:
+            contexts = np.asarray(contexts, dtype=np.float64)
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                for arm in np.unique(arms).tolist():
+                    mask = arms == arm
+                    decay, increment = ewma_coefficients(rewards[mask], alpha)
+                    self._connection.execute(
+                        "UPDATE arms SET count = count + ?, value = value * ? + ? WHERE arm = ?",
+                        (int(mask.sum()), decay, increment, int(arm))
+                    )
+                    if contexts is not None:
+                        X = contexts[mask]
+                        self._add_context(int(arm), X.T @ X, rewards[mask] @ X)
+                state = self._read()
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return state
+
+    def context_snapshot(self, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the merged LinUCB statistics of all workers.
+
+        Args:
+            dim: Dimension of the context vectors
+
+        Returns:
+            Tuple of (per-arm design matrices I + sum x x^T, per-arm sums of reward * x)
+        """
+        A = np.repeat(np.eye(dim)[None], self.num_arms, axis=0)
+        b = np.zeros((self.num_arms, dim))
+        with self._lock:
+            rows = self._connection.execute("SELECT arm, xx, rx FROM contexts WHERE arm < ?", (self.num_arms,)).fetchall()
+        for arm, xx, rx in rows:
+            A[arm] += np.frombuffer(xx, dtype=np.float64).reshape(dim, dim)
+            b[arm] = np.frombuffer(rx, dtype=np.float64)
+        return A, b
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the current (arm counts, arm values) of all workers."""
+        with self._lock:
+            return self._read()
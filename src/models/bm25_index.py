@@ -0,0 +1,189 @@
+import re
+import hashlib
+import numpy as np
+from scipy import sparse
+from typing import List, Dict, Any, Optional, Tuple
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+ALL_FIELDS = '_all'  # Array key prefix of the field over all components of an essay
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercased alphanumeric tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def term_hashes(tokens: List[str]) -> np.ndarray:
+    """Map tokens to stable signed 64-bit term hashes."""
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(t.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+         for t in tokens],
+        dtype=np.int64
+    )
+
+
+def component_tokens(component: Any) -> List[str]:
+    """Tokenize a component that is either a string or a list of strings."""
+    if isinstance(component, list):
+        return [token for item in component for token in tokenize(item)]
+    return tokenize(component)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over essay components backed by sparse term-document matrices.
+
+    One term x essay CSR matrix of precomputed BM25 weights is built per
+    component type, plus one over all components of an essay. Scoring a query
+    is a sparse row-vector product that only touches the postings of the query
+    terms, followed by a partial sort for the top-k.
+    """
+
+    def __init__(self, essays: List[Dict[str, Any]], k1: float = 1.2, b: float = 0.75):
+        self.num_essays = len(essays)
+        self.k1 = k1
+        self.b = b
+        self.term_keys = np.empty(0, dtype=np.int64)
+        self._matrices: Dict[Optional[str], sparse.csr_matrix] = {}
+        self._idf: Dict[Optional[str], np.ndarray] = {}
+        self._build(essays)
+
+    @classmethod
+    def from_arrays(cls, num_essays: int, fields: List[Optional[str]], arrays: Dict[str, np.ndarray],
+                    k1: float = 1.2, b: float = 0.75) -> 'BM25Index':
+        """
+        Reopen an index from the arrays of ``arrays()`` without re-tokenizing the corpus.
+
+        Args:
+            num_essays: Number of essays of the corpus
+            fields: Component types with a weight matrix, None for the field over all components
+            arrays: Weight matrices keyed like ``arrays()``, e.g. memory-mapped from a snapshot
+        """
+        index = cls.__new__(cls)
+        index.num_essays = num_essays
+        index.k1 = k1
+        index.b = b
+        index.term_keys = arrays['term_keys']
+        index._matrices, index._idf = {}, {}
+        for field in fields:
+            prefix = ALL_FIELDS if field is None else field
+            index._matrices[field] = sparse.csr_matrix(
+                (arrays[f"{prefix}.data"], arrays[f"{prefix}.indices"], arrays[f"{prefix}.indptr"]),
+                shape=(len(index.term_keys), num_essays)
+            )
+            index._idf[field] = arrays[f"{prefix}.idf"]
+        return index
+
+    @property
+    def fields(self) -> List[Optional[str]]:
+        """Component types with a weight matrix, None for the field over all components."""
+        return list(self._matrices)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The vocabulary and the CSR weight matrix and IDF of every field, keyed ``<field>.<array>``."""
+        arrays = {'term_keys': self.term_keys}
+        for field, matrix in self._matrices.items():
+            prefix = ALL_FIELDS if field is None else field
+            arrays[f"{prefix}.data"] = matrix.data
+            arrays[f"{prefix}.indices"] = matrix.indices
+            arrays[f"{prefix}.indptr"] = matrix.indptr
+            arrays[f"{prefix}.idf"] = self._idf[field]
+        return arrays
+
+    def _build(self, essays: List[Dict[str, Any]]):
+        """Tokenize the corpus once and precompute BM25 weights per field."""
+        fields: Dict[Optional[str], List[List[str]]] = {None: [[] for _ in essays]}
+        for essay_idx, essay in enumerate(essays):
+            for component_type, component in essay['components'].items():
+                tokens = component_tokens(component)
+                if component_type not in fields:
+                    fields[component_type] = [[] for _ in essays]
+                fields[component_type][essay_idx] = tokens
+                fields[None][essay_idx].extend(tokens)
+
+        hashed = {field: [term_hashes(tokens) for tokens in docs] for field, docs in fields.items()}
+        all_hashes = [h for docs in hashed.values() for h in docs]
+        self.term_keys = np.unique(np.concatenate(all_hashes)) if all_hashes else self.term_keys
+
+        for field, docs in hashed.items():
+            self._matrices[field], self._idf[field] = self._weights(docs)
+
+    def _weights(self, docs: List[np.ndarray]) -> Tuple[sparse.csr_matrix, np.ndarray]:
+        """Build the term x essay BM25 weight matrix of one field."""
+        num_terms = len(self.term_keys)
+        rows = np.concatenate([np.searchsorted(self.term_keys, h) for h in docs]) if docs else np.empty(0, dtype=np.int64)
+        cols = np.concatenate([np.full(len(h), i, dtype=np.int64) for i, h in enumerate(docs)]) if docs else rows
+        tf = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(num_terms, self.num_essays)
+        )
+        tf.sum_duplicates()
+
+        doc_lengths = np.array([len(h) for h in docs], dtype=np.float32)
+        avg_length = doc_lengths.mean() if len(doc_lengths) and doc_lengths.mean() > 0 else 1.0
+        df = np.diff(tf.indptr).astype(np.float32)
+        idf = np.log1p((self.num_essays - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        norm = self.k1 * (1 - self.b + self.b * doc_lengths / avg_length)
+        term_rows = np.repeat(np.arange(num_terms), np.diff(tf.indptr))
+        tf.data = idf[term_rows] * tf.data * (self.k1 + 1) / (tf.data + norm[tf.indices])
+        return tf, idf
+
+    def _query_vectors(self, queries: List[str]) -> Tuple[sparse.csr_matrix, List[np.ndarray]]:
+        """Encode queries as binary sparse term vectors over the vocabulary."""
+        indptr, indices, term_ids = [0], [], []
+        for query in queries:
+            hashes = np.unique(term_hashes(tokenize(query)))
+            positions = np.searchsorted(self.term_keys, hashes)
+            known = positions < len(self.term_keys)
+            known[known] = self.term_keys[positions[known]] == hashes[known]
+            ids = positions[known]
+            term_ids.append(ids)
+            indices.extend(ids.tolist())
+            indptr.append(len(indices))
+        vectors = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, indptr),
+            shape=(len(queries), len(self.term_keys))
+        )
+        return vectors, term_ids
+
+    def top_k_many(self, queries: List[str], component_type: str = None,
+                   top_k: int = 5) -> List[List[Tuple[int, float, float]]]:
+        """
+        Score a batch of queries against every essay in one sparse product.
+
+        Args:
+            queries: The search queries
+            component_type: Optional component type to score against
+            top_k: Maximum number of essays returned per query
+
+        Returns:
+            Per query, a list of (essay index, BM25 score, relevance in [0, 1]),
+            best first
+        """
+        if component_type not in self._matrices:
+            return [[] for _ in queries]
+
+        matrix, idf = self._matrices[component_type], self._idf[component_type]
+        vectors, term_ids = self._query_vectors(queries)
+        scores = (vectors @ matrix).tocsr()
+
+        ranked = []
+        for row, ids in enumerate(term_ids):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            essay_ids, values = scores.indices[start:end], scores.data[start:end]
+            if len(values) > top_k:
+                keep = np.argpartition(-values, top_k - 1)[:top_k]
+                essay_ids, values = essay_ids[keep], values[keep]
+            order = np.lexsort((essay_ids, -values))
+            # Upper bound reached by a document saturating every query term
+            max_score = float(idf[ids].sum() * (self.k1 + 1)) or 1.0
+            ranked.append([
+                (int(essay_ids[i]), float(values[i]), min(float(values[i]) / max_score, 1.0))
+                for i in order if values[i] > 0
+            ])
+        return ranked
+
+    def top_k(self, query: str, component_type: str = None, top_k: int = 5) -> List[Tuple[int, float, float]]:
+        """Score a single query, see ``top_k_many``."""
+        return self.top_k_many([query], component_type, top_k)[0]
@@ -0,0 +1,169 @@
+import numpy as np
+from typing import List, Dict, Any, Optional, Sequence
+
+# Character trigrams are packed into a single int64 (21 bits per code point)
+TRIGRAM_BITS = 21
+# Number of rarest trigrams intersected before exact verification
+MAX_PROBE_TRIGRAMS = 8
+# Separator placed between items of list components (e.g. data points)
+ITEM_SEPARATOR = '\x00'
+
+
+def component_text(component: Any) -> str:
+    """Flatten a component (string or list of strings) into one lowercased text."""
+    if isinstance(component, list):
+        return ITEM_SEPARATOR.join(item.lower() for item in component)
+    return component.lower()
+
+
+def trigram_codes(text: str) -> np.ndarray:
+    """Return the sorted unique trigram codes of an already normalized text."""
+    if len(text) < 3:
+        return np.empty(0, dtype=np.int64)
+    points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    codes = (points[:-2] << (2 * TRIGRAM_BITS)) | (points[1:-1] << TRIGRAM_BITS) | points[2:]
+    return np.unique(codes)
+
+
+class ComponentIndex:
+    """
+    Inverted character-trigram index over the Toulmin components of a corpus.
+
+    Posting lists are kept per component type in CSR form (sorted trigram keys,
+    ``indptr`` offsets and sorted essay indices), so a lookup is a handful of
+    binary searches and posting-list intersections followed by an exact substring
+    check on the few surviving candidates.
+    """
+
+    def __init__(self, essays: List[Dict[str, Any]]):
+        self.num_essays = len(essays)
+        self.component_types: List[str] = []
+        self._texts: Dict[str, List[Optional[str]]] = {}
+        self._keys: Dict[str, np.ndarray] = {}
+        self._indptr: Dict[str, np.ndarray] = {}
+        self._postings: Dict[str, np.ndarray] = {}
+        self._present: Dict[str, np.ndarray] = {}
+        self._build(essays)
+
+    @classmethod
+    def from_arrays(cls, num_essays: int, component_types: List[str], texts: Dict[str, Sequence[Optional[str]]],
+                    arrays: Dict[str, np.ndarray]) -> 'ComponentIndex':
+        """
+        Reopen an index from the arrays of ``arrays()`` without rebuilding it.
+
+        Args:
+            num_essays: Number of essays of the corpus
+            component_types: Component types in index order
+            texts: Per component type, the normalized component text of every essay, None where missing
+            arrays: Posting lists keyed like ``arrays()``, e.g. memory-mapped from a snapshot
+        """
+        index = cls.__new__(cls)
+        index.num_essays = num_essays
+        index.component_types = list(component_types)
+        index._texts = texts
+        index._keys = {ctype: arrays[f"{ctype}.keys"] for ctype in component_types}
+        index._indptr = {ctype: arrays[f"{ctype}.indptr"] for ctype in component_types}
+        index._postings = {ctype: arrays[f"{ctype}.postings"] for ctype in component_types}
+        index._present = {ctype: arrays[f"{ctype}.present"] for ctype in component_types}
+        return index
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The posting lists of every component type, keyed ``<component type>.<array>``."""
+        arrays = {}
+        for ctype in self.component_types:
+            arrays[f"{ctype}.keys"] = self._keys[ctype]
+            arrays[f"{ctype}.indptr"] = self._indptr[ctype]
+            arrays[f"{ctype}.postings"] = self._postings[ctype]
+            arrays[f"{ctype}.present"] = self._present[ctype]
+        return arrays
+
+    def _build(self, essays: List[Dict[str, Any]]):
+        """Normalize every component once and build its posting lists."""
+        for essay in essays:
+            for component_type in essay['components']:
+                if component_type not in self._texts:
+                    self.component_types.append(component_type)
+                    self._texts[component_type] = [None] * self.num_essays
+
+        for essay_idx, essay in enumerate(essays):
+            for component_type, component in essay['components'].items():
+                # Empty data lists can never match, keep them out of the index
+                if isinstance(component, list) and not component:
+                    continue
+                self._texts[component_type][essay_idx] = component_text(component)
+
+        for component_type in self.component_types:
+            texts = self._texts[component_type]
+            code_chunks, essay_chunks = [], []
+            for essay_idx, text in enumerate(texts):
+                if text is None:
+                    continue
+                codes = trigram_codes(text)
+                code_chunks.append(codes)
+                essay_chunks.append(np.full(len(codes), essay_idx, dtype=np.int32))
+
+            codes = np.concatenate(code_chunks) if code_chunks else np.empty(0, dtype=np.int64)
+            owners = np.concatenate(essay_chunks) if essay_chunks else np.empty(0, dtype=np.int32)
+            order = np.lexsort((owners, codes))
+            codes, owners = codes[order], owners[order]
+
+            keys, starts = np.unique(codes, return_index=True)
+            self._keys[component_type] = keys
+            self._indptr[component_type] = np.append(starts, len(codes)).astype(np.int64)
+            self._postings[component_type] = owners
+            self._present[component_type] = np.array(
+                [i for i, text in enumerate(texts) if text is not None], dtype=np.int32
+            )
+
+    def _candidates(self, codes: np.ndarray, component_type: str) -> np.ndarray:
+        """Intersect the posting lists of the rarest query trigrams."""
+        if len(codes) == 0:
+            return self._present[component_type]
+
+        keys = self._keys[component_type]
+        positions = np.searchsorted(keys, codes)
+        positions = np.minimum(positions, len(keys) - 1) if len(keys) else positions
+        if len(keys) == 0 or not np.array_equal(keys[positions], codes):
+            # At least one trigram never occurs in this component type
+            return np.empty(0, dtype=np.int32)
+
+        indptr = self._indptr[component_type]
+        lengths = indptr[positions + 1] - indptr[positions]
+        rarest = positions[np.argsort(lengths, kind='stable')[:MAX_PROBE_TRIGRAMS]]
+
+        postings = self._postings[component_type]
+        candidates = postings[indptr[rarest[0]]:indptr[rarest[0] + 1]]
+        for position in rarest[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(
+                candidates, postings[indptr[position]:indptr[position + 1]], assume_unique=True
+            )
+        return candidates
+
+    def search(self, query: str, component_type: str = None) -> List[int]:
+        """
+        Find essays whose component text contains the query as a substring.
+
+        Args:
+            query: The search query
+            component_type: Optional component type to restrict the search to
+
+        Returns:
+            Sorted list of matching essay indices
+        """
+        normalized = query.lower()
+        codes = trigram_codes(normalized)
+
+        if component_type:
+            component_types = [component_type] if component_type in self._texts else []
+        else:
+            component_types = self.component_types
+
+        matches = set()
+        for ctype in component_types:
+            texts = self._texts[ctype]
+            for essay_idx in self._candidates(codes, ctype).tolist():
+                if essay_idx not in matches and normalized in texts[essay_idx]:
+                    matches.add(essay_idx)
+        return sorted(matches)
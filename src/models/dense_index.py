@@ -0,0 +1,280 @@
+import os
+import re
+import json
+import uuid
+import fcntl
+import hashlib
+import numpy as np
+from pathlib import Path
+from typing import List, Dict, Any, Tuple
+from .bm25_index import tokenize, term_hashes
+
+EMBEDDING_DIR = "src/data/embeddings"
+KEEP_VERSIONS = 2  # Vector file versions kept per source, the current one and the one it replaced
+# <version>.vectors.npy and <version>.rows.npy after the source stem, no version for unversioned older builds
+VECTOR_FILE_PATTERN = re.compile(r'(?:([0-9a-f]{12})\.)?(?:vectors|rows)\.npy')
+
+
+class HashingEncoder:
+    """
+    CPU-only text encoder based on signed feature hashing.
+
+    Unigrams and bigrams are hashed into a fixed number of signed buckets, which
+    is a sparse random projection of the bag-of-n-grams, and the result is
+    L2-normalized so that dot products are cosine similarities.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-ngram-{dim}"
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts into an (len(texts), dim) float32 matrix."""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            if not features:
+                continue
+            hashes = term_hashes(features)
+            signs = np.where((hashes >> 32) & 1, 1.0, -1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.dim, signs)
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+def _file_digest(path: Path) -> str:
+    """Hash a source file so stale embeddings can be detected."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _component_text(component: Any) -> str:
+    return '. '.join(component) if isinstance(component, list) else component
+
+
+class DenseIndex:
+    """
+    Cosine top-k search over precomputed component embeddings.
+
+    Vectors live in a contiguous float32 ``.npy`` file that is memory-mapped
+    read-only, so every worker process shares the same page-cached matrix. Rows
+    are grouped by component type, which makes a component filter a zero-copy
+    slice, and a batch of queries is answered with a single matrix product.
+    """
+
+    def __init__(self, vectors: np.ndarray, row_essays: np.ndarray,
+                 offsets: Dict[str, Tuple[int, int]], encoder: HashingEncoder):
+        self.vectors = vectors
+        self.row_essays = row_essays
+        self.offsets = offsets
+        self.encoder = encoder
+
+    @staticmethod
+    def _manifest_path(source_path: Path, embedding_dir: str) -> Path:
+        return (Path(embedding_dir) / source_path.stem).with_suffix('.manifest.json')
+
+    @staticmethod
+    def _paths(source_path: Path, embedding_dir: str, version: str) -> Tuple[Path, Path]:
+        base = Path(embedding_dir) / source_path.stem
+        return base.with_suffix(f".{version}.vectors.npy"), base.with_suffix(f".{version}.rows.npy")
+
+    @staticmethod
+    def _read_manifest(manifest_path: Path) -> Dict[str, Any]:
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def embed(essays: List[Dict[str, Any]],
+              encoder: HashingEncoder) -> Tuple[np.ndarray, np.ndarray, Dict[str, Tuple[int, int]]]:
+        """
+        Embed every component of the corpus, rows grouped by component type.
+
+        Returns:
+            Tuple of (float32 vectors, int32 essay index per row, row range per component type)
+        """
+        component_types = []
+        for essay in essays:
+            component_types.extend(c for c in essay['components'] if c not in component_types)
+
+        texts, row_essays, offsets = [], [], {}
+        for component_type in component_types:
+            start = len(texts)
+            for essay_idx, essay in enumerate(essays):
+                component = essay['components'].get(component_type)
+                if component:
+                    texts.append(_component_text(component))
+                    row_essays.append(essay_idx)
+            offsets[component_type] = (start, len(texts))
+
+        vectors = encoder.encode(texts) if texts else np.zeros((0, encoder.dim), dtype=np.float32)
+        return (np.ascontiguousarray(vectors, dtype=np.float32), np.array(row_essays, dtype=np.int32),
+                offsets)
+
+    @classmethod
+    def build(cls, essays: List[Dict[str, Any]], source_path: Path,
+              embedding_dir: str = EMBEDDING_DIR, encoder: HashingEncoder = None) -> Dict[str, Any]:
+        """
+        Embed every component of the corpus and write the vector files.
+
+        Every build writes files under a new version name and then publishes
+        them by replacing the manifest, which names the version, so concurrent
+        readers always pair a manifest with the vectors it describes. Versions
+        beyond the last ``KEEP_VERSIONS`` are pruned; readers that mapped them
+        keep their mappings.
+
+        Returns:
+            The manifest describing the written files
+        """
+        encoder = encoder or HashingEncoder()
+        manifest_path = cls._manifest_path(source_path, embedding_dir)
+        os.makedirs(embedding_dir, exist_ok=True)
+
+        vectors, row_essays, offsets = cls.embed(essays, encoder)
+        version = uuid.uuid4().hex[:12]
+        vectors_path, rows_path = cls._paths(source_path, embedding_dir, version)
+        suffix = f".tmp{os.getpid()}"
+        np.save(f"{vectors_path}{suffix}", vectors)
+        np.save(f"{rows_path}{suffix}", row_essays)
+        os.replace(f"{vectors_path}{suffix}.npy", vectors_path)
+        os.replace(f"{rows_path}{suffix}.npy", rows_path)
+
+        # Publishing and pruning are serialized, so concurrent builds never prune each other's current version
+        lock_fd = os.open(manifest_path.with_suffix('.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            return cls._publish(source_path, embedding_dir, encoder, version, offsets)
+        finally:
+            os.close(lock_fd)
+
+    @classmethod
+    def _publish(cls, source_path: Path, embedding_dir: str, encoder: HashingEncoder, version: str,
+                 offsets: Dict[str, Tuple[int, int]]) -> Dict[str, Any]:
+        manifest_path = cls._manifest_path(source_path, embedding_dir)
+        suffix = f".tmp{os.getpid()}"
+        previous = cls._read_manifest(manifest_path)
+        published = ([previous['version']] + previous['previous_versions']
+                     if previous is not None and 'version' in previous else [])
+        manifest = {
+            'version': version,
+            'previous_versions': published[:KEEP_VERSIONS - 1],
+            'source_digest': _file_digest(source_path),
+            'encoder': encoder.name,
+            'dim': encoder.dim,
+            'offsets': offsets
+        }
+        with open(f"{manifest_path}{suffix}", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(f"{manifest_path}{suffix}", manifest_path)
+
+        # Versions that fell off the manifest and the unversioned files of older builds; versions that
+        # concurrent builds wrote but did not publish yet are left alone
+        pruned = set(published[KEEP_VERSIONS - 1:]) | {None}
+        stem = source_path.stem
+        for path in Path(embedding_dir).glob(f"{stem}.*.npy"):
+            match = VECTOR_FILE_PATTERN.fullmatch(path.name[len(stem) + 1:])
+            if match and match.group(1) in pruned:
+                path.unlink(missing_ok=True)
+        return manifest
+
+    @classmethod
+    def open_or_build(cls, essays: List[Dict[str, Any]], source_path: Path,
+                      embedding_dir: str = EMBEDDING_DIR, encoder: HashingEncoder = None) -> 'DenseIndex':
+        """Memory-map the embeddings of the corpus, (re)building them if missing or stale."""
+        encoder = encoder or HashingEncoder()
+        manifest_path = cls._manifest_path(source_path, embedding_dir)
+
+        manifest = cls._read_manifest(manifest_path)
+        if (manifest is None or 'version' not in manifest or manifest['encoder'] != encoder.name
+                or manifest['source_digest'] != _file_digest(source_path)):
+            manifest = cls.build(essays, source_path, embedding_dir, encoder)
+
+        while True:
+            vectors_path, rows_path = cls._paths(source_path, embedding_dir, manifest['version'])
+            try:
+                vectors = np.load(vectors_path, mmap_mode='r')
+                row_essays = np.load(rows_path)
+                break
+            except FileNotFoundError:
+                # Pruned by builds published since the manifest was read, a newer one is current
+                current = cls._read_manifest(manifest_path)
+                if current is None or current['version'] == manifest['version']:
+                    raise
+                manifest = current
+        offsets = {k: tuple(v) for k, v in manifest['offsets'].items()}
+        return cls(vectors, row_essays, offsets, encoder)
+
+    def similarity(self, queries: List[str], texts: List[str]) -> np.ndarray:
+        """
+        Cosine similarity of each query to each of a few texts, e.g. results another method found.
+
+        Returns:
+            A (len(queries), len(texts)) float32 matrix, dissimilar pairs at 0
+        """
+        if not queries or not texts:
+            return np.zeros((len(queries), len(texts)), dtype=np.float32)
+        return np.maximum(self.encoder.encode(queries) @ self.encoder.encode(texts).T, 0.0)
+
+    def search_many(self, queries: List[str], component_type: str = None,
+                    top_k: int = 5) -> List[List[Tuple[int, float]]]:
+        """
+        Find the essays whose components are most similar to each query.
+
+        Args:
+            queries: The search queries
+            component_type: Optional component type to compare against
+            top_k: Maximum number of essays returned per query
+
+        Returns:
+            Per query, a list of (essay index, cosine similarity), best first
+        """
+        if component_type:
+            if component_type not in self.offsets:
+                return [[] for _ in queries]
+            start, end = self.offsets[component_type]
+        else:
+            start, end = 0, len(self.row_essays)
+        if end <= start or not queries:
+            return [[] for _ in queries]
+
+        similarities = self.encoder.encode(queries) @ self.vectors[start:end].T
+        row_essays = self.row_essays[start:end]
+
+        # An essay contributes one row per component, so over-fetch before deduplicating
+        fetch = min(top_k * (len(self.offsets) if not component_type else 1), end - start)
+        ranked = []
+        for row in similarities:
+            candidates = np.argpartition(-row, fetch - 1)[:fetch]
+            candidates = candidates[np.argsort(-row[candidates], kind='stable')]
+            hits, seen = [], set()
+            for candidate in candidates.tolist():
+                essay_idx = int(row_essays[candidate])
+                if essay_idx in seen or row[candidate] <= 0:
+                    continue
+                seen.add(essay_idx)
+                hits.append((essay_idx, float(row[candidate])))
+                if len(hits) == top_k:
+                    break
+            ranked.append(hits)
+        return ranked
+
+
+def main():
+    """Precompute the component embeddings of the default knowledge graph."""
+    source_path = Path("src/data/ielts_knowledge_graph.json")
+    with open(source_path, 'r', encoding='utf-8') as f:
+        essays = json.load(f)['essays']
+    manifest = DenseIndex.build(essays, source_path)
+    print(f"Embedded {len(essays)} essays with {manifest['encoder']} into {EMBEDDING_DIR}")
+
+
+if __name__ == "__main__":
+    main()
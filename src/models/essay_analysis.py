@@ -0,0 +1,200 @@
+import re
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from .answer_scorer import AnswerScorer
+from .metrics import Counter, Histogram, SIZE_BUCKETS
+
+MAX_ESSAY_CHARS = 20000
+SESSION_CACHE_SIZE = 1024  # Analyzed sentences kept per session, so undoing an edit costs nothing
+NUM_EXAMPLES = 3  # Retrieved examples streamed per sentence
+
+# A paragraph is a run of text without a blank line, a sentence runs up to its terminator
+PARAGRAPH_PATTERN = re.compile(r'\S(?:[^\n]|\n(?![ \t\r\f\v]*\n))*')
+SENTENCE_PATTERN = re.compile(r'[^.!?\s][^.!?]*(?:[.!?]+|$)')
+
+SEGMENTS = Counter('essay_analysis_sentences_total', "Sentences of analysis revisions, by whether they were analyzed",
+                   ['result'])
+REVISION_CHANGED = Histogram('essay_analysis_changed_sentences', "Sentences to analyze per revision",
+                             buckets=SIZE_BUCKETS)
+
+# (start, end, sentence hash) of a sentence, offsets relative to its paragraph
+SentenceSpan = Tuple[int, int, str]
+
+
+def segment_hash(text: str) -> str:
+    """Hash of a segment, insensitive to how its words are spaced or wrapped"""
+    return hashlib.blake2b(' '.join(text.split()).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def split_sentences(paragraph: str) -> List[SentenceSpan]:
+    """Split a paragraph into sentences with their offsets and hashes"""
+    spans = []
+    for match in SENTENCE_PATTERN.finditer(paragraph):
+        text = match.group().rstrip()
+        spans.append((match.start(), match.start() + len(text), segment_hash(text)))
+    return spans
+
+
+def apply_edits(text: str, edits: Iterable[Dict[str, Any]]) -> str:
+    """
+    Apply text edits in order, each replacing ``text[start:end]`` with its ``text``.
+
+    Raises:
+        ValueError: If an edit does not fit the text
+    """
+    for edit in edits:
+        start, end = int(edit.get('start', 0)), int(edit.get('end', edit.get('start', 0)))
+        if not 0 <= start <= end <= len(text):
+            raise ValueError(f"Edit [{start}, {end}) is outside the text of {len(text)} characters")
+        text = text[:start] + str(edit.get('text', '')) + text[end:]
+    return text
+
+
+class Sentence:
+    """A sentence of the current revision of a session."""
+    __slots__ = ('id', 'paragraph', 'start', 'end', 'text')
+
+    def __init__(self, id: str, paragraph: int, start: int, end: int, text: str):
+        self.id = id
+        self.paragraph = paragraph
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'id': self.id, 'paragraph': self.paragraph, 'start': self.start, 'end': self.end}
+
+
+class EssayAnalysisSession:
+    """
+    Incremental analysis state of one essay while it is being edited.
+
+    Each revision of the text is split into paragraphs and sentences, and every
+    segment is identified by a hash of its text. Paragraphs whose hash was seen
+    before reuse their sentence split and sentences whose hash was seen before
+    reuse their analysis, so component detection and retrieval only run for
+    the sentences an edit actually changed. Splitting and hashing are linear
+    passes in C over a few kilobytes; the analysis work follows the edit.
+
+    Analyses are cached per session in LRU order and dropped when the knowledge
+    graph they were retrieved from is replaced.
+    """
+
+    def __init__(self, cache_size: int = SESSION_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.text = ''
+        self.revision = 0
+        self.sentences: List[Sentence] = []
+        self._paragraphs: Dict[str, List[SentenceSpan]] = {}
+        self._results: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._source: Any = None
+
+    def update(self, text: Optional[str] = None, edits: Iterable[Dict[str, Any]] = None) -> int:
+        """
+        Start a new revision from a full text or from edits of the current one.
+
+        Returns:
+            The new revision number
+
+        Raises:
+            ValueError: If an edit does not fit the text or the essay is too long
+        """
+        text = apply_edits(self.text, edits or []) if text is None else text
+        if len(text) > MAX_ESSAY_CHARS:
+            raise ValueError(f"Essays are limited to {MAX_ESSAY_CHARS} characters")
+
+        paragraphs: Dict[str, List[SentenceSpan]] = {}
+        sentences = []
+        for index, match in enumerate(PARAGRAPH_PATTERN.finditer(text)):
+            paragraph = match.group().rstrip()
+            # Sentence offsets depend on the exact spacing, so paragraphs are keyed by their raw text
+            key = hashlib.blake2b(paragraph.encode('utf-8'), digest_size=8).hexdigest()
+            spans = paragraphs.get(key) or self._paragraphs.get(key)
+            if spans is None:
+                spans = split_sentences(paragraph)
+            paragraphs[key] = spans
+            offset = match.start()
+            sentences.extend(Sentence(sentence_id, index, offset + start, offset + end, paragraph[start:end])
+                             for start, end, sentence_id in spans)
+
+        self.text = text
+        self.sentences = sentences
+        self._paragraphs = paragraphs
+        self.revision += 1
+        return self.revision
+
+    def bind(self, source: Any):
+        """Drop cached analyses if they were made against another knowledge graph than ``source``"""
+        if source is not self._source:
+            self._results.clear()
+            self._source = source
+
+    def pending(self) -> List[Sentence]:
+        """Sentences of the current revision without an analysis, each distinct text once"""
+        seen, pending = set(), []
+        for sentence in self.sentences:
+            if sentence.id not in self._results and sentence.id not in seen:
+                seen.add(sentence.id)
+                pending.append(sentence)
+        REVISION_CHANGED.observe(len(pending))
+        SEGMENTS.labels('analyzed').inc(len(pending))
+        SEGMENTS.labels('reused').inc(len(self.sentences) - len(pending))
+        return pending
+
+    def result(self, sentence_id: str) -> Optional[Dict[str, Any]]:
+        return self._results.get(sentence_id)
+
+    def store(self, sentence_id: str, result: Dict[str, Any]):
+        self._results[sentence_id] = result
+        self._results.move_to_end(sentence_id)
+        if len(self._results) > self.cache_size:
+            # Sentences of the current text stay, the least recently analyzed others go first
+            current = {sentence.id for sentence in self.sentences}
+            for key in list(self._results):
+                if len(self._results) <= max(self.cache_size, len(current)):
+                    break
+                if key not in current:
+                    del self._results[key]
+
+    def summary(self) -> Dict[str, Any]:
+        """Detected components of the whole current revision"""
+        counts: Dict[str, int] = {}
+        for sentence in self.sentences:
+            result = self._results.get(sentence.id)
+            if result is not None and result['component_type'] is not None:
+                counts[result['component_type']] = counts.get(result['component_type'], 0) + 1
+        return {'components': counts}
+
+
+def _example(result: Dict[str, Any], component_type: Optional[str]) -> Dict[str, Any]:
+    """The part of a retrieved essay or example worth streaming to an editor"""
+    example = {key: result[key] for key in ('topic', 'band_score', 'relevance') if key in result}
+    if 'example' in result:
+        example['example'] = result['example']
+    elif component_type is not None and component_type in result.get('components', {}):
+        component = result['components'][component_type]
+        example['example'] = '. '.join(component) if isinstance(component, list) else component
+    return example
+
+
+def analyze_sentences(scorer: AnswerScorer, mab_rag, texts: List[str],
+                      num_examples: int = NUM_EXAMPLES) -> List[Dict[str, Any]]:
+    """
+    Detect the component of each sentence and retrieve examples for it, as one batch.
+
+    Args:
+        scorer: AnswerScorer whose exemplar centroids label the sentences
+        mab_rag: MABEnhancedRAG retrieving examples of the detected components
+
+    Returns:
+        Per sentence: component_type, confidence, scores, examples and the selected arm
+    """
+    detections = scorer.detect_components(texts)
+    component_types = [detection['component_type'] for detection in detections]
+    retrieved = mab_rag.retrieve_many(texts, component_types)
+    return [
+        dict(detection, examples=[_example(result, detection['component_type']) for result in results[:num_examples]],
+             selected_arm=arm)
+        for detection, (results, arm) in zip(detections, retrieved)
+    ]
@@ -0,0 +1,273 @@
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from .bm25_index import component_tokens, term_hashes, tokenize
+from .component_index import ComponentIndex
+from .metrics import Histogram, SIZE_BUCKETS
+
+# Keywords shared by more than this share of all components are too common to relate anything
+MAX_CONCEPT_SHARE = 0.05
+MIN_CONCEPT_LENGTH = 3
+MAX_FANOUT = 256  # Components followed per concept in a traversal, highest bands first
+TOPIC_FIELD = 'topic'  # Single component type of the trigram index over topic names
+STOPWORDS = frozenset("""
+    about after again against all also and any are because been before being between both but can cannot could
+    did does doing down during each few for from further had has have having her here hers him his how however
+    into its itself just more most much must not now off once only other our ours out over own same she should
+    some such than that the their theirs them then there these they this those through too under until very was
+    were what when where which while who whom why will with would you your yours
+""".split())
+
+RELATED_VISITED = Histogram('knowledge_graph_related_visited', "Components visited per related-examples traversal",
+                            buckets=SIZE_BUCKETS)
+
+
+class _Lowered(Sequence):
+    """Lowercased view of a string sequence, the normalized texts of the topic index."""
+
+    def __init__(self, strings: Sequence[str]):
+        self.strings = strings
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __getitem__(self, i: int) -> str:
+        return self.strings[i].lower()
+
+
+def concept_terms(component: Any) -> List[str]:
+    """Distinct keywords of a component that may become concept nodes, in order of appearance."""
+    return list(dict.fromkeys(token for token in component_tokens(component)
+                              if len(token) >= MIN_CONCEPT_LENGTH and token not in STOPWORDS))
+
+
+class EssayGraph:
+    """
+    The knowledge graph as typed CSR adjacency arrays.
+
+    Nodes are essays, topics, components (one per Toulmin component of an
+    essay) and concepts (keywords shared between components). Components are
+    numbered by type and, within a type, by descending band score, so the
+    components of a type sorted by band are a contiguous id range and every
+    posting list sorted by id is sorted by type and band too. The relations
+    are stored once per direction:
+
+    - essay -> topic as one id per essay, topic -> essays as CSR sorted by band
+    - essay -> component as a dense (component type, essay) slot table,
+      component -> essay as one id per component
+    - component <-> concept as two CSR arrays, concepts keyed by term hash
+
+    Topic names are found through a trigram index, so structure and example
+    lookups are index hits and related-example queries a traversal bounded by
+    ``MAX_FANOUT`` per concept instead of scans over the corpus.
+    """
+
+    def __init__(self, essays: List[Dict[str, Any]], band_scores: np.ndarray):
+        self.num_essays = len(essays)
+        self.band_scores = np.asarray(band_scores, dtype=np.float64)
+        self.component_types: List[str] = []
+        for essay in essays:
+            self.component_types.extend(c for c in essay['components'] if c not in self.component_types)
+        self.topic_names: List[str] = []
+        self._build(essays, self.band_scores)
+        self._index_topics(ComponentIndex([{'components': {TOPIC_FIELD: name}} for name in self.topic_names]))
+
+    @classmethod
+    def from_arrays(cls, band_scores: np.ndarray, component_types: List[str], topic_names: Sequence[str],
+                    arrays: Dict[str, np.ndarray]) -> 'EssayGraph':
+        """
+        Reopen a graph from the arrays of ``arrays()`` without rebuilding it.
+
+        Args:
+            band_scores: Band score of every essay
+            component_types: Component types in graph order
+            topic_names: Name of every topic node, e.g. a column of a snapshot string table
+            arrays: Adjacency arrays keyed like ``arrays()``, e.g. memory-mapped from a snapshot
+        """
+        graph = cls.__new__(cls)
+        graph.band_scores = band_scores
+        graph.component_types = list(component_types)
+        graph.topic_names = topic_names
+        for name in ('essay_topics', 'topic_indptr', 'topic_essays', 'slots', 'type_indptr', 'component_essays',
+                     'component_bands', 'component_indptr', 'component_concepts', 'concept_keys',
+                     'concept_weights', 'concept_indptr', 'concept_components'):
+            setattr(graph, name, arrays[name])
+        graph.num_essays = len(graph.essay_topics)
+        prefix = 'topic_index.'
+        graph._index_topics(ComponentIndex.from_arrays(
+            len(topic_names), [TOPIC_FIELD], {TOPIC_FIELD: _Lowered(topic_names)},
+            {name[len(prefix):]: array for name, array in arrays.items() if name.startswith(prefix)}
+        ))
+        return graph
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Every adjacency array and the topic index; topic names are kept by the caller."""
+        arrays = {name: getattr(self, name) for name in (
+            'essay_topics', 'topic_indptr', 'topic_essays', 'slots', 'type_indptr', 'component_essays',
+            'component_bands', 'component_indptr', 'component_concepts', 'concept_keys', 'concept_weights',
+            'concept_indptr', 'concept_components')}
+        arrays.update({f"topic_index.{name}": array for name, array in self._topic_index.arrays().items()})
+        return arrays
+
+    def _index_topics(self, topic_index: ComponentIndex):
+        self._topic_index = topic_index
+        self._type_ids = {component_type: t for t, component_type in enumerate(self.component_types)}
+
+    def _build(self, essays: List[Dict[str, Any]], band_scores: np.ndarray):
+        """Number every node and build both directions of each relation."""
+        n = self.num_essays
+        topic_ids: Dict[str, int] = {}
+        self.essay_topics = np.array([topic_ids.setdefault(essay['topic'], len(topic_ids)) for essay in essays],
+                                     dtype=np.int32)
+        self.topic_names = list(topic_ids)
+        # Best band first, ties in corpus order
+        by_band = np.lexsort((np.arange(n), -band_scores)).astype(np.int32)
+        order = by_band[np.argsort(self.essay_topics[by_band], kind='stable')]
+        self.topic_indptr = np.zeros(len(topic_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.essay_topics, minlength=len(topic_ids)), out=self.topic_indptr[1:])
+        self.topic_essays = order
+
+        self.slots = np.full((len(self.component_types), n), -1, dtype=np.int32)
+        self.type_indptr = np.zeros(len(self.component_types) + 1, dtype=np.int64)
+        owners = []
+        for t, component_type in enumerate(self.component_types):
+            present = by_band[np.array([component_type in essays[i]['components'] for i in by_band.tolist()],
+                                       dtype=bool)]
+            self.slots[t, present] = self.type_indptr[t] + np.arange(len(present), dtype=np.int32)
+            owners.append(present)
+            self.type_indptr[t + 1] = self.type_indptr[t] + len(present)
+        self.component_essays = np.concatenate(owners) if owners else np.empty(0, dtype=np.int32)
+        self.component_bands = band_scores[self.component_essays]
+
+        # Keywords per component, then only those rare enough to be concepts
+        num_components = len(self.component_essays)
+        terms = [concept_terms(essays[essay_idx]['components'][self.component_types[t]])
+                 for t in range(len(self.component_types))
+                 for essay_idx in owners[t].tolist()]
+        document_frequency: Dict[str, int] = {}
+        for component_terms in terms:
+            for term in component_terms:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        limit = max(2, int(MAX_CONCEPT_SHARE * num_components))
+        concepts = [term for term, df in document_frequency.items() if df <= limit]
+        keys = term_hashes(concepts)
+        ranks = np.argsort(keys, kind='stable')
+        self.concept_keys = keys[ranks]
+        concept_ids = dict(zip((concepts[i] for i in ranks.tolist()), range(len(concepts))))
+
+        edges = [sorted(concept_ids[term] for term in component_terms if term in concept_ids)
+                 for component_terms in terms]
+        self.component_indptr = np.zeros(num_components + 1, dtype=np.int64)
+        np.cumsum([len(concept_list) for concept_list in edges], out=self.component_indptr[1:])
+        self.component_concepts = np.fromiter((c for concept_list in edges for c in concept_list),
+                                              dtype=np.int32, count=int(self.component_indptr[-1]))
+
+        # Transpose; a stable sort by concept keeps each posting list sorted by component id
+        sources = np.repeat(np.arange(num_components, dtype=np.int32), np.diff(self.component_indptr))
+        order = np.argsort(self.component_concepts, kind='stable')
+        self.concept_components = sources[order]
+        counts = np.bincount(self.component_concepts, minlength=len(concepts))
+        self.concept_indptr = np.zeros(len(concepts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.concept_indptr[1:])
+        self.concept_weights = np.log1p(num_components / np.maximum(counts, 1))
+
+    @property
+    def num_components(self) -> int:
+        return len(self.component_essays)
+
+    def component_range(self, component_type: str) -> Tuple[int, int]:
+        """Component ids of a type, best band first; empty for unknown types."""
+        t = self._type_ids.get(component_type)
+        if t is None:
+            return 0, 0
+        return int(self.type_indptr[t]), int(self.type_indptr[t + 1])
+
+    def components(self, component_type: str, min_band: float = None, limit: int = None) -> np.ndarray:
+        """
+        Components of a type by descending band score, cut at ``min_band`` and ``limit``.
+
+        Returns:
+            Component ids, whose essays are ``component_essays[ids]``
+        """
+        start, end = self.component_range(component_type)
+        if min_band is not None:
+            # Bands descend over the range, so the qualifying components are a prefix
+            end = start + int(np.searchsorted(-self.component_bands[start:end], -min_band, side='right'))
+        if limit is not None:
+            end = min(end, start + limit)
+        return np.arange(start, end, dtype=np.int32)
+
+    def find_topics(self, query: str) -> List[int]:
+        """Topics whose name contains the query, case-insensitively."""
+        return self._topic_index.search(query, TOPIC_FIELD)
+
+    def best_essay(self, topics: List[int], min_band: float = None) -> Optional[int]:
+        """The highest-band essay of any of the topics, earliest on ties; None if none reaches ``min_band``."""
+        # Topic lists are sorted by band, so only their first essays compete
+        firsts = [int(self.topic_essays[self.topic_indptr[topic]]) for topic in topics
+                  if self.topic_indptr[topic] < self.topic_indptr[topic + 1]]
+        if not firsts:
+            return None
+        best = min(firsts, key=lambda essay_idx: (-self.band_scores[essay_idx], essay_idx))
+        if min_band is not None and self.band_scores[best] < min_band:
+            return None
+        return best
+
+    def concepts(self, text: str) -> np.ndarray:
+        """Concept ids of the keywords of a text, sorted; keywords that are not concepts are skipped."""
+        keys = term_hashes(list(dict.fromkeys(tokenize(text))))
+        if len(keys) == 0 or len(self.concept_keys) == 0:
+            return np.empty(0, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.concept_keys, keys), len(self.concept_keys) - 1)
+        return np.unique(positions[self.concept_keys[positions] == keys])
+
+    def related(self, concepts: np.ndarray, target_type: str, via_type: str = None,
+                exclude_essay: int = None, top_k: int = 5) -> List[Tuple[int, int, float, int]]:
+        """
+        Multi-hop related components: concept -> components sharing it -> their essays -> target component.
+
+        Each essay scores the summed weight of the distinct concepts it shares,
+        counted through its components of ``via_type`` or through any of its
+        components. Every concept follows at most ``MAX_FANOUT`` components,
+        the best bands first.
+
+        Args:
+            concepts: Concept ids of the source, e.g. from ``concepts()``
+            target_type: Component type to return from the related essays
+            via_type: Component type that must share the concepts, None for any
+            exclude_essay: Essay to leave out, e.g. the one the source came from
+            top_k: Maximum number of results
+
+        Returns:
+            (essay index, component id, score, shared concepts) tuples, best
+            score first, then best band
+        """
+        target = self._type_ids.get(target_type)
+        if target is None or len(concepts) == 0:
+            return []
+        low, high = self.component_range(via_type) if via_type else (0, self.num_components)
+        hits, sources = [], []
+        for concept in np.unique(concepts).tolist():
+            postings = self.concept_components[self.concept_indptr[concept]:self.concept_indptr[concept + 1]]
+            if via_type:
+                postings = postings[np.searchsorted(postings, low):np.searchsorted(postings, high)]
+            hits.append(postings[:MAX_FANOUT])
+            sources.append(np.full(len(hits[-1]), concept, dtype=np.int64))
+        components = np.concatenate(hits)
+        RELATED_VISITED.observe(len(components))
+        if len(components) == 0:
+            return []
+
+        # An essay counts each concept once, however many of its components share it
+        pairs = np.unique(self.component_essays[components].astype(np.int64) * len(self.concept_keys)
+                          + np.concatenate(sources))
+        essays, concept_of = np.divmod(pairs, len(self.concept_keys))
+        essays, inverse = np.unique(essays, return_inverse=True)
+        scores = np.bincount(inverse, weights=self.concept_weights[concept_of])
+        shared = np.bincount(inverse)
+        targets = self.slots[target, essays]
+        keep = targets >= 0
+        if exclude_essay is not None:
+            keep &= essays != exclude_essay
+        essays, targets, scores, shared = essays[keep], targets[keep], scores[keep], shared[keep]
+        order = np.lexsort((essays, -self.component_bands[targets], -scores))[:top_k]
+        return [(int(essays[i]), int(targets[i]), float(scores[i]), int(shared[i])) for i in order.tolist()]
@@ -0,0 +1,372 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import shutil
+import argparse
+import numpy as np
+from pathlib import Path
+from collections.abc import Sequence
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from .component_index import ComponentIndex, component_text
+from .bm25_index import BM25Index
+from .dense_index import DenseIndex, HashingEncoder
+from .essay_graph import EssayGraph
+
+SNAPSHOT_DIR = "src/data/snapshots"
+FORMAT_VERSION = 2
+KEEP_VERSIONS = 3  # Snapshot versions kept on disk, older ones are pruned after a build
+ESSAY_CACHE_SIZE = 4096  # Decoded essay dicts kept per snapshot
+PAGE_SIZE = 4096
+
+# Component kinds of the (component type, essay) slots
+MISSING, TEXT, LIST = 0, 1, 2
+
+
+class StringTable(Sequence):
+    """UTF-8 strings stored back to back in one byte array, addressed through an offsets array."""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    @staticmethod
+    def encode(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Pack strings into (uint8 blob, int64 offsets with one entry more than strings)."""
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+
+class StringColumn(Sequence):
+    """Strings of a table selected by an id array, None where the id is negative."""
+
+    def __init__(self, table: StringTable, ids: np.ndarray):
+        self.table = table
+        self.ids = ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        string_id = int(self.ids[i])
+        return self.table[string_id] if string_id >= 0 else None
+
+
+class SnapshotEssays(Sequence):
+    """
+    The essays of a snapshot as a read-only sequence of essay dicts.
+
+    Essays are decoded from the string table when indexed and the most recent
+    ones are cached, so opening a snapshot never materializes the corpus.
+    """
+
+    def __init__(self, snapshot: 'GraphSnapshot'):
+        self.snapshot = snapshot
+        self._decode = lru_cache(maxsize=ESSAY_CACHE_SIZE)(self._decode_essay)
+
+    def __len__(self) -> int:
+        return self.snapshot.num_essays
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._decode(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._decode(int(i))
+
+    def _decode_essay(self, i: int) -> Dict[str, Any]:
+        snapshot = self.snapshot
+        strings, n = snapshot.strings, snapshot.num_essays
+        kinds, indptr, items = snapshot.arrays['component_kinds'], snapshot.arrays['component_indptr'], \
+            snapshot.arrays['component_items']
+        components = {}
+        for t, component_type in enumerate(snapshot.component_types):
+            kind = kinds[t, i]
+            if kind == MISSING:
+                continue
+            slot = t * n + i
+            texts = [strings[string_id] for string_id in items[indptr[slot]:indptr[slot + 1]].tolist()]
+            components[component_type] = texts[0] if kind == TEXT else texts
+        band_score = snapshot.band_scores[i].item()
+        return {
+            'id': strings[int(snapshot.arrays['essay_ids'][i])],
+            'topic': strings[int(snapshot.arrays['essay_topics'][i])],
+            'band_score': int(band_score) if snapshot.manifest['integer_bands'] else band_score,
+            'components': components
+        }
+
+
+def _source_stamp(source_path: Path) -> Dict[str, int]:
+    stat = os.stat(source_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _snapshot_root(source_path: Path, snapshot_dir: str) -> Path:
+    return Path(snapshot_dir) / Path(source_path).stem
+
+
+class GraphSnapshot:
+    """
+    A compiled, memory-mapped knowledge graph with its indexes.
+
+    A snapshot is a directory of ``.npy`` arrays: a string table holding every
+    essay id, topic and component text, the component layout of each essay as
+    offsets into it, and the arrays of the trigram, BM25 and dense indexes.
+    Every array is memory-mapped read-only, so opening a snapshot costs a few
+    file opens regardless of corpus size and worker processes share its pages.
+
+    Snapshots of a source live in numbered version directories next to a
+    ``CURRENT`` pointer that is replaced atomically once a version is complete,
+    so readers only ever open finished snapshots. Open snapshots stay valid
+    after newer versions are published or older ones are pruned.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / 'manifest.json', 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest['format_version'] != FORMAT_VERSION:
+            raise ValueError(f"Snapshot {self.path} has format {self.manifest['format_version']}, "
+                             f"expected {FORMAT_VERSION}")
+        self.version = self.manifest['version']
+        self.num_essays = self.manifest['num_essays']
+        self.component_types: List[str] = self.manifest['component_types']
+        self.metadata = self.manifest['metadata']
+        # Plain ndarray views of the mappings, slicing np.memmap costs more than the lookups themselves
+        self.arrays = {path.name[:-len('.npy')]: np.load(path, mmap_mode='r').view(np.ndarray)
+                       for path in self.path.glob('*.npy')}
+        self.strings = StringTable(self.arrays['strings'], self.arrays['string_offsets'])
+        self.band_scores = self.arrays['band_scores']
+        self.topics = StringColumn(self.strings, self.arrays['essay_topics'])
+        self.essays = SnapshotEssays(self)
+
+    def _prefixed(self, prefix: str) -> Dict[str, np.ndarray]:
+        return {name[len(prefix):]: array for name, array in self.arrays.items() if name.startswith(prefix)}
+
+    def component_index(self) -> ComponentIndex:
+        """The trigram index, verifying candidates against the string table."""
+        texts = {ctype: StringColumn(self.strings, self.arrays['component_texts'][t])
+                 for t, ctype in enumerate(self.component_types)}
+        return ComponentIndex.from_arrays(self.num_essays, self.component_types, texts,
+                                          self._prefixed('trigram.'))
+
+    def bm25_index(self) -> BM25Index:
+        bm25 = self.manifest['bm25']
+        return BM25Index.from_arrays(self.num_essays, bm25['fields'], self._prefixed('bm25.'), bm25['k1'], bm25['b'])
+
+    def dense_index(self) -> DenseIndex:
+        dense = self.manifest['dense']
+        encoder = HashingEncoder(dense['dim'])
+        if encoder.name != dense['encoder']:
+            raise ValueError(f"Snapshot {self.path} was embedded with {dense['encoder']}")
+        offsets = {ctype: tuple(bounds) for ctype, bounds in dense['offsets'].items()}
+        return DenseIndex(self.arrays['dense.vectors'], self.arrays['dense.rows'], offsets, encoder)
+
+    def essay_graph(self) -> EssayGraph:
+        """The graph adjacency, topic names read from the string table."""
+        return EssayGraph.from_arrays(self.band_scores, self.component_types,
+                                      StringColumn(self.strings, self.arrays['graph_topic_names']),
+                                      self._prefixed('graph.'))
+
+    def warm(self) -> int:
+        """
+        Fault in every page of the snapshot arrays, e.g. before it starts serving.
+
+        Returns:
+            The number of bytes mapped
+        """
+        total = 0
+        for array in self.arrays.values():
+            raw = np.asarray(array).reshape(-1).view(np.uint8)
+            raw[::PAGE_SIZE].sum()
+            total += raw.nbytes
+        return total
+
+    @staticmethod
+    def current_version(source_path: Path, snapshot_dir: str = SNAPSHOT_DIR) -> Optional[str]:
+        """The version the CURRENT pointer of a source names, None if nothing was published."""
+        try:
+            with open(_snapshot_root(source_path, snapshot_dir) / 'CURRENT', 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def open_current(cls, source_path: Path, snapshot_dir: str = SNAPSHOT_DIR,
+                     check_source: bool = True) -> Optional['GraphSnapshot']:
+        """
+        Open the published snapshot of a source.
+
+        Args:
+            source_path: The knowledge graph JSON the snapshot was compiled from
+            snapshot_dir: Directory holding the snapshots
+            check_source: Return None if the source changed since the snapshot was built
+
+        Returns:
+            The snapshot, or None if there is none or it is stale, including one of another
+            format and one pruned between reading ``CURRENT`` and opening it
+        """
+        version = cls.current_version(source_path, snapshot_dir)
+        if version is None:
+            return None
+        try:
+            snapshot = cls(_snapshot_root(source_path, snapshot_dir) / version)
+        except (ValueError, OSError):
+            return None
+        if check_source and snapshot.manifest['source'] != _source_stamp(source_path):
+            return None
+        return snapshot
+
+    @classmethod
+    def build(cls, source_path: Path, snapshot_dir: str = SNAPSHOT_DIR,
+              encoder: HashingEncoder = None) -> 'GraphSnapshot':
+        """
+        Compile a knowledge graph JSON into a new snapshot version and publish it.
+
+        Builders of a source take turns on its ``build.lock``, and one that finds
+        a snapshot of the unchanged source published while it waited returns
+        that instead of compiling again. The version is written to a temporary
+        directory, renamed into place and only then made current, and versions
+        beyond the last ``KEEP_VERSIONS`` are pruned.
+
+        Returns:
+            The published snapshot
+        """
+        source_path = Path(source_path)
+        encoder = encoder or HashingEncoder()
+        root = _snapshot_root(source_path, snapshot_dir)
+        root.mkdir(parents=True, exist_ok=True)
+        lock_fd = os.open(root / 'build.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            snapshot = cls.open_current(source_path, snapshot_dir)
+            if snapshot is not None and snapshot.manifest['dense']['encoder'] == encoder.name:
+                return snapshot
+            return cls._build(source_path, root, encoder)
+        finally:
+            os.close(lock_fd)
+
+    @classmethod
+    def _build(cls, source_path: Path, root: Path, encoder: HashingEncoder) -> 'GraphSnapshot':
+        # Called with the build lock held, so version numbers and the pointer have one writer
+        stamp = _source_stamp(source_path)
+        with open(source_path, 'r', encoding='utf-8') as f:
+            knowledge_graph = json.load(f)
+        essays = knowledge_graph['essays']
+        num_essays = len(essays)
+
+        component_types: List[str] = []
+        for essay in essays:
+            component_types.extend(c for c in essay['components'] if c not in component_types)
+
+        # One string table with every distinct string; components point at their item strings
+        string_ids: Dict[str, int] = {}
+
+        def intern(text: str) -> int:
+            string_id = string_ids.get(text)
+            if string_id is None:
+                string_id = string_ids[text] = len(string_ids)
+            return string_id
+
+        kinds = np.zeros((len(component_types), num_essays), dtype=np.int8)
+        texts = np.full((len(component_types), num_essays), -1, dtype=np.int32)
+        indptr = np.zeros(len(component_types) * num_essays + 1, dtype=np.int64)
+        items: List[int] = []
+        for t, component_type in enumerate(component_types):
+            for i, essay in enumerate(essays):
+                component = essay['components'].get(component_type)
+                if component is not None:
+                    kinds[t, i] = LIST if isinstance(component, list) else TEXT
+                    items.extend(intern(item) for item in (component if kinds[t, i] == LIST else [component]))
+                    # Matches the texts the trigram index keeps, empty lists never match
+                    if not (isinstance(component, list) and not component):
+                        texts[t, i] = intern(component_text(component))
+                indptr[t * num_essays + i + 1] = len(items)
+
+        band_scores = np.array([essay['band_score'] for essay in essays], dtype=np.float64)
+        arrays = {
+            'essay_ids': np.array([intern(str(essay['id'])) for essay in essays], dtype=np.int32),
+            'essay_topics': np.array([intern(essay['topic']) for essay in essays], dtype=np.int32),
+            'band_scores': band_scores,
+            'component_kinds': kinds,
+            'component_texts': texts,
+            'component_indptr': indptr,
+            'component_items': np.array(items, dtype=np.int32)
+        }
+        essay_graph = EssayGraph(essays, band_scores)
+        arrays.update({f"graph.{name}": array for name, array in essay_graph.arrays().items()})
+        arrays['graph_topic_names'] = np.array([intern(name) for name in essay_graph.topic_names], dtype=np.int32)
+        arrays['strings'], arrays['string_offsets'] = StringTable.encode(list(string_ids))
+
+        component_index = ComponentIndex(essays)
+        arrays.update({f"trigram.{name}": array for name, array in component_index.arrays().items()})
+        bm25_index = BM25Index(essays)
+        arrays.update({f"bm25.{name}": array for name, array in bm25_index.arrays().items()})
+        arrays['dense.vectors'], arrays['dense.rows'], offsets = DenseIndex.embed(essays, encoder)
+
+        previous = [int(p.name[1:]) for p in root.glob('v*') if p.name[1:].isdigit()]
+        version = f"v{max(previous, default=0) + 1}"
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            'version': version,
+            'built_at': time.time(),
+            'source': stamp,
+            'num_essays': num_essays,
+            'component_types': component_types,
+            'integer_bands': all(isinstance(essay['band_score'], int) for essay in essays),
+            'metadata': knowledge_graph.get('metadata', {}),
+            'bm25': {'k1': bm25_index.k1, 'b': bm25_index.b, 'fields': bm25_index.fields},
+            'dense': {'encoder': encoder.name, 'dim': encoder.dim, 'offsets': offsets}
+        }
+
+        tmp_dir = root / f".{version}.tmp{os.getpid()}"
+        tmp_dir.mkdir()
+        try:
+            for name, array in arrays.items():
+                np.save(tmp_dir / f"{name}.npy", np.ascontiguousarray(array))
+            with open(tmp_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_dir, root / version)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        pointer = root / f".CURRENT.tmp{os.getpid()}"
+        with open(pointer, 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(pointer, root / 'CURRENT')
+
+        # Workers still serving a pruned version keep reading their open mappings
+        for old in sorted(previous)[:max(0, len(previous) + 1 - KEEP_VERSIONS)]:
+            shutil.rmtree(root / f"v{old}", ignore_errors=True)
+        return cls(root / version)
+
+
+def main(argv: Iterable[str] = None):
+    """Compile a knowledge graph into a published snapshot."""
+    parser = argparse.ArgumentParser(description="Compile a knowledge graph JSON into a memory-mappable snapshot")
+    parser.add_argument('knowledge_graph', nargs='?', default="src/data/ielts_knowledge_graph.json")
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    snapshot = GraphSnapshot.build(Path(args.knowledge_graph), args.snapshot_dir)
+    size = sum(array.nbytes for array in snapshot.arrays.values())
+    print(f"Compiled {snapshot.num_essays} essays into {snapshot.path} ({size / (1 << 20):.1f} MiB) "
+          f"in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,79 @@
 import json
-from typing import List, Dict, Any
+import numpy as np
+from typing import List, Dict, Any, Optional
 from pathlib import Path
+from .component_index import ComponentIndex
+from .bm25_index import BM25Index
+from .dense_index import DenseIndex, EMBEDDING_DIR
+from .essay_graph import EssayGraph
+from .graph_snapshot import GraphSnapshot, SNAPSHOT_DIR
+from .metrics import Gauge, Histogram
+
+INDEX_BUILD_SECONDS = Histogram('knowledge_graph_index_build_seconds',
+                                "Time to load the knowledge graph, open its snapshot or build one of its indexes", ['index'])
+ESSAYS = Gauge('knowledge_graph_essays', "Essays in the most recently loaded knowledge graph")
+
+HIGH_BAND = 7  # Band score from which essays serve as structures and examples
 
 class KnowledgeGraphRAG:
-    def __init__(self, knowledge_graph_path: str = "src/data/ielts_knowledge_graph.json"):
+    def __init__(self, knowledge_graph_path: str = "src/data/ielts_knowledge_graph.json",
+                 embedding_dir: str = EMBEDDING_DIR, snapshot: Optional[GraphSnapshot] = None):
         self.knowledge_graph_path = Path(knowledge_graph_path)
-        self.knowledge_graph = self._load_knowledge_graph()
+        self.snapshot = snapshot  # Compiled snapshot backing the graph, None when parsed from JSON
+        if snapshot is not None:
+            # Every array is memory-mapped, nothing is parsed or rebuilt
+            with INDEX_BUILD_SECONDS.labels('snapshot').time():
+                self.knowledge_graph = {'essays': snapshot.essays, 'metadata': snapshot.metadata}
+                self.band_scores = snapshot.band_scores
+                self.topics = snapshot.topics
+                self.component_index = snapshot.component_index()
+                self.bm25_index = snapshot.bm25_index()
+                self.dense_index = snapshot.dense_index()
+                self.graph = snapshot.essay_graph()
+            ESSAYS.set(snapshot.num_essays)
+            return
+
+        with INDEX_BUILD_SECONDS.labels('load').time():
+            self.knowledge_graph = self._load_knowledge_graph()
+        essays = self.knowledge_graph['essays']
+        self.band_scores = np.array([essay['band_score'] for essay in essays], dtype=np.float64)
+        self.topics = [essay['topic'] for essay in essays]
+        with INDEX_BUILD_SECONDS.labels('component').time():
+            self.component_index = ComponentIndex(essays)
+        with INDEX_BUILD_SECONDS.labels('bm25').time():
+            self.bm25_index = BM25Index(essays)
+        with INDEX_BUILD_SECONDS.labels('dense').time():
+            self.dense_index = DenseIndex.open_or_build(essays, self.knowledge_graph_path, embedding_dir)
+        with INDEX_BUILD_SECONDS.labels('graph').time():
+            self.graph = EssayGraph(essays, self.band_scores)
+        ESSAYS.set(len(essays))
+
+    @classmethod
+    def open(cls, knowledge_graph_path: str = "src/data/ielts_knowledge_graph.json",
+             embedding_dir: str = EMBEDDING_DIR, snapshot_dir: str = SNAPSHOT_DIR) -> 'KnowledgeGraphRAG':
+        """
+        Open the published snapshot of a knowledge graph, compiling one first if it is missing or stale.
+
+        Args:
+            knowledge_graph_path: The knowledge graph JSON
+            embedding_dir: Unused with a snapshot, which carries its own embeddings
+            snapshot_dir: Directory holding the snapshots
+        """
+        snapshot = GraphSnapshot.open_current(Path(knowledge_graph_path), snapshot_dir)
+        if snapshot is None:
+            snapshot = GraphSnapshot.build(Path(knowledge_graph_path), snapshot_dir)
+        return cls(knowledge_graph_path, embedding_dir, snapshot)
+
+    def warm(self):
+        """Fault in the snapshot pages and run each index once, so the first request pays neither."""
+        if self.snapshot is not None:
+            self.snapshot.warm()
+        self.component_index.search('warm')
+        self.bm25_index.top_k('warm')
+        self.dense_index.search_many(['warm'])
+        self.graph.find_topics('warm')
+        if len(self.knowledge_graph['essays']):
+            self.knowledge_graph['essays'][0]
         
     def _load_knowledge_graph(self) -> Dict[str, Any]:
         """Load the knowledge graph from JSON file."""
@@ -23,57 +91,69 @@ class KnowledgeGraphRAG:
         Returns:
             List of relevant essays with their components
         """
-        relevant_essays = []
+        essays = self.knowledge_graph['essays']
+        return [essays[i] for i in self.component_index.search(query, component_type)]
+    
+    def rank_essays(self, query: str, component_type: str = None, top_k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Retrieve the top-k essays for the query ranked by BM25 relevance.
         
-        for essay in self.knowledge_graph['essays']:
-            # Check if component type is specified
-            if component_type:
-                if component_type in essay['components']:
-                    component = essay['components'][component_type]
-                    if isinstance(component, list):
-                        # For data points, check each item
-                        if any(query.lower() in item.lower() for item in component):
-                            relevant_essays.append(essay)
-                    else:
-                        # For single components like claim, warrant, etc.
-                        if query.lower() in component.lower():
-                            relevant_essays.append(essay)
-            else:
-                # Search across all components
-                for component in essay['components'].values():
-                    if isinstance(component, list):
-                        if any(query.lower() in item.lower() for item in component):
-                            relevant_essays.append(essay)
-                            break
-                    else:
-                        if query.lower() in component.lower():
-                            relevant_essays.append(essay)
-                            break
+        Args:
+            query: The search query
+            component_type: Optional component type to score against instead of the whole essay
+            top_k: Maximum number of essays to return
+            
+        Returns:
+            List of essays, best first, each with its BM25 'score' and a normalized 'relevance'
+        """
+        essays = self.knowledge_graph['essays']
+        return [
+            dict(essays[essay_idx], score=score, relevance=relevance)
+            for essay_idx, score, relevance in self.bm25_index.top_k(query, component_type, top_k)
+        ]
+    
+    def semantic_search(self, query: str, component_type: str = None, top_k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Retrieve the top-k essays whose components are closest to the query in embedding space.
         
-        return relevant_essays
+        Args:
+            query: The search query
+            component_type: Optional component type to compare against
+            top_k: Maximum number of essays to return
+            
+        Returns:
+            List of essays, best first, each with its cosine 'score' used as 'relevance'
+        """
+        essays = self.knowledge_graph['essays']
+        return [
+            dict(essays[essay_idx], score=score, relevance=score)
+            for essay_idx, score in self.dense_index.search_many([query], component_type, top_k)[0]
+        ]
     
-    def get_component_examples(self, component_type: str) -> List[Dict[str, Any]]:
+    def _example(self, component_id: int) -> Dict[str, Any]:
+        essay = self.knowledge_graph['essays'][int(self.graph.component_essays[component_id])]
+        component_type = self.graph.component_types[
+            int(np.searchsorted(self.graph.type_indptr, component_id, side='right')) - 1]
+        return {
+            'example': essay['components'][component_type],
+            'topic': essay['topic'],
+            'band_score': essay['band_score']
+        }
+
+    def get_component_examples(self, component_type: str, limit: int = None) -> List[Dict[str, Any]]:
         """
         Get examples of specific argument components from high-scoring essays.
         
         Args:
             component_type: The type of component to retrieve (claim, data, warrant, etc.)
+            limit: Optional maximum number of examples
             
         Returns:
-            List of examples for the specified component type
+            List of examples for the specified component type, highest band first
         """
-        examples = []
-        
-        for essay in self.knowledge_graph['essays']:
-            if essay['band_score'] >= 7 and component_type in essay['components']:
-                component = essay['components'][component_type]
-                examples.append({
-                    'example': component,
-                    'topic': essay['topic'],
-                    'band_score': essay['band_score']
-                })
-        
-        return examples
+        # A prefix of the band-sorted components of the type, a snapshot decodes just those essays
+        return [self._example(component_id)
+                for component_id in self.graph.components(component_type, HIGH_BAND, limit).tolist()]
     
     def get_essay_structure(self, topic: str) -> Dict[str, Any]:
         """
@@ -83,13 +163,37 @@ class KnowledgeGraphRAG:
             topic: The essay topic to search for
             
         Returns:
-            Dictionary containing the essay structure and components
+            Dictionary containing the essay structure and components of the
+            highest-band essay whose topic contains the query, None if there is none
+        """
+        essay_idx = self.graph.best_essay(self.graph.find_topics(topic), HIGH_BAND)
+        if essay_idx is None:
+            return None
+        essay = self.knowledge_graph['essays'][essay_idx]
+        return {
+            'topic': essay['topic'],
+            'components': essay['components'],
+            'band_score': essay['band_score']
+        }
+
+    def get_related_examples(self, text: str, target_type: str = 'rebuttal', via_type: str = 'claim',
+                             top_k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Get components of essays that share concepts with a text, e.g. rebuttals to consider for a claim.
+        
+        Args:
+            text: The source text, e.g. a claim being written
+            target_type: The type of component to return from the related essays
+            via_type: The type of component that must share the concepts, None for any
+            top_k: Maximum number of examples
+            
+        Returns:
+            List of examples, most related first, each with the number of
+            'shared_concepts' and a 'relevance' relative to all concepts of the text
         """
-        for essay in self.knowledge_graph['essays']:
-            if topic.lower() in essay['topic'].lower() and essay['band_score'] >= 7:
-                return {
-                    'topic': essay['topic'],
-                    'components': essay['components'],
-                    'band_score': essay['band_score']
-                }
-        return None 
\ No newline at end of file
+        concepts = self.graph.concepts(text)
+        total = float(self.graph.concept_weights[concepts].sum()) or 1.0
+        return [
+            dict(self._example(component_id), relevance=score / total, shared_concepts=shared)
+            for _, component_id, score, shared in self.graph.related(concepts, target_type, via_type, top_k=top_k)
+        ]
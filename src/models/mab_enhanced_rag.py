@@ -1,15 +1,126 @@
+import re
+import time
+import logging
+import threading
 import numpy as np
-from typing import List, Dict, Any, Tuple
+from collections import Counter as VoteCounter
+from typing import Hashable, List, Dict, Any, Tuple, Optional
 from .knowledge_graph_rag import KnowledgeGraphRAG
+from .bm25_index import tokenize
+from .component_index import component_text
+from .dense_index import EMBEDDING_DIR
+from .graph_snapshot import GraphSnapshot
+from .bandit_store import BanditStateStore, ewma_coefficients
+from .retrieval_cache import RetrievalCache, normalize_query
+from .metrics import Counter, Histogram, SIZE_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+ARM_SECONDS = Histogram('retrieval_arm_seconds', "Execution time of a retrieval arm, batched runs count once",
+                        ['arm', 'mode'])
+ARM_QUERIES = Counter('retrieval_arm_queries_total', "Queries routed to each retrieval arm", ['arm', 'source'])
+BATCH_SIZE = Histogram('retrieval_batch_queries', "Queries per retrieve_many call", buckets=SIZE_BUCKETS)
+SUBQUERIES = Histogram('retrieval_long_query_subqueries', "Sub-queries a long query was decomposed into",
+                       buckets=SIZE_BUCKETS)
+
+# Long-query mode: queries with more words, e.g. a whole essay, are decomposed into sub-queries
+LONG_QUERY_WORDS = 40
+MIN_SUBQUERY_WORDS = 3  # Shorter sentences and phrases carry too little to rank on their own
+MAX_SUBQUERY_WORDS = 25  # Longer sentences are cut into phrases of at most this many words
+RRF_K = 60  # Reciprocal-rank fusion constant, damps the weight of the very first ranks
+RRF_DEPTH = 20  # Ranked results per sub-query that take part in the fusion
+SUBQUERY_PATTERN = re.compile(r'[^.!?;:\n]+')
+EXAMPLE_COMPONENTS = ['claim', 'data', 'warrant']  # Component keywords arm 2 looks for in a query
+
+
+def decompose_query(query: str) -> List[str]:
+    """
+    Split a long query into sentence and phrase sub-queries.
+
+    Sentences are cut at terminators, semicolons, colons and line breaks, and
+    sentences longer than MAX_SUBQUERY_WORDS into phrases. Each segment is
+    tokenized once to drop fragments below MIN_SUBQUERY_WORDS and sub-queries
+    with the same tokens; the original text is kept so substring matching
+    still sees it as written.
+
+    Returns:
+        The distinct sub-queries in order of appearance
+    """
+    subqueries, seen = [], set()
+    for match in SUBQUERY_PATTERN.finditer(query):
+        words = match.group().split()
+        for start in range(0, len(words), MAX_SUBQUERY_WORDS):
+            phrase = ' '.join(words[start:start + MAX_SUBQUERY_WORDS])
+            key = ' '.join(tokenize(phrase))
+            if key.count(' ') + 1 < MIN_SUBQUERY_WORDS or key in seen:
+                continue
+            seen.add(key)
+            subqueries.append(phrase)
+    return subqueries
+
+
+def result_text(result: Dict[str, Any]) -> str:
+    """The text of a retrieved example, structure or essay that its relevance to a query is measured on"""
+    if 'example' in result:
+        return component_text(result['example'])
+    return ' '.join(component_text(component) for component in result['components'].values())
+
+
+def reciprocal_rank_fusion(rankings: List[List[Hashable]], k: int = RRF_K) -> List[Tuple[Hashable, float]]:
+    """
+    Fuse rankings with reciprocal-rank fusion: an item scores the sum of 1 / (k + rank) over the rankings.
+
+    Returns:
+        (item, fused score) pairs, best first; ties keep the order of first appearance
+    """
+    fused: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda entry: -entry[1])
+
 
 class MABEnhancedRAG:
-    def __init__(self, knowledge_graph_path: str = "src/data/ielts_knowledge_graph.json"):
-        self.knowledge_graph_rag = KnowledgeGraphRAG(knowledge_graph_path)
-        self.num_arms = 3  # Number of retrieval methods
+    num_arms = 4  # Number of retrieval methods
+
+    def __init__(self, knowledge_graph_path: str = "src/data/ielts_knowledge_graph.json",
+                 top_k: Optional[int] = 5, state_store: Optional[BanditStateStore] = None,
+                 cache: Optional[RetrievalCache] = None, cache_hits_update_bandit: bool = False,
+                 embedding_dir: str = EMBEDDING_DIR, snapshot_dir: Optional[str] = None):
+        self.knowledge_graph_path = knowledge_graph_path
+        self.embedding_dir = embedding_dir  # Where the dense index of the knowledge graph is kept
+        self.snapshot_dir = snapshot_dir  # Where compiled snapshots are published, None to parse the JSON
+        self.snapshot_check_interval = 5.0  # Seconds between checks for snapshots published by other workers
+        self._last_snapshot_check = time.monotonic()
+        self._reload_lock = threading.Lock()
+        self.knowledge_graph_rag = self._open_knowledge_graph()
+        self.top_k = top_k  # Ranked result bound for direct search, None for unranked matching
+        self.long_query_words = LONG_QUERY_WORDS  # Word count above which queries are decomposed, None to never
         self.arm_values = np.zeros(self.num_arms)  # Estimated values for each arm
         self.arm_counts = np.zeros(self.num_arms)  # Number of times each arm was pulled
         self.alpha = 0.1  # Learning rate
-        self.epsilon = 0.1  # Exploration rate
+        self.ucb_alpha = 0.5  # LinUCB exploration strength
+        self.latency_weight = 0.2  # Share of the reward traded for speed
+        self.latency_scale = 0.05  # Arm latency (seconds) at which half the latency penalty applies
+        self.context_dim = 6  # Query features plus a bias term
+        # LinUCB per-arm inverse design matrices and reward-weighted feature sums
+        self.A_inv = np.repeat(np.eye(self.context_dim)[None], self.num_arms, axis=0)
+        self.b = np.zeros((self.num_arms, self.context_dim))
+        self.arm_latency = np.zeros(self.num_arms)  # Smoothed latency of each arm in seconds
+        self.state_store = state_store  # Optional cross-process store for the arm statistics
+        self.sync_interval = 5.0  # Seconds between merges of other workers' contextual statistics
+        self._last_sync = 0.0
+        self.cache = cache  # Optional cache of arm results keyed by normalized query, component type and arm
+        self.cache_hits_update_bandit = cache_hits_update_bandit  # Whether served-from-cache pulls still train the bandit
+        self._lock = threading.Lock()
+        # Series resolved once so the request path never builds label tuples
+        self._arm_seconds = [(ARM_SECONDS.labels(arm, 'single'), ARM_SECONDS.labels(arm, 'batch'))
+                             for arm in range(self.num_arms)]
+        self._arm_queries = [(ARM_QUERIES.labels(arm, 'executed'), ARM_QUERIES.labels(arm, 'cached'))
+                             for arm in range(self.num_arms)]
+        if self.state_store is not None:
+            self.arm_counts, self.arm_values = self.state_store.snapshot()
+            self._sync_context()
         
     def _extract_features(self, query: str) -> np.ndarray:
         """Extract features from the query for routing."""
@@ -22,35 +133,91 @@ class MABEnhancedRAG:
         features[4] = 1.0 if 'rebuttal' in query.lower() else 0.0
         return features
 
+    def _context(self, features: np.ndarray) -> np.ndarray:
+        """Append the bias term to the query features."""
+        return np.append(features, 1.0)
+
     def _select_arm(self, features: np.ndarray) -> int:
-        """Select an arm using epsilon-greedy strategy."""
-        if np.random.random() < self.epsilon:
-            return np.random.randint(self.num_arms)
-        return np.argmax(self.arm_values)
+        """Select an arm using the LinUCB upper confidence bound of the query features."""
+        return int(self._select_arms(features[None])[0])
 
-    def _get_reward(self, selected_arm: int, results: List[Dict[str, Any]]) -> float:
-        """Calculate reward based on retrieval results."""
-        if not results:
-            return 0.0
-        
-        # Reward based on number of relevant results and their band scores
-        reward = 0.0
+    def _select_arms(self, features: np.ndarray) -> np.ndarray:
+        """Select an arm for every row of a (queries, features) matrix at once."""
+        X = np.hstack([features, np.ones((len(features), 1))])
+        theta = np.einsum('aij,aj->ai', self.A_inv, self.b)  # Ridge estimate per arm
+        width = np.sqrt(np.maximum(np.einsum('ni,aij,nj->na', X, self.A_inv, X), 0.0))
+        return np.argmax(X @ theta.T + self.ucb_alpha * width, axis=1)
+
+    def _get_reward(self, selected_arm: int, results: List[Dict[str, Any]], latency: float = 0.0) -> float:
+        """Calculate reward based on retrieval results and the time the arm took."""
+        # Reward based on the band scores of the results weighted by their relevance to the query,
+        # results without one earn nothing; finding nothing is worth no quality but still pays for
+        # the time it took
+        quality = 0.0
         for result in results:
-            reward += result.get('band_score', 0) / 9.0  # Normalize by max band score
+            quality += result.get('relevance', 0.0) * result.get('band_score', 0) / 9.0  # Normalize by max band score
+        if results:
+            quality /= len(results)
         
-        return reward / len(results)
+        # Saturating latency cost in [0, 1), so slow arms only win when clearly better
+        cost = latency / (latency + self.latency_scale)
+        return (1 - self.latency_weight) * quality - self.latency_weight * cost
+
+    def _sync_context(self):
+        """Replace the local LinUCB statistics with the ones merged across workers."""
+        A, self.b = self.state_store.context_snapshot(self.context_dim)
+        self.A_inv = np.linalg.inv(A)
+        self._last_sync = time.monotonic()
 
-    def _update_arm_value(self, arm: int, reward: float):
+    def _update_arm_value(self, arm: int, reward: float, features: np.ndarray = None, latency: float = 0.0):
         """Update the estimated value of the selected arm."""
-        self.arm_counts[arm] += 1
-        self.arm_values[arm] += self.alpha * (reward - self.arm_values[arm])
+        x = self._context(features if features is not None else np.zeros(self.context_dim - 1))
+        with self._lock:
+            # Sherman-Morrison rank-1 update of the inverse design matrix
+            A_inv_x = self.A_inv[arm] @ x
+            self.A_inv[arm] -= np.outer(A_inv_x, A_inv_x) / (1.0 + x @ A_inv_x)
+            self.b[arm] += reward * x
+            self.arm_latency[arm] += self.alpha * (latency - self.arm_latency[arm])
+
+            if self.state_store is not None:
+                # Atomic update merged with the pulls of every other worker
+                self.arm_counts, self.arm_values = self.state_store.record(arm, reward, self.alpha, x)
+                if time.monotonic() - self._last_sync >= self.sync_interval:
+                    self._sync_context()
+            else:
+                self.arm_counts[arm] += 1
+                self.arm_values[arm] += self.alpha * (reward - self.arm_values[arm])
+
+    def _update_arm_values(self, arms: np.ndarray, rewards: np.ndarray,
+                           features: np.ndarray, latencies: np.ndarray):
+        """Apply the updates of a batch of pulls, one vectorized step per arm."""
+        X = np.hstack([features, np.ones((len(features), 1))])
+        with self._lock:
+            for arm in np.unique(arms).tolist():
+                mask = arms == arm
+                X_arm = X[mask]
+                # Batch update in design-matrix space; the context dimension is tiny
+                self.A_inv[arm] = np.linalg.inv(np.linalg.inv(self.A_inv[arm]) + X_arm.T @ X_arm)
+                self.b[arm] += rewards[mask] @ X_arm
+                decay, increment = ewma_coefficients(latencies[mask], self.alpha)
+                self.arm_latency[arm] = decay * self.arm_latency[arm] + increment
+                if self.state_store is None:
+                    decay, increment = ewma_coefficients(rewards[mask], self.alpha)
+                    self.arm_counts[arm] += mask.sum()
+                    self.arm_values[arm] = decay * self.arm_values[arm] + increment
 
-    def retrieve(self, query: str) -> Tuple[List[Dict[str, Any]], int]:
+            if self.state_store is not None:
+                self.arm_counts, self.arm_values = self.state_store.record_batch(arms, rewards, self.alpha, X)
+                if time.monotonic() - self._last_sync >= self.sync_interval:
+                    self._sync_context()
+
+    def retrieve(self, query: str, component_type: str = None) -> Tuple[List[Dict[str, Any]], int]:
         """
         Retrieve relevant essays using MAB-enhanced RAG.
         
         Args:
             query: The search query
+            component_type: Optional component type to restrict the search to
             
         Returns:
             Tuple of (retrieved essays, selected arm index)
@@ -58,30 +225,353 @@ class MABEnhancedRAG:
         features = self._extract_features(query)
         selected_arm = self._select_arm(features)
         
-        # Different retrieval methods based on selected arm
+        results, latency, cached = self._execute_arm(selected_arm, query, component_type)
+        
+        # Calculate reward and update arm value
+        if not cached or self.cache_hits_update_bandit:
+            reward = self._get_reward(selected_arm, results, latency)
+            self._update_arm_value(selected_arm, reward, features, latency)
+        
+        return results, selected_arm
+
+    def _execute_arm(self, selected_arm: int, query: str,
+                     component_type: str = None) -> Tuple[List[Dict[str, Any]], float, bool]:
+        """
+        Run an arm through the result cache, if any.
+        
+        Returns:
+            Tuple of (results, execution latency in seconds, whether served from the cache).
+            Cache hits report the latency of the execution that produced them.
+        """
+        def run():
+            start = time.perf_counter()
+            results = self._run_arm(self.knowledge_graph_rag, selected_arm, query, component_type)
+            latency = time.perf_counter() - start
+            self._arm_seconds[selected_arm][0].observe(latency)
+            return results, latency
+        
+        if self.cache is None:
+            cached = False
+            results, latency = run()
+        else:
+            key = (normalize_query(query), component_type, selected_arm)
+            (results, latency), cached = self.cache.get_or_compute(key, run)
+        self._arm_queries[selected_arm][cached].inc()
+        return results, latency, cached
+
+    def retrieve_many(self, queries: List[str],
+                      component_types: List[Optional[str]] = None) -> List[Tuple[List[Dict[str, Any]], int]]:
+        """
+        Retrieve relevant essays for a batch of queries in a single pass.
+        
+        Arms are selected for all queries at once, the queries routed to the same
+        arm are executed together and all bandit updates are applied in one batch.
+        
+        Args:
+            queries: The search queries
+            component_types: Optional component type filter per query
+            
+        Returns:
+            List of (retrieved essays, selected arm index), in query order
+        """
+        if not queries:
+            return []
+        component_types = component_types or [None] * len(queries)
+        BATCH_SIZE.observe(len(queries))
+        features = np.array([self._extract_features(query) for query in queries])
+        arms = self._select_arms(features)
+        
+        results: List[List[Dict[str, Any]]] = [[] for _ in queries]
+        latencies = np.zeros(len(queries))
+        cached = np.zeros(len(queries), dtype=bool)
+        generation = self.cache.generation if self.cache is not None else None
+        # Every arm of the batch runs against the graph served when it started, even across a reload
+        kg_rag = self.knowledge_graph_rag
+        for arm in np.unique(arms).tolist():
+            # Serve what the cache has and run each distinct missing key only once
+            pending: Dict[Tuple, List[int]] = {}
+            for i in np.flatnonzero(arms == arm).tolist():
+                key = (normalize_query(queries[i]), component_types[i], arm)
+                if key in pending:
+                    # Collapsed onto the execution of an identical query in this batch
+                    pending[key].append(i)
+                    cached[i] = True
+                    continue
+                if self.cache is not None:
+                    hit, found = self.cache.get(key)
+                    if found:
+                        results[i], latencies[i] = hit
+                        cached[i] = True
+                        continue
+                pending[key] = [i]
+            hits = int(np.count_nonzero(cached[arms == arm]))
+            if hits:
+                self._arm_queries[arm][1].inc(hits)
+            if not pending:
+                continue
+            
+            firsts = [indices[0] for indices in pending.values()]
+            start = time.perf_counter()
+            arm_results = self._run_arm_many(
+                kg_rag, arm, [queries[i] for i in firsts], [component_types[i] for i in firsts]
+            )
+            elapsed = time.perf_counter() - start
+            self._arm_seconds[arm][1].observe(elapsed)
+            self._arm_queries[arm][0].inc(len(firsts))
+            # Each query is charged its share of the batched execution time
+            latency = elapsed / len(firsts)
+            for (key, indices), result in zip(pending.items(), arm_results):
+                for i in indices:
+                    results[i], latencies[i] = result, latency
+                if self.cache is not None:
+                    self.cache.put(key, (result, latency), generation)
+        
+        update = ~cached | self.cache_hits_update_bandit
+        if update.any():
+            rewards = np.array([
+                self._get_reward(arm, result, latency)
+                for arm, result, latency in zip(arms.tolist(), results, latencies.tolist())
+            ])
+            self._update_arm_values(arms[update], rewards[update], features[update], latencies[update])
+        
+        return list(zip(results, arms.tolist()))
+
+    def _subqueries(self, query: str) -> Optional[List[str]]:
+        """Sub-queries of a long query, None for queries that are run as they are."""
+        if self.long_query_words is None or len(query.split()) <= self.long_query_words:
+            return None
+        subqueries = decompose_query(query)
+        if len(subqueries) < 2:
+            return None
+        SUBQUERIES.observe(len(subqueries))
+        return subqueries
+
+    def _example_component(self, query: str, subqueries: Optional[List[str]] = None) -> Optional[str]:
+        """Component type arm 2 serves examples of: the first keyword named, by majority over sub-queries"""
+        if subqueries is None:
+            return next((c for c in EXAMPLE_COMPONENTS if c in query.lower()), None)
+        votes = VoteCounter(filter(None, (self._example_component(subquery) for subquery in subqueries)))
+        return votes.most_common(1)[0][0] if votes else None
+
+    def _probe_many(self, kg_rag: KnowledgeGraphRAG, selected_arm: int, queries: List[str],
+                    component_type: Optional[str], top_k: int) -> List[List[Tuple[int, float, float]]]:
+        """Run queries through the index of a ranked arm in one batch, as (essay index, score, relevance)."""
+        if selected_arm == 0:
+            return kg_rag.bm25_index.top_k_many(queries, component_type, top_k)
+        return [[(essay_idx, score, score) for essay_idx, score in ranked]
+                for ranked in kg_rag.dense_index.search_many(queries, component_type, top_k)]
+
+    @staticmethod
+    def _with_relevance(kg_rag: KnowledgeGraphRAG, query: str,
+                        results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Attach the query relevance to results an arm picked without ranking them by the query.
+
+        Examples, structures and substring matches are chosen by component type,
+        topic or a literal match, so their relevance is the cosine similarity of
+        their text to the query, the measure the dense arm ranks by.
+        """
+        if not results:
+            return results
+        relevance = kg_rag.dense_index.similarity([query], [result_text(result) for result in results])[0]
+        return [dict(result, relevance=r) for result, r in zip(results, relevance.tolist())]
+
+    def _fuse(self, rankings: List[List[int]], top_k: Optional[int]) -> List[Tuple[int, float, float]]:
+        """
+        Fuse per sub-query essay rankings into one list of (essay index, fused score, relevance).
+
+        Relevance is the fused score relative to an essay ranked first by every sub-query.
+        """
+        fused = reciprocal_rank_fusion(rankings)
+        if top_k:
+            fused = fused[:top_k]
+        best = len(rankings) / (RRF_K + 1) or 1.0
+        return [(essay_idx, score, min(score / best, 1.0)) for essay_idx, score in fused]
+
+    def _run_arm_many(self, kg_rag: KnowledgeGraphRAG, selected_arm: int, queries: List[str],
+                      component_types: List[Optional[str]],
+                      subqueries: List[Optional[List[str]]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Execute the retrieval method of an arm for a batch of queries.
+
+        The graph is passed in by the caller, which took it once for the whole
+        request: essay indices of its indexes are only valid in its own essays.
+        """
+        essays = kg_rag.knowledge_graph['essays']
+        results: List[List[Dict[str, Any]]] = [[] for _ in queries]
+        subqueries = subqueries or [self._subqueries(query) for query in queries]
+        
+        if selected_arm in (0, 3) and (selected_arm == 3 or self.top_k):
+            # Index-backed arms score every query sharing a filter in one vectorized call, and the
+            # sub-queries of all long queries sharing it in one more
+            top_k = self.top_k or 5
+            for component_type in set(component_types):
+                indices = [i for i, c in enumerate(component_types) if c == component_type]
+                short = [i for i in indices if subqueries[i] is None]
+                if short:
+                    ranked = self._probe_many(kg_rag, selected_arm, [queries[i] for i in short], component_type, top_k)
+                    for i, hits in zip(short, ranked):
+                        results[i] = [dict(essays[e], score=s, relevance=r) for e, s, r in hits]
+                long = [i for i in indices if subqueries[i] is not None]
+                if long:
+                    ranked = self._probe_many(kg_rag, selected_arm, [q for i in long for q in subqueries[i]],
+                                              component_type, max(RRF_DEPTH, top_k))
+                    offset = 0
+                    for i in long:
+                        rankings = [[e for e, _, _ in hits] for hits in ranked[offset:offset + len(subqueries[i])]]
+                        offset += len(subqueries[i])
+                        results[i] = [dict(essays[e], score=s, relevance=r)
+                                      for e, s, r in self._fuse(rankings, top_k)]
+        elif selected_arm == 2:
+            # Examples only depend on the component type: fetch each type once and score
+            # them against all of its queries in one product
+            by_type: Dict[str, List[int]] = {}
+            for i, (query, component_type) in enumerate(zip(queries, component_types)):
+                component_type = component_type or self._example_component(query, subqueries[i])
+                if component_type:
+                    by_type.setdefault(component_type, []).append(i)
+            for component_type, indices in by_type.items():
+                examples = kg_rag.get_component_examples(component_type, self.top_k)
+                relevance = kg_rag.dense_index.similarity([queries[i] for i in indices],
+                                                          [result_text(example) for example in examples])
+                for i, row in zip(indices, relevance.tolist()):
+                    results[i] = [dict(example, relevance=r) for example, r in zip(examples, row)]
+        else:
+            for i, (query, component_type) in enumerate(zip(queries, component_types)):
+                if subqueries[i] is not None:
+                    results[i] = self._run_long_query(kg_rag, selected_arm, subqueries[i], component_type)
+                else:
+                    results[i] = self._run_arm(kg_rag, selected_arm, query, component_type)
+        return results
+
+    def _run_long_query(self, kg_rag: KnowledgeGraphRAG, selected_arm: int, subqueries: List[str],
+                        component_type: str = None) -> List[Dict[str, Any]]:
+        """Run the sub-queries of a long query through an unranked arm and fuse what they find."""
+        if selected_arm == 0:
+            essays = kg_rag.knowledge_graph['essays']
+            rankings = [kg_rag.component_index.search(subquery, component_type) for subquery in subqueries]
+            return [dict(essays[e], relevance=r) for e, _, r in self._fuse(rankings, None)]
+        # Structure-based search: the structure whose topic most sub-queries name
+        structures = {}
+        rankings = []
+        for subquery in subqueries:
+            structure = kg_rag.get_essay_structure(subquery)
+            rankings.append([structure['topic']] if structure else [])
+            if structure:
+                structures.setdefault(structure['topic'], structure)
+        fused = reciprocal_rank_fusion(rankings)
+        return self._with_relevance(kg_rag, ' '.join(subqueries), [structures[fused[0][0]]] if fused else [])
+
+    def _run_arm(self, kg_rag: KnowledgeGraphRAG, selected_arm: int, query: str,
+                 component_type: str = None) -> List[Dict[str, Any]]:
+        """Execute the retrieval method of an arm against the graph the request started with."""
+        subqueries = self._subqueries(query)
+        if subqueries is not None:
+            if selected_arm == 3 or (selected_arm == 0 and self.top_k):
+                return self._run_arm_many(kg_rag, selected_arm, [query], [component_type], [subqueries])[0]
+            if selected_arm in (0, 1):
+                return self._run_long_query(kg_rag, selected_arm, subqueries, component_type)
+        
         if selected_arm == 0:
-            # Method 1: Direct component search
-            results = self.knowledge_graph_rag.get_relevant_essays(query)
+            # Method 1: Direct component search, BM25-ranked unless unbounded
+            if self.top_k:
+                results = kg_rag.rank_essays(query, component_type, self.top_k)
+            else:
+                results = self._with_relevance(kg_rag, query, kg_rag.get_relevant_essays(query, component_type))
         elif selected_arm == 1:
             # Method 2: Structure-based search
-            results = self.knowledge_graph_rag.get_essay_structure(query)
-            results = [results] if results else []
-        else:
+            results = kg_rag.get_essay_structure(query)
+            results = self._with_relevance(kg_rag, query, [results] if results else [])
+        elif selected_arm == 2:
             # Method 3: Example-based search
-            component_type = next((c for c in ['claim', 'data', 'warrant'] 
-                                 if c in query.lower()), None)
-            results = self.knowledge_graph_rag.get_component_examples(component_type) if component_type else []
+            component_type = component_type or self._example_component(query, subqueries)
+            # Bounded like the ranked arms, so it is not charged or credited for a whole component type
+            results = kg_rag.get_component_examples(component_type, self.top_k) if component_type else []
+            results = self._with_relevance(kg_rag, query, results)
+        else:
+            # Method 4: Dense-vector search over precomputed component embeddings
+            results = kg_rag.semantic_search(query, component_type, self.top_k or 5)
+        return results
+
+    def _open_knowledge_graph(self) -> KnowledgeGraphRAG:
+        if self.snapshot_dir is None:
+            return KnowledgeGraphRAG(self.knowledge_graph_path, self.embedding_dir)
+        return KnowledgeGraphRAG.open(self.knowledge_graph_path, self.embedding_dir, self.snapshot_dir)
+
+    def _swap_knowledge_graph(self, knowledge_graph_rag: KnowledgeGraphRAG):
+        """Swap in a warmed knowledge graph; requests already running keep the one they started with."""
+        knowledge_graph_rag.warm()
+        self.knowledge_graph_rag = knowledge_graph_rag
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def reload_knowledge_graph(self):
+        """
+        Reload the knowledge graph from disk and drop every cached result.
         
-        # Calculate reward and update arm value
-        reward = self._get_reward(selected_arm, results)
-        self._update_arm_value(selected_arm, reward)
+        With snapshots, the JSON is compiled into a new snapshot version that is
+        published for the other workers too.
+        """
+        with self._reload_lock:
+            if self.snapshot_dir is None:
+                self._swap_knowledge_graph(KnowledgeGraphRAG(self.knowledge_graph_path, self.embedding_dir))
+            else:
+                snapshot = GraphSnapshot.build(self.knowledge_graph_path, self.snapshot_dir)
+                self._swap_knowledge_graph(KnowledgeGraphRAG(self.knowledge_graph_path, self.embedding_dir, snapshot))
+
+    def check_snapshot(self) -> bool:
+        """
+        Look for a snapshot version another worker published, at most every ``snapshot_check_interval`` seconds.
         
-        return results, selected_arm
+        A new version is opened and warmed on a background thread and swapped in
+        when ready, the calling request never waits for it.
+        
+        Returns:
+            Whether a new version is being swapped in
+        """
+        if self.snapshot_dir is None or time.monotonic() - self._last_snapshot_check < self.snapshot_check_interval:
+            return False
+        # While a reload runs everyone else skips the check instead of waiting
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        self._last_snapshot_check = time.monotonic()
+        current = self.knowledge_graph_rag.snapshot
+        version = GraphSnapshot.current_version(self.knowledge_graph_path, self.snapshot_dir)
+        if version is None or (current is not None and current.version == version):
+            self._reload_lock.release()
+            return False
+        threading.Thread(target=self._load_published_snapshot, name='snapshot-reload', daemon=True).start()
+        return True
+
+    def _load_published_snapshot(self):
+        try:
+            snapshot = GraphSnapshot.open_current(self.knowledge_graph_path, self.snapshot_dir, check_source=False)
+            # Pruned or of another format meanwhile: keep serving and look again at the next check,
+            # never fall back to parsing the JSON and rebuilding every index here
+            if snapshot is not None:
+                self._swap_knowledge_graph(KnowledgeGraphRAG(self.knowledge_graph_path, self.embedding_dir, snapshot))
+        except Exception:
+            logger.exception("Could not swap in the published snapshot of %s, retrying at the next check",
+                             self.knowledge_graph_path)
+        finally:
+            self._reload_lock.release()
+
+    def get_snapshot_version(self) -> Optional[str]:
+        """Version of the snapshot being served, None when the graph was parsed from JSON."""
+        snapshot = self.knowledge_graph_rag.snapshot
+        return snapshot.version if snapshot is not None else None
 
     def get_arm_statistics(self) -> Dict[str, Any]:
         """Get statistics about the performance of each arm."""
-        return {
+        if self.state_store is not None:
+            with self._lock:
+                self.arm_counts, self.arm_values = self.state_store.snapshot()
+        statistics = {
             'arm_values': self.arm_values.tolist(),
             'arm_counts': self.arm_counts.tolist(),
+            'arm_latency_ms': (self.arm_latency * 1000).tolist(),
             'best_arm': int(np.argmax(self.arm_values))
-        } 
\ No newline at end of file
+        }
+        if self.cache is not None:
+            statistics['cache'] = self.cache.get_statistics()
+        return statistics 
\ No newline at end of file
@@ -0,0 +1,154 @@
+import os
+import time
+import fcntl
+import threading
+import numpy as np
+from typing import Iterable, Tuple
+
+MAGIC = b'AMAJ'
+VERSION = 1
+HEADER_SIZE = 16
+
+# Fixed-size little-endian record, so the log can be read back as one NumPy array
+ATTEMPT_DTYPE = np.dtype([
+    ('user_id', '<i8'),
+    ('item_id', '<i4'),
+    ('correct', '<i4'),
+    ('timestamp', '<f8')
+])
+
+
+class AttemptJournal:
+    """
+    Append-only binary write-ahead log of learner attempts.
+
+    Each attempt is one 24-byte record appended with a single ``write``, which
+    makes it safe against process crashes. ``sync`` fsyncs the file and is meant
+    to be called in batches (group commit) off the request path. Attempts are
+    addressed by their sequence number, the record index in the file, which
+    checkpoints store to know where replay has to resume.
+
+    A ``shared`` journal is appended to by several processes, the serving
+    workers, and followed by the trainer process. Appends then hold a shared
+    ``flock`` so that dropping a torn tail, which takes it exclusively, never
+    cuts into a record another process is writing, and ``refresh`` picks up
+    what the other processes appended.
+    """
+
+    def __init__(self, path: str, fsync_interval: float = 1.0, shared: bool = False):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.shared = shared
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        size = os.fstat(self._fd).st_size
+        if size == 0:
+            os.write(self._fd, MAGIC + VERSION.to_bytes(4, 'little') + bytes(HEADER_SIZE - 8))
+            os.fsync(self._fd)
+            size = HEADER_SIZE
+        else:
+            header = os.pread(self._fd, HEADER_SIZE, 0)
+            if header[:4] != MAGIC:
+                raise ValueError(f"{path} is not an attempt journal")
+
+        # A crash can leave a torn record at the end, drop it
+        if shared:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            size = os.fstat(self._fd).st_size
+        try:
+            records, torn = divmod(size - HEADER_SIZE, ATTEMPT_DTYPE.itemsize)
+            if torn:
+                os.ftruncate(self._fd, HEADER_SIZE + records * ATTEMPT_DTYPE.itemsize)
+        finally:
+            if shared:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._length = records
+        self._synced_length = records
+        self._last_sync = time.monotonic()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, user_id: int, item_id: int, correct: int) -> int:
+        """
+        Append one attempt.
+
+        Returns:
+            The sequence number of the attempt
+        """
+        return self.append_many([(user_id, item_id, correct)])
+
+    def append_many(self, attempts: Iterable[Tuple[int, int, int]]) -> int:
+        """
+        Append attempts with a single write.
+
+        Returns:
+            The sequence number of the first appended attempt
+        """
+        now = time.time()
+        records = np.array([(u, i, c, now) for u, i, c in attempts], dtype=ATTEMPT_DTYPE)
+        if self.shared:
+            return self._append_shared(records)
+        with self._lock:
+            os.write(self._fd, records.tobytes())
+            first = self._length
+            self._length += len(records)
+        return first
+
+    def _append_shared(self, records: np.ndarray) -> int:
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                os.write(self._fd, records.tobytes())
+                # O_APPEND leaves the offset of this descriptor at the end of our own write
+                end = (os.lseek(self._fd, 0, os.SEEK_CUR) - HEADER_SIZE) // ATTEMPT_DTYPE.itemsize
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._length = max(self._length, end)
+        return end - len(records)
+
+    def refresh(self) -> int:
+        """
+        Pick up attempts other processes appended to a shared journal.
+
+        A record still being written is only counted once it is complete.
+
+        Returns:
+            The number of attempts in the journal
+        """
+        records = (os.fstat(self._fd).st_size - HEADER_SIZE) // ATTEMPT_DTYPE.itemsize
+        with self._lock:
+            self._length = max(self._length, records)
+            return self._length
+
+    def sync(self, force: bool = False):
+        """fsync appended attempts, at most once per ``fsync_interval`` unless forced."""
+        with self._lock:
+            length = self._length
+            if length == self._synced_length:
+                return
+            if not force and time.monotonic() - self._last_sync < self.fsync_interval:
+                return
+        os.fsync(self._fd)
+        with self._lock:
+            self._synced_length = max(self._synced_length, length)
+            self._last_sync = time.monotonic()
+
+    def read(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """
+        Read attempts ``[start, stop)`` as a structured array with ``ATTEMPT_DTYPE`` fields.
+        """
+        stop = self._length if stop is None else min(stop, self._length)
+        if start >= stop:
+            return np.empty(0, dtype=ATTEMPT_DTYPE)
+        data = os.pread(self._fd, (stop - start) * ATTEMPT_DTYPE.itemsize,
+                        HEADER_SIZE + start * ATTEMPT_DTYPE.itemsize)
+        return np.frombuffer(data, dtype=ATTEMPT_DTYPE)
+
+    def close(self):
+        """Sync and close the journal."""
+        self.sync(force=True)
+        os.close(self._fd)
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import argparse
+import torch
+import numpy as np
+from typing import Callable, Dict, Any, List
+from .neuralcdm import NeuralCDM
+from .item_bank import ItemBank
+from .inference import export_inference_model
+
+
+def time_calls(call: Callable[[], Any], iterations: int, warmup: int = 20) -> np.ndarray:
+    """Run a call repeatedly and return per-call latencies in seconds"""
+    for _ in range(warmup):
+        call()
+    latencies = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter()
+        call()
+        latencies[i] = time.perf_counter() - start
+    return latencies
+
+
+def benchmark(model: NeuralCDM, batch_sizes: List[int], iterations: int = 500,
+              drift_samples: int = 100000, seed: int = 0) -> Dict[str, Any]:
+    """
+    Compare the float model with the scripted float and scripted int8 artifacts.
+
+    Student abilities are sampled like trained embeddings, so every variant
+    sees identical inputs and only the item side of the model is measured.
+
+    Returns:
+        Latency percentiles and throughput per variant and batch size, and the
+        prediction drift of each artifact against the float model
+    """
+    model.eval()
+    generator = torch.Generator().manual_seed(seed)
+    variants = {
+        'float': lambda abilities, item_ids: model.predict(abilities, item_ids),
+        'float_script': export_inference_model(model, quantize=False),
+        'int8_script': export_inference_model(model, quantize=True)
+    }
+
+    def run(name, abilities, item_ids):
+        # The float model keeps its usual no_grad read path, the artifacts use inference_mode
+        if name == 'float':
+            with torch.no_grad():
+                return variants[name](abilities, item_ids)
+        with torch.inference_mode():
+            return variants[name](abilities, item_ids)
+
+    results = {'threads': torch.get_num_threads(), 'latency': {}, 'drift': {}}
+    for batch_size in batch_sizes:
+        abilities = torch.randn(batch_size, model.num_skills, generator=generator)
+        item_ids = torch.randint(0, model.num_items, (batch_size,), generator=generator)
+        for name in variants:
+            latencies = time_calls(lambda: run(name, abilities, item_ids), iterations)
+            results['latency'].setdefault(name, {})[batch_size] = {
+                'p50_ms': float(np.percentile(latencies, 50) * 1000),
+                'p99_ms': float(np.percentile(latencies, 99) * 1000),
+                'predictions_per_second': float(batch_size / latencies.mean())
+            }
+
+    abilities = torch.randn(drift_samples, model.num_skills, generator=generator)
+    item_ids = torch.randint(0, model.num_items, (drift_samples,), generator=generator)
+    reference = run('float', abilities, item_ids)
+    for name in ('float_script', 'int8_script'):
+        predictions = run(name, abilities, item_ids)
+        difference = (predictions - reference).abs()
+        agreement = ((predictions >= 0.5) == (reference >= 0.5)).float().mean()
+        results['drift'][name] = {
+            'max_abs': float(difference.max()),
+            'mean_abs': float(difference.mean()),
+            'decision_agreement': float(agreement)
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NeuralCDM inference artifacts")
+    parser.add_argument('--checkpoint', default='models/saved/neuralcdm_model.pt',
+                        help="Model checkpoint, a freshly initialized model is used when it is missing")
+    parser.add_argument('--qmatrix', default='src/data/qmatrix.json')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 64, 1024])
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=1, help="Torch threads, 1 measures per-core throughput")
+    parser.add_argument('--output', help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    item_bank = ItemBank.load(args.qmatrix)
+    if os.path.exists(args.checkpoint):
+        checkpoint = NeuralCDM.read_checkpoint(args.checkpoint)
+        # Only the item side is benchmarked, student rows are not needed
+        state_dict = dict(checkpoint['model_state_dict'])
+        state_dict.pop('student_embeddings.weight', None)
+        num_items = checkpoint['num_items']
+        state_dict.setdefault('q_matrix', item_bank.q_matrix[:num_items])
+        model = NeuralCDM(checkpoint['num_skills'], 1, num_items, q_matrix=state_dict['q_matrix'])
+        model.load_state_dict(state_dict, strict=False)
+    else:
+        model = NeuralCDM(item_bank.num_skills, 1, len(item_bank), q_matrix=item_bank.q_matrix)
+
+    results = benchmark(model, args.batch_sizes, args.iterations)
+    print(f"{'variant':<14}{'batch':>7}{'p50 ms':>10}{'p99 ms':>10}{'predictions/s':>16}")
+    for name, by_batch in results['latency'].items():
+        for batch_size, stats in by_batch.items():
+            print(f"{name:<14}{batch_size:>7}{stats['p50_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+                  f"{stats['predictions_per_second']:>16,.0f}")
+    for name, stats in results['drift'].items():
+        print(f"{name} drift: max {stats['max_abs']:.5f}, mean {stats['mean_abs']:.5f}, "
+              f"decision agreement {stats['decision_agreement']:.4%}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
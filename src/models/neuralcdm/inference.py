@@ -0,0 +1,248 @@
+import os
+import threading
+import torch
+import numpy as np
+from contextlib import nullcontext
+from typing import Callable, Dict, Optional
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.ao.quantization import quantize_dynamic
+from .neuralcdm import NeuralCDM
+from .shared_weights import SharedWeights
+from ..metrics import Histogram, SIZE_BUCKETS
+
+PREDICT_SECONDS = Histogram('neuralcdm_predict_seconds', "Time of a batched prediction on the inference artifact")
+PREDICT_PAIRS = Histogram('neuralcdm_predict_pairs', "(student, item) pairs per prediction call",
+                          buckets=SIZE_BUCKETS)
+REFRESH_SECONDS = Histogram('neuralcdm_inference_refresh_seconds',
+                            "Time to re-export, save and swap in the inference artifact")
+
+
+def _frozen_linear(weight: torch.Tensor, bias: torch.Tensor) -> nn.Linear:
+    # Built on the meta device so no parameters are allocated only to be replaced
+    linear = nn.Linear(weight.shape[1], weight.shape[0], device='meta')
+    linear.weight = nn.Parameter(weight, requires_grad=False)
+    linear.bias = nn.Parameter(bias, requires_grad=False)
+    return linear
+
+
+class PredictionHead(nn.Module):
+    """
+    The item side of NeuralCDM as a self-contained, scriptable module.
+
+    Student abilities are gathered by the caller (a StudentStore cannot be
+    scripted), item difficulties and Q rows are frozen buffers. All weights,
+    the layers included, are used as given, so weights mapped from shared
+    memory are not copied.
+    """
+
+    def __init__(self, weights: Dict[str, torch.Tensor]):
+        super(PredictionHead, self).__init__()
+        self.register_buffer('item_difficulties', weights['item_difficulties'])
+        self.register_buffer('q_matrix', weights['q_matrix'])
+        self.fc1 = _frozen_linear(weights['fc1.weight'], weights['fc1.bias'])
+        self.fc2 = _frozen_linear(weights['fc2.weight'], weights['fc2.bias'])
+
+    def forward(self, student_abilities: torch.Tensor, item_ids: torch.Tensor) -> torch.Tensor:
+        q_matrix = self.q_matrix[item_ids]
+        combined = torch.cat([student_abilities * q_matrix, self.item_difficulties[item_ids] * q_matrix], dim=1)
+        x = F.relu(self.fc1(combined))
+        return torch.sigmoid(self.fc2(x)).squeeze(-1)
+
+
+def head_weights(model: NeuralCDM, lock: threading.Lock = None) -> Dict[str, torch.Tensor]:
+    """
+    Copy the item-side weights of a float NeuralCDM, the inputs of a PredictionHead.
+
+    Args:
+        model: The float model, e.g. the one the trainer updates
+        lock: Lock guarding the float model against concurrent training steps
+    """
+    with lock if lock is not None else nullcontext():
+        weights = {
+            'item_difficulties': model.item_embeddings.weight,
+            'q_matrix': model.q_matrix,
+            **{f'fc1.{name}': value for name, value in model.fc1.state_dict().items()},
+            **{f'fc2.{name}': value for name, value in model.fc2.state_dict().items()}
+        }
+        return {name: value.detach().clone() for name, value in weights.items()}
+
+
+def build_inference_model(weights: Dict[str, torch.Tensor], quantize: bool = True) -> torch.jit.ScriptModule:
+    """
+    Compile item-side weights into a TorchScript prediction artifact.
+
+    Args:
+        weights: Tensors named like the output of head_weights
+        quantize: Apply dynamic int8 quantization to fc1 and fc2
+
+    Returns:
+        The scripted PredictionHead
+    """
+    head = PredictionHead(weights)
+    head.eval()
+    if quantize:
+        # In place, a copy of the module would also copy the item buffers
+        head = quantize_dynamic(head, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return torch.jit.script(head)
+
+
+def export_inference_model(model: NeuralCDM, quantize: bool = True,
+                           lock: threading.Lock = None) -> torch.jit.ScriptModule:
+    """
+    Compile a float NeuralCDM into a TorchScript prediction artifact.
+
+    Args:
+        model: The float model, e.g. the one the trainer updates
+        quantize: Apply dynamic int8 quantization to fc1 and fc2
+        lock: Lock guarding the float model against concurrent training steps,
+            only held while its weights are copied
+
+    Returns:
+        The scripted PredictionHead
+    """
+    return build_inference_model(head_weights(model, lock), quantize)
+
+
+def save_inference_model(module: torch.jit.ScriptModule, path: str):
+    """Atomically write an exported artifact next to the checkpoint"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    torch.jit.save(module, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_inference_model(path: str) -> torch.jit.ScriptModule:
+    """Load an artifact written by save_inference_model"""
+    return torch.jit.load(path)
+
+
+class InferenceModel:
+    """
+    Read path of NeuralCDM serving predictions from an exported artifact.
+
+    Predictions run under ``torch.inference_mode`` on the scripted, optionally
+    quantized, prediction head. ``refresh`` re-exports from the float model the
+    trainer keeps updating and swaps the artifact in one assignment, so readers
+    never wait on training steps. Each export is also written to ``path``.
+
+    With ``shared`` weights the artifact is built from the generation the
+    trainer process published instead and serves it in float straight from
+    the mapping, ``quantize`` does not apply: quantizing would give every
+    worker a private copy of the layers and cost each of them a rebuild per
+    generation, for no gain at the layer sizes of NeuralCDM. Reads compare the published generation counter with the one they
+    serve and the first to see a newer one rebuilds the artifact; reads racing
+    with it keep using the previous artifact rather than waiting.
+    """
+
+    def __init__(self, model: NeuralCDM, path: str = None, quantize: bool = True,
+                 shared: Optional[SharedWeights] = None,
+                 on_refresh: Optional[Callable[[int], None]] = None):
+        self.model = model
+        self.path = path
+        self.quantize = quantize
+        self.shared = shared
+        # Called with the number of items of a new artifact before it is swapped in
+        self.on_refresh = on_refresh
+        self.refreshes = 0
+        self.generation = 0  # Shared generation of the current artifact
+        self._lock = threading.Lock()
+        self._module: torch.jit.ScriptModule = None
+        self._num_items = 0
+        self.refresh()
+
+    @property
+    def num_items(self) -> int:
+        self._current()
+        return self._num_items
+
+    @property
+    def q_matrix(self) -> torch.Tensor:
+        """Q-matrix rows of the items the current artifact knows"""
+        return self._current().q_matrix
+
+    def refresh(self, lock: threading.Lock = None):
+        """
+        Re-export the artifact from the float model, or load the latest shared generation.
+
+        Args:
+            lock: Lock guarding the float model against concurrent training steps
+        """
+        with self._lock:
+            self._refresh(lock)
+
+    def _refresh(self, lock: threading.Lock = None):
+        if self.shared is not None and self.shared.generation == self.generation:
+            return
+        with REFRESH_SECONDS.time():
+            if self.shared is not None:
+                generation, arrays = self.shared.load()
+                module = build_inference_model({name: torch.from_numpy(array) for name, array in arrays.items()},
+                                               quantize=False)
+            else:
+                generation, module = 0, export_inference_model(self.model, self.quantize, lock)
+            if self.on_refresh is not None:
+                self.on_refresh(len(module.q_matrix))
+            if self.path is not None:
+                save_inference_model(module, self.path)
+            self._module, self._num_items = module, len(module.q_matrix)
+            self.generation = generation
+            self.refreshes += 1
+
+    def _current(self) -> torch.jit.ScriptModule:
+        """The artifact to serve, after loading a newer shared generation unless another thread already is"""
+        if self.shared is not None and self.shared.generation != self.generation:
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._refresh()
+                finally:
+                    self._lock.release()
+        return self._module
+
+    def save(self, path: str):
+        """Write the current artifact, e.g. next to a checkpoint"""
+        save_inference_model(self._module, path)
+
+    def predict(self, student_ids, item_ids) -> torch.Tensor:
+        """
+        Predict success probabilities for (student, item) pairs.
+
+        Returns:
+            Probabilities as a 1-D float tensor
+        """
+        student_ids = torch.as_tensor(student_ids, dtype=torch.long)
+        item_ids = torch.as_tensor(item_ids, dtype=torch.long)
+        module = self._current()
+        PREDICT_PAIRS.observe(len(item_ids))
+        with PREDICT_SECONDS.time(), torch.inference_mode():
+            if self.model.student_store is not None:
+                store = self.model.student_store
+                abilities = torch.from_numpy(store.embeddings(store.lookup(student_ids.numpy())))
+            else:
+                abilities = self.model.student_embeddings.weight[student_ids]
+            return module(abilities, item_ids)
+
+    def predict_items(self, student_id: int, item_ids=None) -> torch.Tensor:
+        """
+        Predict the success probabilities of one student on many items in one batch.
+
+        Args:
+            student_id: The student
+            item_ids: Items to score, None for every item of the artifact
+
+        Returns:
+            Probabilities as a 1-D float tensor aligned with item_ids
+        """
+        module = self._current()
+        if item_ids is None:
+            item_ids = torch.arange(len(module.q_matrix))
+        item_ids = torch.as_tensor(item_ids, dtype=torch.long)
+        PREDICT_PAIRS.observe(len(item_ids))
+        with PREDICT_SECONDS.time(), torch.inference_mode():
+            if self.model.student_store is not None:
+                store = self.model.student_store
+                ability = torch.from_numpy(store.embeddings(store.lookup(np.array([student_id]))))
+            else:
+                ability = self.model.student_embeddings.weight[student_id].unsqueeze(0)
+            return module(ability.expand(len(item_ids), -1), item_ids)
@@ -0,0 +1,101 @@
+import os
+import json
+import threading
+import torch
+from typing import Dict, List, Sequence
+
+
+class ItemBank:
+    """
+    Tasks of the NeuralCDM model compiled from ``qmatrix.json``.
+
+    Task ``task_{i+1}`` is item ``i``. The Q-matrix is compiled once into a dense
+    [num_items, num_skills] tensor that the model registers as a buffer, so item
+    ids map to Q rows by indexing instead of per-request dict and string lookups.
+    Tasks added at runtime are appended under the next free item id and saved
+    in the same JSON format.
+    """
+
+    def __init__(self, skills: Dict[str, str], tasks: Dict[str, List[int]]):
+        self.skills = dict(skills)
+        self.num_skills = len(self.skills)
+        self.names: List[str] = []
+        rows = []
+        for i in range(len(tasks)):
+            name = f"task_{i+1}"
+            if name not in tasks:
+                raise ValueError(f"Tasks must be numbered task_1..task_{len(tasks)}, missing {name}")
+            rows.append(self._check_row(tasks[name]))
+            self.names.append(name)
+        self.q_matrix = torch.tensor(rows, dtype=torch.float).reshape(len(rows), self.num_skills)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> 'ItemBank':
+        """Compile an item bank from a ``qmatrix.json`` style file"""
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(data['skills'], data['tasks'])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def skill_names(self) -> List[str]:
+        """Skill names in column order of the Q-matrix"""
+        return [self.skills[str(i)] for i in range(self.num_skills)]
+
+    def _check_row(self, row: Sequence[int]) -> List[int]:
+        if len(row) != self.num_skills or any(value not in (0, 1) for value in row):
+            raise ValueError(f"A Q-matrix row needs {self.num_skills} entries of 0 or 1")
+        return list(row)
+
+    def add(self, skills: Sequence[int]) -> int:
+        """
+        Append a task with the given Q-matrix row.
+
+        Returns:
+            The item id of the new task
+        """
+        row = torch.tensor([self._check_row(skills)], dtype=torch.float)
+        with self._lock:
+            item_id = len(self.names)
+            self.names.append(f"task_{item_id+1}")
+            self.q_matrix = torch.cat([self.q_matrix, row])
+        return item_id
+
+    def refresh(self, path: str) -> int:
+        """
+        Append the tasks other processes saved to ``path`` since this bank was loaded.
+
+        Returns:
+            The number of tasks added
+        """
+        if not os.path.exists(path):
+            return 0
+        saved = ItemBank.load(path)
+        with self._lock:
+            first = len(self.names)
+            if len(saved) <= first:
+                return 0
+            self.q_matrix = torch.cat([self.q_matrix, saved.q_matrix[first:]])
+            self.names.extend(saved.names[first:])
+            return len(saved) - first
+
+    def to_dict(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                'skills': self.skills,
+                'tasks': {name: [int(v) for v in row] for name, row in zip(self.names, self.q_matrix.tolist())}
+            }
+
+    def save(self, path: str):
+        """Atomically write the item bank in the ``qmatrix.json`` format"""
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
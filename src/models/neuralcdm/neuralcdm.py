@@ -1,38 +1,73 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import json
 import os
+import threading
+import numpy as np
 
 class NeuralCDM(nn.Module):
-    def __init__(self, num_skills, num_students, num_items, hidden_dim=64):
+    def __init__(self, num_skills, num_students, num_items, hidden_dim=64, student_store=None, q_matrix=None):
         super(NeuralCDM, self).__init__()
         self.num_skills = num_skills
         self.num_students = num_students
         self.num_items = num_items
         
-        # Student ability embeddings
-        self.student_embeddings = nn.Embedding(num_students, num_skills)
+        # Student ability embeddings, either a dense table indexed by student id or a
+        # memory-mapped StudentStore keyed by external user id whose rows are loaded lazily
+        self.student_store = student_store
+        if student_store is None:
+            self.student_embeddings = nn.Embedding(num_students, num_skills)
+        else:
+            self.student_embeddings = None
+            self.num_students = None
         
         # Item difficulty embeddings
         self.item_embeddings = nn.Embedding(num_items, num_skills)
         
+        # Q-matrix rows indexed by item id, every skill counts when none is given
+        if q_matrix is None:
+            q_matrix = torch.ones(num_items, num_skills)
+        if tuple(q_matrix.shape) != (num_items, num_skills):
+            raise ValueError(f"Q-matrix must have shape ({num_items}, {num_skills})")
+        self.register_buffer('q_matrix', q_matrix.clone().float())
+        
         # Neural network layers
         self.fc1 = nn.Linear(num_skills * 2, hidden_dim)
         self.fc2 = nn.Linear(hidden_dim, 1)
         
         # Initialize weights
         self._init_weights()
+        
+        # Cached sigmoid of the student embeddings and rows to refresh before the next read
+        self._mastery = None
+        self._stale_students = set()
+        self._mastery_lock = threading.Lock()
     
     def _init_weights(self):
-        nn.init.xavier_uniform_(self.student_embeddings.weight)
+        if self.student_embeddings is not None:
+            nn.init.xavier_uniform_(self.student_embeddings.weight)
         nn.init.xavier_uniform_(self.item_embeddings.weight)
         nn.init.xavier_uniform_(self.fc1.weight)
         nn.init.xavier_uniform_(self.fc2.weight)
     
-    def forward(self, student_ids, item_ids, q_matrix):
-        # Get student abilities and item difficulties
-        student_abilities = self.student_embeddings(student_ids)  # [batch_size, num_skills]
+    def student_abilities(self, student_ids):
+        """Look up ability embeddings, loading StudentStore rows on demand"""
+        if self.student_store is None:
+            return self.student_embeddings(student_ids)
+        # Only training assigns rows to unknown users, reads treat them as fresh students
+        rows = self.student_store.rows(student_ids.numpy(), create=self.training)
+        return torch.from_numpy(self.student_store.embeddings(rows))
+    
+    def forward(self, student_ids, item_ids, q_matrix=None):
+        return self.predict(self.student_abilities(student_ids), item_ids, q_matrix)
+    
+    def predict(self, student_abilities, item_ids, q_matrix=None):
+        """Predict success probabilities from already gathered student abilities"""
+        # Gather the Q-matrix rows of the items unless the caller passed them
+        if q_matrix is None:
+            q_matrix = self.q_matrix[item_ids]
+        
+        # Get item difficulties
         item_difficulties = self.item_embeddings(item_ids)  # [batch_size, num_skills]
         
         # Apply Q-matrix masking
@@ -48,30 +83,175 @@ class NeuralCDM(nn.Module):
         
         return x.squeeze(-1)
     
+    def add_items(self, q_rows):
+        """
+        Add items at runtime by growing the item embeddings and the Q-matrix buffer.
+        
+        Existing item difficulties are kept, new ones are initialized like at
+        construction. The item embedding parameter is replaced, so optimizers
+        holding it have to be rebuilt.
+        
+        Args:
+            q_rows: [num_new_items, num_skills] Q-matrix rows of the new items
+            
+        Returns:
+            Item ids of the new items
+        """
+        q_rows = torch.as_tensor(q_rows, dtype=torch.float).reshape(-1, self.num_skills)
+        first = self.num_items
+        weight = torch.empty(first + len(q_rows), self.num_skills)
+        nn.init.xavier_uniform_(weight)
+        with torch.no_grad():
+            weight[:first] = self.item_embeddings.weight
+        self.item_embeddings = nn.Embedding.from_pretrained(weight, freeze=False)
+        self.q_matrix = torch.cat([self.q_matrix, q_rows])
+        self.num_items = first + len(q_rows)
+        return list(range(first, self.num_items))
+    
     def get_mastery(self, student_id):
         """Get mastery scores for all skills for a given student"""
-        with torch.no_grad():
-            abilities = self.student_embeddings(torch.tensor([student_id]))
-            return torch.sigmoid(abilities).squeeze().numpy()
+        if self.student_store is not None:
+            return self.get_mastery_many([student_id])[1][0]
+        return self.mastery_table()[student_id]
     
-    def save_model(self, path):
-        """Save model state and configuration"""
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        torch.save({
+    def get_mastery_many(self, student_ids=None):
+        """
+        Get the mastery scores of many students at once.
+        
+        Args:
+            student_ids: Student ids (user ids with a StudentStore), None for every known student
+            
+        Returns:
+            Tuple of (student ids as a NumPy array, [len(student_ids), num_skills] mastery matrix)
+        """
+        if self.student_store is not None:
+            if student_ids is None:
+                student_ids = self.student_store.user_ids()
+                return student_ids, self.student_store.mastery(np.arange(len(student_ids)))
+            student_ids = np.asarray(student_ids, dtype=np.int64)
+            return student_ids, self.student_store.mastery(self.student_store.lookup(student_ids))
+        
+        table = self.mastery_table()
+        if student_ids is None:
+            return np.arange(len(table)), table
+        student_ids = np.asarray(student_ids, dtype=np.int64)
+        if student_ids.size and (student_ids.min() < 0 or student_ids.max() >= len(table)):
+            raise IndexError("Unknown student id")
+        return student_ids, table[student_ids]
+    
+    def mastery_table(self):
+        """
+        Get the mastery matrix of all students as a [num_students, num_skills] NumPy array.
+        
+        The sigmoid of the student embeddings is computed once and afterwards only
+        the rows reported through mark_students_updated are recomputed. The
+        returned array is shared, callers must not modify it. Only available for
+        dense student tables, a StudentStore maintains mastery per row itself.
+        """
+        if self.student_store is not None:
+            raise RuntimeError("Mastery of a StudentStore is read with get_mastery_many")
+        with self._mastery_lock:
+            if self._mastery is None:
+                with torch.no_grad():
+                    self._mastery = torch.sigmoid(self.student_embeddings.weight).numpy().copy()
+                self._stale_students.clear()
+            elif self._stale_students:
+                rows = torch.tensor(sorted(self._stale_students), dtype=torch.long)
+                with torch.no_grad():
+                    self._mastery[rows.numpy()] = torch.sigmoid(self.student_embeddings.weight[rows]).numpy()
+                self._stale_students.clear()
+            return self._mastery
+    
+    def mark_students_updated(self, student_ids):
+        """Record that the embeddings of these students changed, e.g. after a training step"""
+        with self._mastery_lock:
+            self._stale_students.update(int(s) for s in student_ids)
+    
+    def invalidate_mastery(self):
+        """Drop the cached mastery matrix after bulk changes to the student embeddings"""
+        with self._mastery_lock:
+            self._mastery = None
+            self._stale_students.clear()
+    
+    def save_model(self, path, optimizer=None, extra=None):
+        """
+        Save model state and configuration atomically.
+        
+        The checkpoint is written to a temporary file in the same directory,
+        fsynced and renamed over the previous one, so a crash never leaves a
+        partially written checkpoint behind.
+        
+        Args:
+            path: Destination of the checkpoint
+            optimizer: Optional optimizer whose state is saved alongside the model
+            extra: Optional dictionary of additional entries to store
+        """
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        if self.student_store is not None:
+            # Student rows live in the store, make them durable before the checkpoint
+            self.student_store.flush()
+        checkpoint = {
             'model_state_dict': self.state_dict(),
             'num_skills': self.num_skills,
             'num_students': self.num_students,
-            'num_items': self.num_items
-        }, path)
+            'num_items': self.num_items,
+            'student_store': self.student_store is not None
+        }
+        if optimizer is not None:
+            checkpoint['optimizer_state_dict'] = optimizer.state_dict()
+        checkpoint.update(extra or {})
+        
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            torch.save(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        
+        # Persist the rename itself
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    
+    @staticmethod
+    def read_checkpoint(path):
+        """Read a raw checkpoint dictionary"""
+        return torch.load(path)
     
     @classmethod
-    def load_model(cls, path):
-        """Load model from saved state"""
-        checkpoint = torch.load(path)
+    def from_checkpoint(cls, checkpoint, student_store=None, q_matrix=None):
+        """
+        Build a model from a checkpoint dictionary.
+        
+        When a StudentStore is given and the checkpoint has a dense student table,
+        the table is imported into the (empty) store with user id = row index.
+        Checkpoints written before the Q-matrix became a buffer take it from
+        ``q_matrix``; items it has beyond the checkpoint are added.
+        """
         model = cls(
             num_skills=checkpoint['num_skills'],
             num_students=checkpoint['num_students'],
-            num_items=checkpoint['num_items']
+            num_items=checkpoint['num_items'],
+            student_store=student_store
         )
-        model.load_state_dict(checkpoint['model_state_dict'])
-        return model 
\ No newline at end of file
+        state_dict = dict(checkpoint['model_state_dict'])
+        if 'q_matrix' not in state_dict:
+            state_dict['q_matrix'] = (q_matrix[:model.num_items] if q_matrix is not None
+                                      else model.q_matrix)
+        dense_students = state_dict.pop('student_embeddings.weight', None)
+        if student_store is None:
+            state_dict['student_embeddings.weight'] = dense_students
+        elif dense_students is not None and len(student_store) == 0:
+            student_store.import_embeddings(np.arange(len(dense_students)), dense_students.numpy())
+        model.load_state_dict(state_dict)
+        if q_matrix is not None and len(q_matrix) > model.num_items:
+            model.add_items(q_matrix[model.num_items:])
+        return model
+    
+    @classmethod
+    def load_model(cls, path, student_store=None, q_matrix=None):
+        """Load model from saved state"""
+        return cls.from_checkpoint(cls.read_checkpoint(path), student_store, q_matrix)
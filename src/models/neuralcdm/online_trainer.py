@@ -0,0 +1,464 @@
+import time
+import asyncio
+import logging
+import threading
+import torch
+import torch.nn as nn
+import torch.optim as optim
+import numpy as np
+from typing import List, Dict, Any, Tuple, Optional, Callable
+from .neuralcdm import NeuralCDM
+from .attempt_journal import AttemptJournal
+from .shared_weights import SharedWeights
+from ..metrics import Counter, Gauge, Histogram, SIZE_BUCKETS
+
+STEP_SECONDS = Histogram('neuralcdm_train_step_seconds', "Time of one online gradient step, including the lock wait")
+STEP_ATTEMPTS = Histogram('neuralcdm_train_step_attempts', "Attempts per online gradient step", buckets=SIZE_BUCKETS)
+CHECKPOINT_SECONDS = Histogram('neuralcdm_checkpoint_seconds', "Time to write a NeuralCDM checkpoint")
+JOURNAL_SYNC_SECONDS = Histogram('neuralcdm_journal_sync_seconds', "Time of a batched attempt journal fsync")
+SUBMITTED = Counter('neuralcdm_attempts_submitted_total', "Attempts offered to the online trainer", ['result'])
+TRAINED = Counter('neuralcdm_attempts_trained_total', "Attempts the online trainer applied")
+QUEUE_DEPTH = Gauge('neuralcdm_train_queue_depth', "Attempts waiting for the online trainer")
+DROPPED = Counter('neuralcdm_attempts_dropped_total', "Attempts the online trainer dropped instead of training",
+                  ['reason'])
+
+logger = logging.getLogger(__name__)
+
+# Queued attempt: (journal sequence number or -1, user_id, item_id, correct)
+Attempt = Tuple[int, int, int, int]
+
+
+def check_attempt(user_id: int, item_id: int, correct: int):
+    """
+    Reject attempts no gradient step can train on, before they are journaled.
+
+    Raises:
+        ValueError: If an id is negative or ``correct`` is not 0 or 1
+    """
+    if user_id < 0 or item_id < 0:
+        raise ValueError(f"Attempt ids must not be negative, got user {user_id} and item {item_id}")
+    if correct not in (0, 1):
+        raise ValueError(f"correct must be 0 or 1, got {correct}")
+
+
+class OnlineTrainer:
+    """
+    Background mini-batch trainer for attempts logged through the API.
+
+    Request handlers only append attempts to a bounded asyncio queue. A
+    background task drains it into mini-batches of up to ``batch_size`` attempts
+    (or whatever arrived within ``flush_interval`` seconds) and applies one
+    gradient step per batch with a single persistent optimizer.
+
+    When a journal is attached, every attempt is appended to it before being
+    queued and the journal is fsynced in batches by the trainer. Checkpoints,
+    written at most every ``checkpoint_interval`` seconds, store the optimizer
+    state and the journal offset they cover, so ``recover`` only replays the
+    journal tail after a crash.
+
+    With ``follow_journal`` the journal itself is the queue: attempts are only
+    appended to it, by this process or by serving workers sharing the journal,
+    and the background task polls it every ``poll_interval`` seconds and trains
+    on whatever lies past ``journal_offset``. Backpressure then applies to
+    the attempts journaled but not trained yet.
+    """
+
+    def __init__(self, model: NeuralCDM, model_path: str,
+                 batch_size: int = 64, flush_interval: float = 1.0, max_queue_size: int = 10000,
+                 learning_rate: float = 0.001, checkpoint_interval: float = 30.0,
+                 journal: Optional[AttemptJournal] = None,
+                 on_checkpoint: Optional[Callable[[], None]] = None,
+                 follow_journal: bool = False, poll_interval: float = 0.05):
+        if follow_journal and journal is None:
+            raise ValueError("Following the journal needs a journal")
+        self.model = model
+        self.on_checkpoint = on_checkpoint  # Called after each checkpoint, outside the lock
+        self.journal = journal
+        self.follow_journal = follow_journal
+        self.poll_interval = poll_interval
+        self.journal_offset = 0  # Journal sequence number up to which attempts are trained
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.checkpoint_interval = checkpoint_interval
+        self.criterion = nn.BCELoss()
+        self.learning_rate = learning_rate
+        # Student rows get sparse updates, so a step only changes the students in its batch
+        # and mastery can be refreshed row by row. A StudentStore applies its own row-wise
+        # Adagrad, a dense student table gets sparse gradients and SparseAdam.
+        self.sparse_optimizer = None
+        if model.student_store is None:
+            model.student_embeddings.sparse = True
+            self.sparse_optimizer = optim.SparseAdam([model.student_embeddings.weight], lr=learning_rate)
+        self.optimizer = self._dense_optimizer()
+        self.lock = threading.Lock()  # Serializes gradient steps and checkpoints
+        self.queue: asyncio.Queue = None
+        self.steps = 0
+        self.trained_attempts = 0
+        self.dropped_attempts = 0  # Invalid attempts and attempts of failed steps, skipped for good
+        self.dirty = False
+        self._last_checkpoint = time.monotonic()
+        self._task: asyncio.Task = None
+        self._pending: List[Attempt] = []
+        self._accepted, self._rejected = SUBMITTED.labels('accepted'), SUBMITTED.labels('rejected')
+        TRAINED.set_function(lambda: self.trained_attempts)
+        QUEUE_DEPTH.set_function(self.queue_depth)
+
+    def _dense_optimizer(self) -> optim.Adam:
+        return optim.Adam(
+            [p for name, p in self.model.named_parameters() if name != 'student_embeddings.weight'],
+            lr=self.learning_rate
+        )
+    
+    def add_items(self, q_rows: torch.Tensor) -> List[int]:
+        """
+        Add items to the model between gradient steps and rebuild the optimizer.
+        
+        Adam state carries over; the moments of the grown item embeddings are
+        padded with zeros for the new items.
+        
+        Returns:
+            Item ids of the new items
+        """
+        with self.lock:
+            old_weight = self.model.item_embeddings.weight
+            old_state = {id(p): state for p, state in self.optimizer.state.items()}
+            item_ids = self.model.add_items(q_rows)
+            
+            optimizer = self._dense_optimizer()
+            new_weight = self.model.item_embeddings.weight
+            for p in (p for group in optimizer.param_groups for p in group['params']):
+                state = old_state.get(id(old_weight) if p is new_weight else id(p))
+                if state is None:
+                    continue
+                if p is new_weight:
+                    state = {key: (torch.cat([value, value.new_zeros(len(p) - len(value), *value.shape[1:])])
+                                   if torch.is_tensor(value) and value.dim() > 0 else value)
+                             for key, value in state.items()}
+                optimizer.state[p] = state
+            self.optimizer = optimizer
+            self.dirty = True
+        return item_ids
+    
+    def queue_depth(self) -> int:
+        """Attempts accepted but not trained yet"""
+        if self.follow_journal:
+            return max(0, len(self.journal) - self.journal_offset)
+        return self.queue.qsize() if self.queue is not None else 0
+
+    async def start(self):
+        """Create the queue and start the background training task."""
+        if not self.follow_journal:
+            self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Train on whatever is still queued, stop the task and write a final checkpoint."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.train_step, self._pending)
+        self._pending = []
+        while self.queue is not None and not self.queue.empty():
+            await asyncio.to_thread(self.train_step, self._drain(self.batch_size))
+        if self.follow_journal:
+            await asyncio.to_thread(self.recover)
+        await asyncio.to_thread(self.checkpoint)
+
+    def restore(self, checkpoint: Dict[str, Any]):
+        """Resume the optimizer state and journal offset saved in a checkpoint."""
+        if 'optimizer_state_dict' in checkpoint and 'sparse_optimizer_state_dict' in checkpoint:
+            self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+            if self.sparse_optimizer is not None and checkpoint['sparse_optimizer_state_dict']:
+                self.sparse_optimizer.load_state_dict(checkpoint['sparse_optimizer_state_dict'])
+        self.journal_offset = checkpoint.get('journal_offset', 0)
+
+    def recover(self) -> int:
+        """
+        Replay the journaled attempts that the last checkpoint does not cover.
+
+        Records that cannot be trained on are skipped and counted in
+        ``dropped_attempts``, so a bad record cannot fail every startup.
+
+        Returns:
+            The number of replayed attempts, including skipped ones
+        """
+        if self.journal is None:
+            return 0
+        self.journal.refresh()
+        offset = self.journal_offset
+        records = self.journal.read(offset)
+        for start in range(0, len(records), self.batch_size):
+            chunk = records[start:start + self.batch_size]
+            self._apply(chunk['user_id'], chunk['item_id'], chunk['correct'], offset + start + len(chunk))
+        if len(records):
+            self.checkpoint()
+        return len(records)
+
+    def submit(self, user_id: int, item_id: int, correct: int) -> bool:
+        """
+        Journal an attempt and queue it for training without waiting for it.
+
+        Returns:
+            False if the queue is full and the attempt was rejected
+
+        Raises:
+            ValueError: If the attempt cannot be trained on, see ``check_attempt``
+        """
+        check_attempt(user_id, item_id, correct)
+        if self.follow_journal:
+            # Picked up from the journal by the background task, like attempts of other workers
+            if self.queue_depth() >= self.max_queue_size:
+                self._rejected.inc()
+                return False
+            self.journal.append(user_id, item_id, correct)
+            self._accepted.inc()
+            return True
+        if self.queue.full():
+            self._rejected.inc()
+            return False
+        sequence = self.journal.append(user_id, item_id, correct) if self.journal is not None else -1
+        self.queue.put_nowait((sequence, user_id, item_id, correct))
+        self._accepted.inc()
+        return True
+
+    def _drain(self, limit: int) -> List[Attempt]:
+        batch = []
+        while len(batch) < limit and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _collect(self) -> List[Attempt]:
+        """Wait for a full batch or for the flush interval to elapse after the first attempt."""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.flush_interval
+        try:
+            while len(batch) < self.batch_size:
+                batch.extend(self._drain(self.batch_size - len(batch)))
+                remaining = deadline - loop.time()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            # Keep the partial batch so stop() can still train on it
+            self._pending = batch
+            raise
+        return batch
+
+    async def _follow(self) -> Tuple[int, np.ndarray]:
+        """
+        Wait for a full batch past ``journal_offset`` in the journal, or for the
+        flush interval to elapse after the first attempt showed up.
+
+        Returns:
+            Tuple of (sequence number of the first attempt, attempt records)
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None
+        while True:
+            available = self.journal.refresh() - self.journal_offset
+            now = loop.time()
+            if available >= self.batch_size or (available > 0 and deadline is not None and now >= deadline):
+                break
+            if available > 0 and deadline is None:
+                deadline = now + self.flush_interval
+            await asyncio.sleep(self.poll_interval if deadline is None else
+                                min(self.poll_interval, deadline - now))
+        start = self.journal_offset
+        return start, self.journal.read(start, start + self.batch_size)
+
+    async def _run(self):
+        while True:
+            if self.follow_journal:
+                start, records = await self._follow()
+                await asyncio.to_thread(self._apply, records['user_id'], records['item_id'],
+                                        records['correct'], start + len(records))
+            else:
+                batch = await self._collect()
+                await asyncio.to_thread(self.train_step, batch)
+            if self.journal is not None:
+                await asyncio.to_thread(self._sync_journal)
+            if time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+                await asyncio.to_thread(self.checkpoint)
+
+    def _sync_journal(self):
+        with JOURNAL_SYNC_SECONDS.time():
+            self.journal.sync()
+
+    def train_step(self, batch: List[Attempt]) -> float:
+        """
+        Apply one gradient step on a mini-batch of queued attempts.
+
+        Returns:
+            The batch loss
+        """
+        if not batch:
+            return 0.0
+        sequences, user_ids, item_ids, correct = (np.array(column) for column in zip(*batch))
+        return self._apply(user_ids, item_ids, correct, int(sequences.max()) + 1)
+
+    def _apply(self, user_ids: np.ndarray, item_ids: np.ndarray, correct: np.ndarray,
+               journal_offset: int) -> float:
+        """
+        Train on the valid attempts of a batch and move past the whole batch.
+
+        Journal records are not checked by whoever appended them, so attempts of
+        unknown items or with ``correct`` outside {0, 1} are dropped here, and a
+        batch whose step fails is logged and dropped too, so that neither the
+        background task nor a replay at startup gets stuck on it.
+        """
+        user_ids, item_ids, correct = np.asarray(user_ids), np.asarray(item_ids), np.asarray(correct)
+        valid = ((user_ids >= 0) & (item_ids >= 0) & (item_ids < self.model.num_items)
+                 & ((correct == 0) | (correct == 1)))
+        invalid = len(valid) - int(np.count_nonzero(valid))
+        if invalid:
+            DROPPED.labels('invalid').inc(invalid)
+            self.dropped_attempts += invalid
+            user_ids, item_ids, correct = user_ids[valid], item_ids[valid], correct[valid]
+        if len(user_ids):
+            try:
+                return self._step(user_ids, item_ids, correct, journal_offset)
+            except Exception:
+                logger.exception("Dropped a batch of %d attempts the trainer failed to step on", len(user_ids))
+                DROPPED.labels('error').inc(len(user_ids))
+                self.dropped_attempts += len(user_ids)
+        with self.lock:
+            self.journal_offset = max(self.journal_offset, journal_offset)
+            self.dirty = True
+        return 0.0
+
+    def _step(self, user_ids: np.ndarray, item_ids: np.ndarray, correct: np.ndarray,
+              journal_offset: int) -> float:
+        student_ids = torch.from_numpy(np.array(user_ids, dtype=np.int64))
+        item_ids = torch.from_numpy(np.array(item_ids, dtype=np.int64))
+        correct = torch.from_numpy(np.array(correct, dtype=np.float32))
+
+        start = time.perf_counter()
+        with self.lock:
+            self.model.train()
+            self.optimizer.zero_grad()
+            store = self.model.student_store
+            if store is not None:
+                rows = store.rows(student_ids.numpy(), create=True)
+                abilities = torch.from_numpy(store.embeddings(rows)).requires_grad_()
+                prediction = self.model.predict(abilities, item_ids)
+            else:
+                self.sparse_optimizer.zero_grad()
+                prediction = self.model(student_ids, item_ids)
+            loss = self.criterion(prediction, correct)
+            loss.backward()
+            self.optimizer.step()
+            if store is not None:
+                store.apply_gradients(rows, abilities.grad.numpy(), self.learning_rate)
+            else:
+                self.sparse_optimizer.step()
+                self.model.mark_students_updated(student_ids.tolist())
+            self.steps += 1
+            self.trained_attempts += len(student_ids)
+            self.journal_offset = max(self.journal_offset, journal_offset)
+            self.dirty = True
+        STEP_SECONDS.observe(time.perf_counter() - start)
+        STEP_ATTEMPTS.observe(len(student_ids))
+        return loss.item()
+
+    def checkpoint(self):
+        """Atomically save the model and optimizer if they changed since the last checkpoint."""
+        with self.lock:
+            saved = self.dirty
+            if self.dirty:
+                start = time.perf_counter()
+                if self.journal is not None:
+                    # Everything the checkpoint covers must be durable in the journal first
+                    self.journal.sync(force=True)
+                self.model.save_model(self.model_path, self.optimizer, {
+                    'sparse_optimizer_state_dict': (self.sparse_optimizer.state_dict()
+                                                    if self.sparse_optimizer is not None else None),
+                    'journal_offset': self.journal_offset
+                })
+                self.dirty = False
+                CHECKPOINT_SECONDS.observe(time.perf_counter() - start)
+            self._last_checkpoint = time.monotonic()
+        if saved and self.on_checkpoint is not None:
+            self.on_checkpoint()
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """Get queue and training counters."""
+        return {
+            'queue_depth': self.queue_depth(),
+            'max_queue_size': self.max_queue_size,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+            'steps': self.steps,
+            'trained_attempts': self.trained_attempts,
+            'dropped_attempts': self.dropped_attempts,
+            'journal_length': len(self.journal) if self.journal is not None else 0,
+            'journal_offset': self.journal_offset
+        }
+
+
+class AttemptForwarder:
+    """
+    Attempt intake of a serving worker that does not train.
+
+    Attempts are appended to the journal shared with the trainer process,
+    which follows it. The trainer's progress is read from the header of the
+    shared weights, so attempts are rejected once more than ``max_queue_size``
+    of them wait for training, as the trainer's own intake does.
+    """
+
+    def __init__(self, journal: AttemptJournal, shared: SharedWeights, max_queue_size: int = 10000):
+        self.journal = journal
+        self.shared = shared
+        self.max_queue_size = max_queue_size
+        self._accepted, self._rejected = SUBMITTED.labels('accepted'), SUBMITTED.labels('rejected')
+        QUEUE_DEPTH.set_function(self.queue_depth)
+
+    def queue_depth(self) -> int:
+        """Attempts journaled but not trained yet, as of this worker's last append"""
+        return max(0, len(self.journal) - self.shared.journal_offset)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def submit(self, user_id: int, item_id: int, correct: int) -> bool:
+        """
+        Journal an attempt for the trainer process.
+
+        Returns:
+            False if the trainer is too far behind and the attempt was rejected
+
+        Raises:
+            ValueError: If the attempt cannot be trained on, see ``check_attempt``
+        """
+        check_attempt(user_id, item_id, correct)
+        if self.queue_depth() >= self.max_queue_size:
+            self._rejected.inc()
+            return False
+        self.journal.append(user_id, item_id, correct)
+        self._accepted.inc()
+        return True
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """Get the trainer's progress as published in the shared header."""
+        header = self.shared.header()
+        return {
+            'queue_depth': max(0, self.journal.refresh() - header['journal_offset']),
+            'max_queue_size': self.max_queue_size,
+            'steps': header['steps'],
+            'trained_attempts': header['trained_attempts'],
+            'journal_length': len(self.journal),
+            'journal_offset': header['journal_offset'],
+            'trainer_pid': header['trainer_pid']
+        }
@@ -0,0 +1,145 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+from .item_bank import ItemBank
+from .inference import InferenceModel
+
+# Lower bounds of the predicted success probability for each difficulty label
+DIFFICULTY_LEVELS = [(0.8, 'beginner'), (0.6, 'intermediate'), (0.0, 'advanced')]
+
+
+def difficulty_label(probability: float) -> str:
+    for lower_bound, label in DIFFICULTY_LEVELS:
+        if probability >= lower_bound:
+            return label
+    return DIFFICULTY_LEVELS[-1][1]
+
+
+class ExerciseRecommender:
+    """
+    Recommend exercises of desirable difficulty from NeuralCDM predictions.
+
+    Every item of the bank is scored for the student in one batched forward pass
+    of the inference artifact. Items whose predicted success probability lies in
+    ``band`` are preferred, closest to the middle of the band first; when fewer
+    than ``top_k`` qualify, the nearest items outside the band fill the list.
+    Each recommendation targets the student's weakest skill among the skills
+    the item exercises and carries exemplars of that component from
+    high-scoring essays.
+
+    Results are cached per student and reused until the student's mastery row
+    or the number of items changes.
+    """
+
+    def __init__(self, inference_model: InferenceModel, item_bank: ItemBank,
+                 knowledge_graph_rag: Callable[[], Any], band: Tuple[float, float] = (0.6, 0.8),
+                 top_k: int = 3, num_exemplars: int = 2, cache_size: int = 10000):
+        self.inference_model = inference_model
+        self.model = inference_model.model
+        self.item_bank = item_bank
+        self.knowledge_graph_rag = knowledge_graph_rag  # Returns the current KnowledgeGraphRAG
+        self.band = band
+        self.top_k = top_k
+        self.num_exemplars = num_exemplars
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: 'OrderedDict[Tuple[int, int], Tuple[bytes, int, List[Dict[str, Any]]]]' = OrderedDict()
+        self._exemplars: Tuple[Any, Dict[str, List[Dict[str, Any]]]] = (None, {})
+        self._lock = threading.Lock()
+
+    def _exemplars_for(self, component_type: str) -> List[Dict[str, Any]]:
+        """Best examples of a component, recomputed when the knowledge graph was reloaded"""
+        rag = self.knowledge_graph_rag()
+        cached_rag, exemplars = self._exemplars
+        if cached_rag is not rag:
+            exemplars = {}
+            self._exemplars = (rag, exemplars)
+        if component_type not in exemplars:
+            # Examples come best band first, only the exemplars are decoded
+            exemplars[component_type] = rag.get_component_examples(component_type, self.num_exemplars)
+        return exemplars[component_type]
+
+    def recommend(self, student_id: int, top_k: int = None) -> List[Dict[str, Any]]:
+        """
+        Recommend exercises for a student.
+
+        Args:
+            student_id: The student (user id of the NeuralCDM model)
+            top_k: Number of exercises, defaults to the recommender's top_k
+
+        Returns:
+            Recommended exercises, best first
+        """
+        top_k = self.top_k if top_k is None else top_k
+        mastery = self.model.get_mastery_many([student_id])[1][0]
+        key = (student_id, top_k)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] == mastery.tobytes() and entry[1] == self.inference_model.num_items:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        num_items = self.inference_model.num_items
+        recommendations = self._recommend(student_id, mastery, top_k)
+        with self._lock:
+            self._cache[key] = (mastery.tobytes(), num_items, recommendations)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return recommendations
+
+    def _recommend(self, student_id: int, mastery: np.ndarray, top_k: int) -> List[Dict[str, Any]]:
+        probabilities = self.inference_model.predict_items(student_id).numpy()
+        num_items = len(probabilities)
+        q_matrix = self.inference_model.q_matrix[:num_items].numpy()
+        k = min(top_k, num_items)
+        if k <= 0:
+            return []
+
+        # Distance to the middle of the band, items outside the band rank after all items inside
+        low, high = self.band
+        in_band = (probabilities >= low) & (probabilities <= high)
+        distance = np.abs(probabilities - (low + high) / 2) + (~in_band)
+        chosen = np.argpartition(distance, k - 1)[:k]
+        chosen = chosen[np.argsort(distance[chosen], kind='stable')]
+
+        # Weakest skill among the skills each chosen item exercises
+        target_skills = np.where(q_matrix[chosen] > 0, mastery, np.inf).argmin(axis=1)
+
+        skill_names = self.item_bank.skill_names
+        recommendations = []
+        for item_id, skill in zip(chosen.tolist(), target_skills.tolist()):
+            component_type = skill_names[skill].lower()
+            exemplars = self._exemplars_for(component_type)
+            probability = float(probabilities[item_id])
+            skills = [name for name, used in zip(skill_names, q_matrix[item_id]) if used > 0]
+            topic = exemplars[0]['topic'] if exemplars else None
+            recommendations.append({
+                'id': f"task_{item_id+1}",
+                'item_id': item_id,
+                'type': component_type,
+                'difficulty': difficulty_label(probability),
+                'content': (f'Write a {component_type} for the essay topic "{topic}"' if topic
+                            else f'Write a {component_type} for an argumentative essay'),
+                'points': 10 * len(skills),
+                'skills': skills,
+                'predicted_success': probability,
+                'in_band': bool(in_band[item_id]),
+                'exemplars': exemplars
+            })
+        return recommendations
+
+    def get_statistics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._cache),
+                'band': list(self.band)
+            }
@@ -0,0 +1,286 @@
+import os
+import time
+import fcntl
+import asyncio
+import threading
+from contextlib import contextmanager
+from typing import Optional
+from .neuralcdm import NeuralCDM
+from .online_trainer import OnlineTrainer, AttemptForwarder
+from .attempt_journal import AttemptJournal
+from .student_store import StudentStore
+from .item_bank import ItemBank
+from .inference import InferenceModel, head_weights
+from .shared_weights import SharedWeights
+
+# Online training configuration
+TRAIN_BATCH_SIZE = int(os.environ.get('NEURALCDM_TRAIN_BATCH_SIZE', 64))
+TRAIN_FLUSH_INTERVAL = float(os.environ.get('NEURALCDM_TRAIN_FLUSH_INTERVAL', 1.0))
+TRAIN_QUEUE_SIZE = int(os.environ.get('NEURALCDM_TRAIN_QUEUE_SIZE', 10000))
+CHECKPOINT_INTERVAL = float(os.environ.get('NEURALCDM_CHECKPOINT_INTERVAL', 30.0))
+JOURNAL_FSYNC_INTERVAL = float(os.environ.get('NEURALCDM_JOURNAL_FSYNC_INTERVAL', 0.2))
+
+# Multi-worker serving: one process trains and publishes the weights, the others serve them.
+# 'auto' makes the first worker to take the writer lock the trainer.
+ROLE = os.environ.get('NEURALCDM_ROLE', 'auto')
+PUBLISH_INTERVAL = float(os.environ.get('NEURALCDM_PUBLISH_INTERVAL', 1.0))
+READER_START_TIMEOUT = float(os.environ.get('NEURALCDM_READER_START_TIMEOUT', 600.0))
+ITEM_PUBLISH_TIMEOUT = 10.0  # Seconds a serving worker waits for the trainer to publish a new task
+
+QMATRIX_PATH = 'src/data/qmatrix.json'
+ITEM_BANK_PATH = 'models/saved/item_bank.json'  # Tasks published at runtime are saved next to the model
+STUDENT_STORE_PATH = 'models/saved/students'
+MODEL_PATH = 'models/saved/neuralcdm_model.pt'
+JOURNAL_PATH = 'models/saved/attempts.journal'
+INFERENCE_PATH = 'models/saved/neuralcdm_inference.pt'
+SHARED_WEIGHTS_PATH = 'models/saved/shared'
+
+
+class NeuralCDMService:
+    """
+    The NeuralCDM components of one process: item bank, student store, the float
+    model with its online trainer, and the inference artifact serving reads.
+
+    Under several workers exactly one process is the ``trainer``: it owns the
+    float model, the checkpoint and the writable student store, follows the
+    attempt journal and publishes the item-side weights as SharedWeights every
+    ``PUBLISH_INTERVAL`` seconds. The other processes are ``reader``s: they map
+    the student store read-only, which shows the trainer's row updates as they
+    happen, serve predictions from the latest published generation and append
+    the attempts they receive to the shared journal. The trainer serves from
+    the published weights as well, so every worker answers alike.
+    """
+
+    def __init__(self, role: str = ROLE, start_timeout: float = READER_START_TIMEOUT):
+        if role not in ('auto', 'trainer', 'reader'):
+            raise ValueError(f"Unknown NeuralCDM role {role!r}")
+        self.item_bank = ItemBank.load(ITEM_BANK_PATH if os.path.exists(ITEM_BANK_PATH) else QMATRIX_PATH)
+        self.item_bank_path = ITEM_BANK_PATH
+        self.shared = SharedWeights(SHARED_WEIGHTS_PATH)
+        if role != 'reader' and self.shared.acquire_writer():
+            self.role = 'trainer'
+        elif role == 'trainer':
+            raise RuntimeError(f"Another process already trains, it holds the lock of {SHARED_WEIGHTS_PATH}")
+        else:
+            self.role = 'reader'
+        self._items_lock = threading.Lock()
+        self._publisher: Optional[asyncio.Task] = None
+        if self.role == 'trainer':
+            self._init_trainer()
+        else:
+            self._init_reader(start_timeout)
+
+    def _init_trainer(self):
+        # Student embeddings live in a growable memory-mapped store keyed by user id
+        self.student_store = StudentStore(STUDENT_STORE_PATH, num_skills=self.item_bank.num_skills)
+
+        checkpoint = None
+        if os.path.exists(MODEL_PATH):
+            checkpoint = NeuralCDM.read_checkpoint(MODEL_PATH)
+            # Tasks published after the last checkpoint are added back from the item bank
+            self.model = NeuralCDM.from_checkpoint(checkpoint, self.student_store, self.item_bank.q_matrix)
+        else:
+            self.model = NeuralCDM(
+                num_skills=self.item_bank.num_skills,
+                num_students=None,  # Grows with the student store
+                num_items=len(self.item_bank),
+                student_store=self.student_store,
+                q_matrix=self.item_bank.q_matrix
+            )
+
+        # Every worker appends to the journal, the trainer trains on it in order
+        self.trainer = OnlineTrainer(
+            self.model, MODEL_PATH,
+            batch_size=TRAIN_BATCH_SIZE,
+            flush_interval=TRAIN_FLUSH_INTERVAL,
+            max_queue_size=TRAIN_QUEUE_SIZE,
+            checkpoint_interval=CHECKPOINT_INTERVAL,
+            journal=AttemptJournal(JOURNAL_PATH, JOURNAL_FSYNC_INTERVAL, shared=True),
+            follow_journal=True
+        )
+        if checkpoint is not None:
+            self.trainer.restore(checkpoint)
+        self._bank_mtime = self._item_bank_mtime()
+        self._published = None
+        self.publish()
+
+        # Predictions are served from a scripted artifact mapping the published weights
+        # while the trainer keeps updating the float model
+        self.inference_model = InferenceModel(self.model, shared=self.shared)
+        self.trainer.on_checkpoint = self._on_checkpoint
+
+    def _init_reader(self, start_timeout: float):
+        # The trainer creates the student store and the journal before its first publish
+        self.shared.wait(start_timeout)
+        self.student_store = StudentStore(STUDENT_STORE_PATH, num_skills=self.item_bank.num_skills,
+                                          readonly=True)
+        # Only gathers mastery from the store, its item weights are never used
+        self.model = NeuralCDM(
+            num_skills=self.item_bank.num_skills,
+            num_students=None,
+            num_items=len(self.item_bank),
+            student_store=self.student_store,
+            q_matrix=self.item_bank.q_matrix
+        )
+        self.model.eval()
+        self.trainer = AttemptForwarder(AttemptJournal(JOURNAL_PATH, JOURNAL_FSYNC_INTERVAL, shared=True),
+                                        self.shared, TRAIN_QUEUE_SIZE)
+        self.inference_model = InferenceModel(self.model, shared=self.shared, on_refresh=self._on_item_count)
+
+    def _on_item_count(self, num_items: int):
+        # Names of tasks other workers published, needed before the artifact scoring them is served
+        if num_items > len(self.item_bank):
+            self.item_bank.refresh(self.item_bank_path)
+
+    def _item_bank_mtime(self) -> int:
+        try:
+            return os.stat(self.item_bank_path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    @contextmanager
+    def _item_bank_locked(self):
+        """Serialize publishing tasks across processes so item ids stay unique"""
+        os.makedirs(os.path.dirname(self.item_bank_path) or '.', exist_ok=True)
+        fd = os.open(f"{self.item_bank_path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _sync_items(self):
+        """Trainer: grow the model by the tasks of the item bank it does not have yet"""
+        mtime = self._item_bank_mtime()
+        if mtime != self._bank_mtime:
+            self._bank_mtime = mtime
+            self.item_bank.refresh(self.item_bank_path)
+        with self._items_lock:
+            first = self.model.num_items
+            if len(self.item_bank) > first:
+                self.trainer.add_items(self.item_bank.q_matrix[first:])
+
+    def publish(self):
+        """
+        Trainer: publish the item-side weights if the model changed since the last
+        publish, and the training progress in any case.
+        """
+        self._sync_items()
+        trainer = self.trainer
+        with trainer.lock:
+            version = (trainer.steps, self.model.num_items)
+            weights = head_weights(self.model) if version != self._published else None
+            progress = (trainer.journal_offset, trainer.steps, trainer.trained_attempts)
+        if weights is not None:
+            self.shared.publish({name: value.numpy() for name, value in weights.items()})
+            self._published = version
+        self.shared.update_progress(*progress)
+
+    async def _publish_loop(self):
+        while True:
+            await asyncio.sleep(PUBLISH_INTERVAL)
+            await asyncio.to_thread(self.publish)
+
+    def recover(self) -> int:
+        """
+        Trainer: replay the journaled attempts the last checkpoint does not cover and publish.
+
+        Returns:
+            The number of replayed attempts
+        """
+        if self.role != 'trainer':
+            return 0
+        replayed = self.trainer.recover()
+        self.refresh_inference_model()
+        return replayed
+
+    async def start(self):
+        """Start training and publishing in the trainer; nothing runs in the background of a reader."""
+        await self.trainer.start()
+        if self.role == 'trainer':
+            self._publisher = asyncio.create_task(self._publish_loop())
+
+    async def stop(self):
+        """Stop the background tasks, train on what is left and publish the final weights."""
+        if self._publisher is not None:
+            self._publisher.cancel()
+            try:
+                await self._publisher
+            except asyncio.CancelledError:
+                pass
+            self._publisher = None
+        await self.trainer.stop()
+        if self.role == 'trainer':
+            await asyncio.to_thread(self.publish)
+        self.trainer.journal.close()
+        self.shared.close()
+
+    def refresh_inference_model(self):
+        """Trainer: publish the float model and serve the new generation right away"""
+        self.publish()
+        self.inference_model.refresh()
+
+    def _on_checkpoint(self):
+        self.refresh_inference_model()
+        self.inference_model.save(INFERENCE_PATH)
+
+    def add_item(self, skills) -> int:
+        """
+        Publish a task: save it to the item bank and have the trainer grow the model.
+
+        Any worker may publish tasks; the bank is locked across processes while a
+        task is added, and a reader waits until the trainer published weights
+        that score the new task.
+
+        Returns:
+            The item id of the new task
+
+        Raises:
+            TimeoutError: If a reader saw no weights scoring the task within
+                ``ITEM_PUBLISH_TIMEOUT``; the task stays in the bank and the
+                trainer still adds it
+        """
+        # The bank is saved first so a crash before the next checkpoint can re-add the task
+        with self._item_bank_locked():
+            self.item_bank.refresh(self.item_bank_path)
+            item_id = self.item_bank.add(skills)
+            self.item_bank.save(self.item_bank_path)
+        if self.role == 'trainer':
+            self.refresh_inference_model()
+            return item_id
+
+        deadline = time.monotonic() + ITEM_PUBLISH_TIMEOUT
+        while self.inference_model.num_items <= item_id:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Task {item_id} was not published within {ITEM_PUBLISH_TIMEOUT:g}s")
+            time.sleep(min(0.05, PUBLISH_INTERVAL))
+        return item_id
+
+
+_service: Optional[NeuralCDMService] = None
+_service_lock = threading.Lock()
+
+
+def get_neuralcdm_service(role: str = ROLE, start_timeout: float = READER_START_TIMEOUT) -> NeuralCDMService:
+    """
+    Return the process-wide NeuralCDMService, creating it on first use.
+
+    The NeuralCDM API and the exercise router share this instance, so the model,
+    student store and journal are opened once per process. Whether the process
+    trains or only serves is decided here, see NeuralCDMService.
+
+    Args:
+        role: The role to create the service with; only the NeuralCDM API, which
+            recovers and starts the service, may train, so other callers pass 'reader'
+        start_timeout: Seconds a reader waits for the trainer's first publish
+
+    Raises:
+        TimeoutError: If a reader saw no published weights within ``start_timeout``;
+            no service is kept, so the next call waits again
+    """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = NeuralCDMService(role, start_timeout)
+    return _service
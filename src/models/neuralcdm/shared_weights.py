@@ -0,0 +1,177 @@
+import os
+import time
+import fcntl
+import shutil
+import numpy as np
+from typing import Dict, Tuple
+from ..metrics import Gauge, Histogram
+
+KEEP_VERSIONS = 3  # Published generations kept on disk, older ones are pruned after a publish
+
+# Fields of the header, one little-endian int64 each
+HEADER_FIELDS = ('generation', 'journal_offset', 'steps', 'trained_attempts', 'trainer_pid')
+GENERATION, JOURNAL_OFFSET, STEPS, TRAINED_ATTEMPTS, TRAINER_PID = range(len(HEADER_FIELDS))
+
+PUBLISH_SECONDS = Histogram('neuralcdm_weights_publish_seconds', "Time to write and publish a weights generation")
+GENERATION_GAUGE = Gauge('neuralcdm_weights_generation', "Shared weights generation served by this worker")
+
+
+class SharedWeights:
+    """
+    Item-side NeuralCDM weights the trainer process publishes to the serving workers.
+
+    Each publish writes the weights as one ``.npy`` file per tensor into a new
+    version directory ``v<generation>`` and then stores the generation in a
+    small memory-mapped header. Workers map the header read-only, so checking
+    for a new generation is a memory read, and map the ``.npy`` files of a new
+    generation copy-on-write, so the item tables live once in the page cache
+    however many workers serve them. A version directory is never modified
+    after it was published; pruned ones stay readable by workers that still
+    have them mapped.
+
+    The header also carries the trainer's progress through the attempt journal,
+    which workers use for backpressure and statistics. Exactly one process may
+    publish, it is elected with ``acquire_writer``.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._header_path = os.path.join(directory, 'header.i64')
+        fd = os.open(self._header_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Growing with zeros is idempotent, so workers racing the trainer here are harmless
+            if os.fstat(fd).st_size < len(HEADER_FIELDS) * 8:
+                os.ftruncate(fd, len(HEADER_FIELDS) * 8)
+        finally:
+            os.close(fd)
+        self._header = np.memmap(self._header_path, dtype='<i8', mode='r', shape=(len(HEADER_FIELDS),))
+        self._writer_fd = None
+        GENERATION_GAUGE.set_function(lambda: self.generation)
+
+    @property
+    def generation(self) -> int:
+        """The latest published generation, 0 before the first publish"""
+        return int(self._header[GENERATION])
+
+    @property
+    def journal_offset(self) -> int:
+        """Journal sequence number up to which the trainer applied attempts"""
+        return int(self._header[JOURNAL_OFFSET])
+
+    @property
+    def is_writer(self) -> bool:
+        return self._writer_fd is not None
+
+    def header(self) -> Dict[str, int]:
+        """Every header field by name"""
+        return dict(zip(HEADER_FIELDS, self._header.tolist()))
+
+    def acquire_writer(self) -> bool:
+        """
+        Try to become the publishing process.
+
+        The election is an exclusive ``flock`` held until the process exits, so
+        a restarted trainer takes over from a crashed one.
+
+        Returns:
+            False if another process already publishes
+        """
+        if self._writer_fd is not None:
+            return True
+        fd = os.open(os.path.join(self.directory, 'writer.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._writer_fd = fd
+        self._header = np.memmap(self._header_path, dtype='<i8', mode='r+', shape=(len(HEADER_FIELDS),))
+        self._header[TRAINER_PID] = os.getpid()
+        # Leftovers of a publish the previous writer did not finish
+        for name in os.listdir(self.directory):
+            if name.startswith('.v'):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        return True
+
+    def publish(self, weights: Dict[str, np.ndarray]) -> int:
+        """
+        Publish a new generation of weights.
+
+        Args:
+            weights: Arrays by tensor name, stored as float32
+
+        Returns:
+            The new generation
+        """
+        if self._writer_fd is None:
+            raise RuntimeError("Only the process holding the writer lock publishes weights")
+        with PUBLISH_SECONDS.time():
+            generation = self.generation + 1
+            tmp_dir = os.path.join(self.directory, f".v{generation}.tmp{os.getpid()}")
+            os.makedirs(tmp_dir)
+            for name, array in weights.items():
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(array, dtype=np.float32))
+            version_dir = os.path.join(self.directory, f"v{generation}")
+            # Left behind by a writer that crashed between the rename and the header update
+            shutil.rmtree(version_dir, ignore_errors=True)
+            os.replace(tmp_dir, version_dir)
+            self._header[GENERATION] = generation
+
+            for name in os.listdir(self.directory):
+                if name.startswith('v') and name[1:].isdigit() and int(name[1:]) <= generation - KEEP_VERSIONS:
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        return generation
+
+    def update_progress(self, journal_offset: int, steps: int, trained_attempts: int):
+        """Record the trainer's progress through the journal for the workers"""
+        if self._writer_fd is None:
+            raise RuntimeError("Only the process holding the writer lock updates progress")
+        self._header[STEPS] = steps
+        self._header[TRAINED_ATTEMPTS] = trained_attempts
+        self._header[JOURNAL_OFFSET] = journal_offset
+
+    def load(self) -> Tuple[int, Dict[str, np.ndarray]]:
+        """
+        Map the latest published generation.
+
+        Returns:
+            Tuple of (generation, arrays by tensor name); the arrays are
+            copy-on-write mappings, writing to them never reaches other processes
+        """
+        previous = None
+        while True:
+            generation = self.generation
+            if generation == 0:
+                raise LookupError(f"No weights were published to {self.directory} yet")
+            version_dir = os.path.join(self.directory, f"v{generation}")
+            try:
+                return generation, {
+                    name[:-len('.npy')]: np.load(os.path.join(version_dir, name), mmap_mode='c').view(np.ndarray)
+                    for name in os.listdir(version_dir) if name.endswith('.npy')
+                }
+            except FileNotFoundError:
+                # Pruned after the header was read, a newer generation is current by now
+                if generation == previous:
+                    raise
+                previous = generation
+
+    def wait(self, timeout: float, poll_interval: float = 0.1) -> int:
+        """
+        Wait until a first generation is published, e.g. by a trainer that is still starting.
+
+        Returns:
+            The latest generation
+        """
+        deadline = time.monotonic() + timeout
+        while self.generation == 0:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"No weights were published to {self.directory} within {timeout:g}s")
+            time.sleep(poll_interval)
+        return self.generation
+
+    def close(self):
+        """Give up the writer lock, if held"""
+        if self._writer_fd is not None:
+            os.close(self._writer_fd)
+            self._writer_fd = None
@@ -0,0 +1,223 @@
+import os
+import threading
+import numpy as np
+from typing import Dict, Tuple
+
+
+class StudentStore:
+    """
+    Growable, memory-mapped store of per-student NeuralCDM state.
+
+    External user IDs are mapped to rows of a float32 file that is memory-mapped
+    and grown in chunks by extending the file, which creates zero-filled holes:
+    students that are never read cost neither resident memory nor disk blocks.
+    Each row holds the student's ability embedding, its cached mastery (sigmoid
+    of the embedding) and a row-wise Adagrad accumulator, so training updates
+    and mastery reads only touch the pages of the students involved.
+
+    Rows are updated in place. ``flush`` writes dirty pages back and is called
+    when the model is checkpointed, so journal replay after a crash may re-apply
+    a few updates that already reached the file (at-least-once semantics).
+
+    A ``readonly`` store maps the files of a store another process writes, the
+    trainer. Since the mapping is shared, updated rows are visible right away;
+    users the writer added are picked up by ``refresh``, which lookups call
+    when they meet an unknown user.
+    """
+
+    def __init__(self, directory: str, num_skills: int, chunk_size: int = 65536, readonly: bool = False):
+        self.directory = directory
+        self.num_skills = num_skills
+        self.chunk_size = chunk_size
+        self.readonly = readonly
+        self.row_width = 2 * num_skills + 1  # embedding, mastery, adagrad accumulator
+        self._lock = threading.Lock()
+
+        self._rows_path = os.path.join(directory, 'rows.f32')
+        self._ids_path = os.path.join(directory, 'ids.i64')
+        if readonly:
+            self._ids_fd = os.open(self._ids_path, os.O_RDONLY)
+            self._rows_fd = os.open(self._rows_path, os.O_RDONLY)
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self._ids_fd = os.open(self._ids_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            self._rows_fd = os.open(self._rows_path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        ids = np.fromfile(self._ids_path, dtype='<i8')
+        self.num_rows = len(ids)
+        self._ids = np.empty(max(len(ids), chunk_size), dtype=np.int64)  # Grown by doubling
+        self._ids[:len(ids)] = ids
+        self._rows: np.memmap = None
+        self._map(max(self.num_rows, 1))
+
+        # Sorted lookup arrays plus the users added since they were built; swapped as one tuple
+        # so lock-free readers always see a consistent pair
+        self._index: Tuple[np.ndarray, np.ndarray, Dict[int, int]] = (np.empty(0, dtype=np.int64),
+                                                                     np.empty(0, dtype=np.int64), {})
+        self._rebuild_index()
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def _map(self, min_rows: int):
+        """Grow the rows file to a whole number of chunks holding ``min_rows`` and remap it."""
+        row_bytes = self.row_width * 4
+        capacity = os.fstat(self._rows_fd).st_size // row_bytes
+        if self._rows is not None and len(self._rows) >= min_rows:
+            return
+        if capacity < min_rows:
+            if self.readonly:
+                raise RuntimeError(f"{self._rows_path} holds {capacity} rows, {min_rows} are known")
+            capacity = -(-min_rows // self.chunk_size) * self.chunk_size
+            os.ftruncate(self._rows_fd, capacity * row_bytes)
+        self._rows = np.memmap(self._rows_path, dtype=np.float32, mode='r' if self.readonly else 'r+',
+                               shape=(capacity, self.row_width))
+
+    @property
+    def capacity(self) -> int:
+        return len(self._rows)
+
+    def lookup(self, user_ids: np.ndarray) -> np.ndarray:
+        """
+        Map user IDs to rows.
+
+        Returns:
+            Row index per user ID, -1 for unknown users
+        """
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        sorted_ids, sorted_rows, recent = self._index
+        rows = np.full(len(user_ids), -1, dtype=np.int64)
+        if len(sorted_ids):
+            positions = np.minimum(np.searchsorted(sorted_ids, user_ids), len(sorted_ids) - 1)
+            found = sorted_ids[positions] == user_ids
+            rows[found] = sorted_rows[positions[found]]
+        if recent:
+            for i in np.flatnonzero(rows < 0).tolist():
+                rows[i] = recent.get(int(user_ids[i]), -1)
+        if self.readonly and (rows < 0).any() and self.refresh():
+            return self.lookup(user_ids)
+        return rows
+
+    def refresh(self) -> int:
+        """
+        Pick up the users the writing process added since this store was opened.
+
+        The writer initializes rows before appending their user IDs, so every
+        ID read here has a valid row.
+
+        Returns:
+            The number of users added
+        """
+        with self._lock:
+            start = self.num_rows
+            count = os.fstat(self._ids_fd).st_size // 8 - start
+            if count <= 0:
+                return 0
+            new_ids = np.frombuffer(os.pread(self._ids_fd, count * 8, start * 8), dtype='<i8')
+            self._map(start + count)
+            self._append_ids(start, new_ids)
+        return count
+
+    def rows(self, user_ids: np.ndarray, create: bool = False) -> np.ndarray:
+        """
+        Map user IDs to rows, optionally assigning rows to unknown users.
+
+        New students start with a zero embedding, i.e. a mastery of 0.5 on every skill.
+        """
+        rows = self.lookup(user_ids)
+        if not create or (rows >= 0).all():
+            return rows
+        if self.readonly:
+            raise RuntimeError("Rows of a read-only StudentStore are added by the writing process")
+
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        with self._lock:
+            # Re-check under the lock, another thread may have added them
+            rows = self.lookup(user_ids)
+            new_ids = np.unique(user_ids[rows < 0])
+            if len(new_ids) == 0:
+                return rows
+            start = self.num_rows
+            self._map(start + len(new_ids))
+            self._rows[start:start + len(new_ids)] = 0.0
+            self._rows[start:start + len(new_ids), self.num_skills:2 * self.num_skills] = 0.5
+            os.write(self._ids_fd, new_ids.astype('<i8').tobytes())
+            self._append_ids(start, new_ids)
+        return self.lookup(user_ids)
+
+    def _append_ids(self, start: int, new_ids: np.ndarray):
+        """Register the users of rows ``start`` onwards, called under the lock."""
+        if start + len(new_ids) > len(self._ids):
+            grown = np.empty(max(2 * len(self._ids), start + len(new_ids)), dtype=np.int64)
+            grown[:start] = self._ids[:start]
+            self._ids = grown
+        self._ids[start:start + len(new_ids)] = new_ids
+        self.num_rows = start + len(new_ids)
+
+        recent = self._index[2]
+        for offset, user_id in enumerate(new_ids.tolist()):
+            recent[user_id] = start + offset
+        if len(recent) > max(4096, self.num_rows // 16):
+            self._rebuild_index()
+
+    def _rebuild_index(self):
+        """Fold recently added users into the sorted lookup arrays."""
+        ids = self._ids[:self.num_rows]
+        order = np.argsort(ids, kind='stable')
+        self._index = (ids[order], order.astype(np.int64), {})
+
+    def user_ids(self) -> np.ndarray:
+        """User ID of every row, in row order."""
+        if self.readonly:
+            self.refresh()
+        return self._ids[:self.num_rows]
+
+    def embeddings(self, rows: np.ndarray) -> np.ndarray:
+        """Copy the ability embeddings of rows; unknown rows (-1) get zeros."""
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.zeros((len(rows), self.num_skills), dtype=np.float32)
+        known = rows >= 0
+        out[known] = self._rows[rows[known], :self.num_skills]
+        return out
+
+    def mastery(self, rows: np.ndarray) -> np.ndarray:
+        """Copy the cached mastery of rows; unknown rows (-1) get 0.5."""
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.full((len(rows), self.num_skills), 0.5, dtype=np.float32)
+        known = rows >= 0
+        out[known] = self._rows[rows[known], self.num_skills:2 * self.num_skills]
+        return out
+
+    def import_embeddings(self, user_ids: np.ndarray, embeddings: np.ndarray):
+        """Bulk-load embeddings, e.g. from a checkpoint of a dense student table."""
+        rows = self.rows(user_ids, create=True)
+        self._rows[rows, :self.num_skills] = embeddings
+        self._rows[rows, self.num_skills:2 * self.num_skills] = 1 / (1 + np.exp(-embeddings))
+
+    def apply_gradients(self, rows: np.ndarray, gradients: np.ndarray,
+                        learning_rate: float, eps: float = 1e-8) -> np.ndarray:
+        """
+        Apply a row-wise Adagrad step to the embeddings of rows and refresh their mastery.
+
+        Gradients of rows that appear several times in a batch are summed first.
+
+        Returns:
+            The distinct updated rows
+        """
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        summed = np.zeros((len(unique_rows), self.num_skills), dtype=np.float32)
+        np.add.at(summed, inverse, gradients)
+
+        state = self._rows[unique_rows]
+        state[:, -1] += (summed ** 2).mean(axis=1)
+        state[:, :self.num_skills] -= learning_rate * summed / (np.sqrt(state[:, -1:]) + eps)
+        state[:, self.num_skills:2 * self.num_skills] = 1 / (1 + np.exp(-state[:, :self.num_skills]))
+        self._rows[unique_rows] = state
+        return unique_rows
+
+    def flush(self):
+        """Write dirty rows back to disk and fsync the ID map."""
+        if self.readonly:
+            return
+        self._rows.flush()
+        os.fsync(self._ids_fd)
@@ -4,7 +4,19 @@ import torch.optim as optim
 import numpy as np
 import json
 import os
+import time
+import argparse
+import copy
+from typing import List, Dict, Any, Iterator, Tuple
+from torch.utils.data import IterableDataset, DataLoader, get_worker_info
 from neuralcdm import NeuralCDM
+from attempt_journal import ATTEMPT_DTYPE, HEADER_SIZE, MAGIC
+from student_store import StudentStore
+
+MODEL_PATH = 'models/saved/neuralcdm_model.pt'
+STUDENT_STORE_PATH = 'models/saved/students'  # The store the API trainer serves students from
+SHARD_SIZE = 1 << 20  # Attempts per shard file written by write_attempt_shards
+BLOCK_SIZE = 1 << 18  # Attempts per shuffled block read by a DataLoader worker
 
 def generate_dummy_data(num_students, num_items, num_skills, q_matrix, num_samples=1000):
     """Generate dummy training data"""
@@ -20,10 +32,271 @@ def generate_dummy_data(num_students, num_items, num_skills, q_matrix, num_sampl
     correct = torch.FloatTensor(correct)
     
     # Get Q-matrix for each item
-    q_matrix_tensor = torch.FloatTensor([q_matrix[f"task_{i+1}"] for i in item_ids])
+    q_matrix_tensor = q_matrix_rows(q_matrix)[item_ids]
     
     return student_ids, item_ids, q_matrix_tensor, correct
 
+def q_matrix_rows(q_matrix):
+    """Stack the task Q-matrix entries into a [num_items, num_skills] tensor indexed by item id"""
+    return torch.FloatTensor([q_matrix[f"task_{i+1}"] for i in range(len(q_matrix))])
+
+def write_attempt_shards(records, directory, shard_size=SHARD_SIZE, prefix='attempts'):
+    """
+    Write attempts as chunked binary shards that training can memory-map.
+    
+    Each shard is a ``.npy`` file of ``ATTEMPT_DTYPE`` records (the record format
+    of the attempt journal), written to a temporary file and renamed into place.
+    
+    Args:
+        records: Structured array of attempts, or an iterable of such arrays
+        directory: Output directory
+        shard_size: Maximum number of attempts per shard
+        prefix: File name prefix of the shards
+        
+    Returns:
+        Paths of the written shards
+    """
+    if isinstance(records, np.ndarray):
+        records = [records]
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    buffer = np.empty(0, dtype=ATTEMPT_DTYPE)
+    
+    def write(shard):
+        path = os.path.join(directory, f"{prefix}-{len(paths):05d}.npy")
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, shard)
+        os.replace(tmp_path, path)
+        paths.append(path)
+    
+    for chunk in records:
+        buffer = np.concatenate([buffer, np.asarray(chunk, dtype=ATTEMPT_DTYPE)])
+        while len(buffer) >= shard_size:
+            write(buffer[:shard_size])
+            buffer = buffer[shard_size:]
+    if len(buffer):
+        write(buffer)
+    return paths
+
+def open_attempts(path):
+    """
+    Memory-map an attempt file, either a shard written by write_attempt_shards
+    or an attempt journal of the API.
+    
+    Returns:
+        Read-only structured array with ``ATTEMPT_DTYPE`` fields
+    """
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is neither an attempt shard nor an attempt journal")
+    records = (os.path.getsize(path) - HEADER_SIZE) // ATTEMPT_DTYPE.itemsize
+    if records == 0:
+        return np.empty(0, dtype=ATTEMPT_DTYPE)
+    return np.memmap(path, dtype=ATTEMPT_DTYPE, mode='r', offset=HEADER_SIZE, shape=(records,))
+
+def is_journal(path):
+    """Whether an attempt file is an attempt journal rather than a shard"""
+    return not path.endswith('.npy')
+
+def find_attempt_files(paths):
+    """Expand directories into the attempt shards they contain"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.npy')))
+        else:
+            files.append(path)
+    return files
+
+def held_out_mask(positions, valid_fraction):
+    """
+    Deterministically assign attempts to the held-out split by hashing their position.
+    
+    Every epoch and every worker agree on the split without storing it.
+    """
+    hashed = (positions.astype(np.uint64) + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15)
+    return (hashed >> np.uint64(40)).astype(np.float64) < valid_fraction * (1 << 24)
+
+class AttemptStream(IterableDataset):
+    """
+    Stream mini-batches of attempts from memory-mapped attempt files.
+    
+    Files are cut into blocks of ``block_size`` attempts. Every epoch the blocks
+    are shuffled and dealt round-robin to the DataLoader workers, which permute
+    the attempts within a block and yield ready-made batches, so at most one
+    block per worker is resident and nothing is collated sample by sample.
+    Attempts whose hashed position falls below ``valid_fraction`` form the
+    held-out split.
+    """
+    
+    def __init__(self, paths, batch_size=4096, split='train', valid_fraction=0.05,
+                 shuffle=True, block_size=BLOCK_SIZE, seed=0):
+        if split not in ('train', 'valid', 'all'):
+            raise ValueError(f"Unknown split: {split}")
+        self.paths = list(paths)
+        self.batch_size = batch_size
+        self.split = split
+        self.valid_fraction = valid_fraction
+        self.shuffle = shuffle
+        self.block_size = block_size
+        self.seed = seed
+        self.epoch = 0
+        # Only lengths are kept, workers map the files themselves
+        self.lengths = [len(open_attempts(path)) for path in self.paths]
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)]).astype(np.int64)
+    
+    def __len__(self):
+        return int(self.offsets[-1])
+    
+    def set_epoch(self, epoch):
+        """Select the shuffle order of the next iteration"""
+        self.epoch = epoch
+    
+    def _blocks(self) -> List[Tuple[int, int, int]]:
+        blocks = [(file_index, start, min(start + self.block_size, length))
+                  for file_index, length in enumerate(self.lengths)
+                  for start in range(0, length, self.block_size)]
+        if self.shuffle:
+            order = np.random.default_rng((self.seed, self.epoch)).permutation(len(blocks))
+            blocks = [blocks[i] for i in order]
+        return blocks
+    
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        worker = get_worker_info()
+        blocks = self._blocks()
+        if worker is not None:
+            blocks = blocks[worker.id::worker.num_workers]
+        
+        files = {}
+        for block_index, (file_index, start, stop) in enumerate(blocks):
+            if file_index not in files:
+                files[file_index] = open_attempts(self.paths[file_index])
+            records = np.array(files[file_index][start:stop])
+            
+            if self.split != 'all':
+                held_out = held_out_mask(self.offsets[file_index] + np.arange(start, stop), self.valid_fraction)
+                records = records[held_out if self.split == 'valid' else ~held_out]
+            if self.shuffle:
+                rng = np.random.default_rng((self.seed, self.epoch, file_index, start))
+                records = records[rng.permutation(len(records))]
+            
+            user_ids = torch.from_numpy(records['user_id'].astype(np.int64))
+            item_ids = torch.from_numpy(records['item_id'].astype(np.int64))
+            correct = torch.from_numpy(records['correct'].astype(np.float32))
+            for i in range(0, len(records), self.batch_size):
+                yield user_ids[i:i + self.batch_size], item_ids[i:i + self.batch_size], correct[i:i + self.batch_size]
+
+def attempt_loader(dataset, num_workers=2):
+    """DataLoader over an AttemptStream, batches are already formed by the dataset"""
+    return DataLoader(dataset, batch_size=None, num_workers=num_workers)
+
+def evaluate(model, loader):
+    """
+    Compute the mean loss and accuracy of the model over a loader.
+    
+    Returns:
+        Tuple of (loss, accuracy, number of attempts)
+    """
+    criterion = nn.BCELoss(reduction='sum')
+    total_loss, total_correct, total = 0.0, 0, 0
+    model.eval()
+    with torch.no_grad():
+        for student_ids, item_ids, correct in loader:
+            predictions = model(student_ids, item_ids)
+            total_loss += criterion(predictions, correct).item()
+            total_correct += ((predictions >= 0.5).float() == correct).sum().item()
+            total += len(correct)
+    if total == 0:
+        return float('nan'), float('nan'), 0
+    return total_loss / total, total_correct / total, total
+
+def train_streaming(model, paths, num_epochs=20, batch_size=4096, learning_rate=0.01,
+                    num_workers=2, valid_fraction=0.05, patience=3, seed=0) -> List[Dict[str, Any]]:
+    """
+    Train the NeuralCDM model by streaming mini-batches from attempt files.
+    
+    Student embeddings get sparse gradients, so a step only touches the students
+    in its batch. After every epoch the model is evaluated on the held-out split;
+    training stops once the held-out loss has not improved for ``patience``
+    epochs and the best weights are restored.
+    
+    Args:
+        model: Model with a dense student table covering every user id in the files
+        paths: Attempt shards or journals, see open_attempts
+        num_epochs: Maximum number of epochs
+        batch_size: Attempts per gradient step
+        learning_rate: Learning rate of both optimizers
+        num_workers: DataLoader worker processes
+        valid_fraction: Fraction of attempts held out for early stopping
+        patience: Epochs without improvement before stopping
+        seed: Seed of the shuffle order
+        
+    Returns:
+        Per-epoch statistics
+    """
+    criterion = nn.BCELoss()
+    model.student_embeddings.sparse = True
+    sparse_optimizer = optim.SparseAdam([model.student_embeddings.weight], lr=learning_rate)
+    optimizer = optim.Adam(
+        [p for name, p in model.named_parameters() if name != 'student_embeddings.weight'],
+        lr=learning_rate
+    )
+    
+    train_data = AttemptStream(paths, batch_size, 'train', valid_fraction, shuffle=True, seed=seed)
+    valid_data = AttemptStream(paths, batch_size, 'valid', valid_fraction, shuffle=False)
+    valid_loader = attempt_loader(valid_data, num_workers)
+    
+    history = []
+    best_loss, best_state, stale_epochs = float('inf'), None, 0
+    for epoch in range(num_epochs):
+        train_data.set_epoch(epoch)
+        model.train()
+        total_loss, samples = 0.0, 0
+        start = time.perf_counter()
+        for student_ids, item_ids, correct in attempt_loader(train_data, num_workers):
+            optimizer.zero_grad()
+            sparse_optimizer.zero_grad()
+            predictions = model(student_ids, item_ids)
+            loss = criterion(predictions, correct)
+            loss.backward()
+            optimizer.step()
+            sparse_optimizer.step()
+            total_loss += loss.item() * len(correct)
+            samples += len(correct)
+        elapsed = time.perf_counter() - start
+        
+        valid_loss, valid_accuracy, _ = evaluate(model, valid_loader)
+        stats = {
+            'epoch': epoch + 1,
+            'train_loss': total_loss / max(samples, 1),
+            'valid_loss': valid_loss,
+            'valid_accuracy': valid_accuracy,
+            'samples': samples,
+            'seconds': elapsed,
+            'samples_per_second': samples / elapsed if elapsed > 0 else 0.0
+        }
+        history.append(stats)
+        print(f"Epoch [{epoch+1}/{num_epochs}], Loss: {stats['train_loss']:.4f}, "
+              f"Valid loss: {valid_loss:.4f}, Valid accuracy: {valid_accuracy:.3f}, "
+              f"{stats['samples_per_second']:,.0f} samples/s")
+        
+        if valid_loss < best_loss:
+            best_loss, stale_epochs = valid_loss, 0
+            best_state = copy.deepcopy(model.state_dict())
+        else:
+            stale_epochs += 1
+            if stale_epochs >= patience:
+                print(f"Early stopping after epoch {epoch+1}, best valid loss: {best_loss:.4f}")
+                break
+    
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    model.invalidate_mastery()
+    return history
+
 def train_model(model, train_data, num_epochs=100, learning_rate=0.001):
     """Train the NeuralCDM model"""
     criterion = nn.BCELoss()
@@ -47,8 +320,58 @@ def train_model(model, train_data, num_epochs=100, learning_rate=0.001):
         
         if (epoch + 1) % 10 == 0:
             print(f'Epoch [{epoch+1}/{num_epochs}], Loss: {loss.item():.4f}')
+    
+    model.invalidate_mastery()
+
+def save_checkpoint(model, path, store_path, user_ids, journal_offset):
+    """
+    Save a trained dense-student model the way the API trainer resumes from it.
+    
+    The embeddings of the students the training data covers are written into
+    the StudentStore, replacing rows the online trainer had for them, and the
+    checkpoint keeps the item side with the journal offset the data covers, so
+    the API only replays attempts journaled after it. Students absent from the
+    data keep their rows. The API should not be training on the store meanwhile.
+    
+    Args:
+        model: Model with a dense student table indexed by user id
+        path: Destination of the checkpoint
+        store_path: Directory of the StudentStore
+        user_ids: Users whose embeddings are written to the store
+        journal_offset: Number of records of the API journal the training data covers
+    """
+    store = StudentStore(store_path, num_skills=model.num_skills)
+    embeddings = model.student_embeddings.weight.detach()[torch.from_numpy(user_ids)].numpy()
+    store.import_embeddings(user_ids, embeddings)
+    store_model = NeuralCDM(model.num_skills, None, model.num_items, student_store=store, q_matrix=model.q_matrix)
+    store_model.load_state_dict({name: value for name, value in model.state_dict().items()
+                                 if name != 'student_embeddings.weight'})
+    # Flushes the store before the checkpoint is written
+    store_model.save_model(path, extra={'journal_offset': journal_offset})
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the NeuralCDM model")
+    parser.add_argument('--attempts', nargs='+',
+                        help="Attempt shard directories/files or attempt journals to stream; "
+                             "trains on dummy data when omitted")
+    parser.add_argument('--generate', type=int, default=0,
+                        help="Write this many dummy attempts as shards to the first --attempts directory first")
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=4096)
+    parser.add_argument('--learning-rate', type=float, default=0.01)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--valid-fraction', type=float, default=0.05)
+    parser.add_argument('--patience', type=int, default=3)
+    parser.add_argument('--student-store', default=STUDENT_STORE_PATH,
+                        help="StudentStore the trained student embeddings are written to")
+    parser.add_argument('--journal-offset', type=int,
+                        help="Records of the API journal the attempts cover; defaults to the length of the "
+                             "journal among --attempts, or 0 when only shards are given")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    
     # Load Q-matrix
     with open('src/data/qmatrix.json', 'r') as f:
         q_matrix_data = json.load(f)
@@ -58,18 +381,42 @@ def main():
     num_items = len(q_matrix_data['tasks'])
     q_matrix = q_matrix_data['tasks']
     
-    # Initialize model
-    model = NeuralCDM(num_skills, num_students, num_items)
-    
-    # Generate dummy data
-    train_data = generate_dummy_data(num_students, num_items, num_skills, q_matrix)
-    
-    # Train model
-    train_model(model, train_data)
+    if args.attempts:
+        if args.generate:
+            student_ids, item_ids, _, correct = generate_dummy_data(num_students, num_items, num_skills,
+                                                                    q_matrix, args.generate)
+            records = np.zeros(args.generate, dtype=ATTEMPT_DTYPE)
+            records['user_id'], records['item_id'], records['correct'] = student_ids, item_ids, correct
+            write_attempt_shards(records, args.attempts[0])
+        
+        paths = find_attempt_files(args.attempts)
+        attempts = [open_attempts(path) for path in paths]
+        if not any(len(records) for records in attempts):
+            raise SystemExit(f"No attempts found in {', '.join(args.attempts)}")
+        journals = [len(records) for path, records in zip(paths, attempts) if is_journal(path)]
+        if args.journal_offset is None and len(journals) > 1:
+            raise SystemExit("Several attempt journals given, pass --journal-offset for the API journal")
+        journal_offset = args.journal_offset if args.journal_offset is not None else sum(journals)
+        user_ids = np.unique(np.concatenate([np.unique(records['user_id']) for records in attempts]))
+        # The dense student table has to cover the largest user id in the files
+        num_students = int(user_ids[-1]) + 1
+        model = NeuralCDM(num_skills, num_students, num_items, q_matrix=q_matrix_rows(q_matrix))
+        train_streaming(model, paths, args.epochs, args.batch_size,
+                        args.learning_rate, args.workers, args.valid_fraction, args.patience)
+    else:
+        # Initialize model
+        model = NeuralCDM(num_skills, num_students, num_items, q_matrix=q_matrix_rows(q_matrix))
+        
+        # Generate dummy data
+        train_data = generate_dummy_data(num_students, num_items, num_skills, q_matrix)
+        user_ids = np.unique(train_data[0].numpy())
+        journal_offset = args.journal_offset or 0
+        
+        # Train model
+        train_model(model, train_data)
     
     # Save model
-    os.makedirs('models/saved', exist_ok=True)
-    model.save_model('models/saved/neuralcdm_model.pt')
+    save_checkpoint(model, MODEL_PATH, args.student_store, user_ids, journal_offset)
     
     # Test model on a sample student
     student_id = 0
@@ -0,0 +1,142 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for use in a cache key (case and whitespace insensitive)."""
+    return ' '.join(query.lower().split())
+
+
+class RetrievalCache:
+    """
+    Bounded LRU cache with per-entry TTL and single-flight miss handling.
+
+    Concurrent lookups of the same missing key are collapsed: the first caller
+    computes the value while the others wait for its result instead of repeating
+    the work. Entries are tagged with a generation that ``invalidate`` bumps, so
+    results computed against an older knowledge graph are never served or stored.
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Tuple[Any, bool]:
+        """
+        Look up a key without computing it on a miss.
+
+        Returns:
+            Tuple of (value or None, whether it was found)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], True
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None, False
+
+    def put(self, key: Hashable, value: Any, generation: int = None):
+        """
+        Store a value, unless the cache was invalidated since ``generation``.
+
+        Args:
+            key: The cache key
+            value: The value to store
+            generation: Generation observed before the value was computed
+        """
+        with self._lock:
+            self._store(key, value, self.generation if generation is None else generation)
+
+    def _store(self, key: Hashable, value: Any, generation: int):
+        if generation != self.generation:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Return the cached value for key, computing it at most once on a miss.
+
+        Args:
+            key: The cache key
+            compute: Callable producing the value on a miss
+
+        Returns:
+            Tuple of (value, whether it was served from the cache)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1], True
+                del self._entries[key]
+
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses += 1
+            else:
+                # Collapsed onto a computation already running for this key
+                self.hits += 1
+            generation = self.generation
+
+        if not owner:
+            return future.result(), True
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self._store(key, value, generation)
+        future.set_result(value)
+        return value, False
+
+    def invalidate(self):
+        """Drop every entry, e.g. after the knowledge graph was reloaded."""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """Get hit/miss counters and occupancy of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl
+            }
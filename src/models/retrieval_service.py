@@ -0,0 +1,63 @@
+import threading
+from typing import Optional
+from .mab_enhanced_rag import MABEnhancedRAG
+from .bandit_store import BanditStateStore
+from .retrieval_cache import RetrievalCache
+from .graph_snapshot import SNAPSHOT_DIR
+from .metrics import Counter, Gauge
+
+CACHE_LOOKUPS = Counter('retrieval_cache_lookups_total', "Arm result cache lookups", ['result'])
+CACHE_EVICTIONS = Counter('retrieval_cache_evictions_total', "Arm results evicted from the cache")
+CACHE_ENTRIES = Gauge('retrieval_cache_entries', "Arm results held in the cache")
+
+KNOWLEDGE_GRAPH_PATH = "src/data/ielts_knowledge_graph.json"
+BANDIT_STATE_PATH = "models/saved/bandit_state.db"
+CACHE_SIZE = 4096  # Maximum number of cached arm results
+CACHE_TTL = 300.0  # Seconds a cached arm result stays valid
+CACHE_HITS_UPDATE_BANDIT = False  # Whether cache hits still count as bandit pulls
+
+_service: Optional[MABEnhancedRAG] = None
+_service_lock = threading.Lock()
+_ready = threading.Event()
+
+
+def get_retrieval_service() -> MABEnhancedRAG:
+    """
+    Return the process-wide MABEnhancedRAG, creating it on first use.
+
+    All routers share this instance, so the knowledge graph and its indexes are
+    loaded once per process, and bandit statistics are merged across worker
+    processes through the SQLite state store.
+    """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                cache = RetrievalCache(CACHE_SIZE, CACHE_TTL)
+                _service = MABEnhancedRAG(
+                    KNOWLEDGE_GRAPH_PATH,
+                    state_store=BanditStateStore(BANDIT_STATE_PATH, MABEnhancedRAG.num_arms),
+                    cache=cache,
+                    cache_hits_update_bandit=CACHE_HITS_UPDATE_BANDIT,
+                    snapshot_dir=SNAPSHOT_DIR
+                )
+                # The cache keeps its own counters, they are read at scrape time
+                CACHE_LOOKUPS.labels('hit').set_function(lambda: cache.hits)
+                CACHE_LOOKUPS.labels('miss').set_function(lambda: cache.misses)
+                CACHE_EVICTIONS.set_function(lambda: cache.evictions)
+                CACHE_ENTRIES.set_function(lambda: len(cache))
+    else:
+        # Pick up snapshot versions published by other workers
+        _service.check_snapshot()
+    return _service
+
+
+def warm_retrieval_service():
+    """Open the service and warm its indexes; the readiness probe reports ready afterwards."""
+    get_retrieval_service().knowledge_graph_rag.warm()
+    _ready.set()
+
+
+def is_retrieval_service_ready() -> bool:
+    """Whether the service is open and its indexes were warmed."""
+    return _ready.is_set()
@@ -0,0 +1,279 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .bm25_index import tokenize
+
+PROGRESS_DAYS = 90  # Days of daily progress kept in a rollup
+RECENT_ESSAYS = 10  # Essays kept in a rollup for the profile page
+SENTENCE_PATTERN = re.compile(r'[.!?]+')
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS essays ("
+    "id INTEGER PRIMARY KEY, student_id TEXT NOT NULL, topic TEXT NOT NULL, band_score REAL NOT NULL, "
+    "components TEXT NOT NULL, created_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS essays_student ON essays (student_id, created_at)",
+    "CREATE TABLE IF NOT EXISTS submissions ("
+    "id INTEGER PRIMARY KEY, student_id TEXT NOT NULL, exercise_id TEXT NOT NULL, component_type TEXT NOT NULL, "
+    "difficulty TEXT NOT NULL, answer TEXT NOT NULL, score REAL NOT NULL, created_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS submissions_student ON submissions (student_id, created_at)",
+    "CREATE TABLE IF NOT EXISTS attempts ("
+    "id INTEGER PRIMARY KEY, student_id TEXT NOT NULL, exercise_id TEXT NOT NULL, correct INTEGER NOT NULL, "
+    "created_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS attempts_student ON attempts (student_id, created_at)",
+    # One row per student holding the incrementally maintained statistics
+    "CREATE TABLE IF NOT EXISTS profiles ("
+    "student_id TEXT PRIMARY KEY, name TEXT, rollup TEXT NOT NULL)"
+]
+
+
+def empty_rollup() -> Dict[str, Any]:
+    return {
+        'essay_count': 0,
+        'band_sum': 0.0,
+        'components': {},  # component type -> [score sum, count]
+        'submission_count': 0,
+        'attempt_count': 0,
+        'attempt_correct': 0,
+        'progress': {},  # YYYY-MM-DD -> [score sum, count]
+        'recent_essays': [],
+        'style': {'words': 0, 'sentences': 0, 'long_words': 0}
+    }
+
+
+def _day(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+
+
+def _add_progress(rollup: Dict[str, Any], timestamp: float, score: float):
+    progress = rollup['progress']
+    entry = progress.setdefault(_day(timestamp), [0.0, 0])
+    entry[0] += score
+    entry[1] += 1
+    if len(progress) > PROGRESS_DAYS:
+        for day in sorted(progress)[:len(progress) - PROGRESS_DAYS]:
+            del progress[day]
+
+
+def _add_style(rollup: Dict[str, Any], text: str):
+    tokens = tokenize(text)
+    style = rollup['style']
+    style['words'] += len(tokens)
+    style['sentences'] += max(1, len([s for s in SENTENCE_PATTERN.split(text) if s.strip()])) if tokens else 0
+    style['long_words'] += sum(len(token) >= 7 for token in tokens)
+
+
+def _component_text(component: Any) -> str:
+    return '. '.join(component) if isinstance(component, list) else component
+
+
+class StudentRecordStore:
+    """
+    Essays, exercise submissions and attempts of students in a local SQLite file.
+
+    Every write also updates the student's rollup row (average band score,
+    per-component scores, daily progress, recent essays, writing style counts)
+    in the same transaction, so reading a profile is a single primary-key row
+    fetch however long the student's history is. The database runs in WAL mode
+    so profile reads never block writers: writes go through one connection
+    under a lock, and every thread reads through a connection of its own,
+    which only ever sees committed rollups.
+    """
+
+    def __init__(self, path: str = "models/saved/students.db"):
+        self.path = path
+        self._lock = threading.Lock()  # Serializes writes on the shared write connection
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self._connection.execute(statement)
+
+    def _reader(self) -> sqlite3.Connection:
+        """The read connection of the calling thread, opened on its first read"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA query_only=ON")
+            self._local.connection = connection
+        return connection
+
+    def _write(self, student_id: str, statement: Optional[str], values: tuple, update,
+               name: Optional[str] = None) -> Optional[int]:
+        """
+        Run an insert and the read-modify-write of the student's rollup in one transaction.
+
+        Args:
+            student_id: The student
+            statement: INSERT statement of the history row, None to only touch the rollup
+            values: Parameters of the statement
+            update: Callable applying the change to the rollup, given the rollup and the new row id
+            name: Optional new display name
+
+        Returns:
+            The id of the inserted row
+        """
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row_id = self._connection.execute(statement, values).lastrowid if statement else None
+                row = self._connection.execute(
+                    "SELECT name, rollup FROM profiles WHERE student_id = ?", (student_id,)
+                ).fetchone()
+                rollup = json.loads(row[1]) if row is not None else empty_rollup()
+                update(rollup, row_id)
+                if name is None and row is not None:
+                    name = row[0]
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO profiles (student_id, name, rollup) VALUES (?, ?, ?)",
+                    (student_id, name, json.dumps(rollup))
+                )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return row_id
+
+    def set_name(self, student_id: str, name: str):
+        """Set the display name of a student"""
+        self._write(student_id, None, (), lambda rollup, row_id: None, name)
+
+    def record_essay(self, student_id: str, topic: str, band_score: float, components: Dict[str, Any],
+                     component_scores: Optional[Dict[str, float]] = None, timestamp: float = None) -> int:
+        """
+        Store an essay and fold it into the student's rollup.
+
+        Args:
+            student_id: The student
+            topic: Essay topic
+            band_score: Overall band score
+            components: Toulmin components of the essay
+            component_scores: Optional band score of each component
+            timestamp: Time of writing, defaults to now
+
+        Returns:
+            The essay id
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+
+        def update(rollup, essay_id):
+            rollup['essay_count'] += 1
+            rollup['band_sum'] += band_score
+            for component_type, score in (component_scores or {}).items():
+                entry = rollup['components'].setdefault(component_type.lower(), [0.0, 0])
+                entry[0] += score
+                entry[1] += 1
+            _add_progress(rollup, timestamp, band_score)
+            for component in components.values():
+                _add_style(rollup, _component_text(component))
+            rollup['recent_essays'] = ([{
+                'id': f"essay_{essay_id}",
+                'topic': topic,
+                'bandScore': band_score,
+                'date': _day(timestamp),
+                'components': components
+            }] + rollup['recent_essays'])[:RECENT_ESSAYS]
+
+        return self._write(
+            student_id,
+            "INSERT INTO essays (student_id, topic, band_score, components, created_at) VALUES (?, ?, ?, ?, ?)",
+            (student_id, topic, float(band_score), json.dumps(components), timestamp),
+            update
+        )
+
+    def record_submission(self, student_id: str, exercise_id: str, component_type: str, difficulty: str,
+                          answer: str, score: float, timestamp: float = None) -> int:
+        """
+        Store a scored exercise submission and fold it into the student's rollup.
+
+        Returns:
+            The submission id
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        component_type = component_type.lower()
+
+        def update(rollup, submission_id):
+            rollup['submission_count'] += 1
+            entry = rollup['components'].setdefault(component_type, [0.0, 0])
+            entry[0] += score
+            entry[1] += 1
+            _add_progress(rollup, timestamp, score)
+            _add_style(rollup, answer)
+
+        return self._write(
+            student_id,
+            "INSERT INTO submissions (student_id, exercise_id, component_type, difficulty, answer, score, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (student_id, exercise_id, component_type, difficulty, answer, float(score), timestamp),
+            update
+        )
+
+    def record_attempt(self, student_id: str, exercise_id: str, correct: bool, timestamp: float = None) -> int:
+        """
+        Store an attempt at an item and fold it into the student's rollup.
+
+        Returns:
+            The attempt id
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+
+        def update(rollup, attempt_id):
+            rollup['attempt_count'] += 1
+            rollup['attempt_correct'] += int(bool(correct))
+
+        return self._write(
+            student_id,
+            "INSERT INTO attempts (student_id, exercise_id, correct, created_at) VALUES (?, ?, ?, ?)",
+            (student_id, exercise_id, int(bool(correct)), timestamp),
+            update
+        )
+
+    def get_rollup(self, student_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Read the rollup of a student with one primary-key lookup.
+
+        Returns:
+            Dictionary with 'name' and the rollup fields, None for unknown students
+        """
+        row = self._reader().execute(
+            "SELECT name, rollup FROM profiles WHERE student_id = ?", (student_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(json.loads(row[1]), name=row[0])
+
+    def list_essays(self, student_id: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        """Page through a student's full essay history, newest first"""
+        rows = self._reader().execute(
+            "SELECT id, topic, band_score, components, created_at FROM essays WHERE student_id = ? "
+            "ORDER BY created_at DESC LIMIT ? OFFSET ?", (student_id, limit, offset)
+        ).fetchall()
+        return [
+            {'id': f"essay_{row[0]}", 'topic': row[1], 'bandScore': row[2],
+             'components': json.loads(row[3]), 'date': _day(row[4])}
+            for row in rows
+        ]
+
+
+STUDENT_RECORDS_PATH = "models/saved/students.db"
+
+_records: Optional[StudentRecordStore] = None
+_records_lock = threading.Lock()
+
+
+def get_student_records() -> StudentRecordStore:
+    """Return the process-wide StudentRecordStore, creating it on first use."""
+    global _records
+    if _records is None:
+        with _records_lock:
+            if _records is None:
+                _records = StudentRecordStore(STUDENT_RECORDS_PATH)
+    return _records